@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""Run the cleaner with two write out modes on the same WARC files and diff their TEI output
+
+It is used to check that the eltedh-lxml engine produces the same TEI as the eltedh (BeautifulSoup) engine. Both modes
+ are run through the command line interface with human-friendly output (-O True), the XML files of the same name are
+ compared in a normalized form: one line for each element (name and sorted attributes) and each text, where the
+ whitespace in the texts is collapsed into one space (a lost or an extra word break is a difference) and the timestamps
+ of the run are masked.
+"""
+
+import os
+import re
+import sys
+from argparse import ArgumentParser
+from difflib import unified_diff
+from subprocess import run, DEVNULL
+from os.path import join as os_path_join, abspath as os_path_abspath, relpath as os_path_relpath
+from shutil import rmtree
+
+from lxml import etree
+
+from synthetic_warc import add_generator_args, generator_params_from_args, generate_synthetic_warc
+
+# The timestamps of the run (datetime.today().isoformat()) which differ between the runs
+RUN_TIMESTAMP = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalized_tei(xml_bytes, ignore_whitespace=False):
+    """The lines of the normalized form of the TEI XML (see the description of the module)
+        With ignore_whitespace the whitespace is removed from the texts instead of collapsing it: only for comparing
+         the output of prettify (which writes every string into a separate line) with the output of other serializers
+    """
+    lines = []
+    for event, element in etree.iterwalk(etree.fromstring(xml_bytes), events=('start', 'end')):
+        if event == 'start':
+            attrs = ' '.join(f'{k}="{RUN_TIMESTAMP.sub("TIMESTAMP", v)}"' for k, v in sorted(element.attrib.items()))
+            lines.append(f'<{element.tag}{" " if len(attrs) > 0 else ""}{attrs}>')
+            text = element.text
+        else:
+            lines.append(f'</{element.tag}>')
+            text = element.tail
+        if text is not None:
+            text = RUN_TIMESTAMP.sub('TIMESTAMP', WHITESPACE.sub('' if ignore_whitespace else ' ', text))
+            if len(text) > 0:
+                lines.append(text)
+    return lines
+
+
+def xml_files(output_dir):
+    """The relative paths of the XML files in output_dir"""
+    return {os_path_relpath(os_path_join(dirpath, filename), output_dir)
+            for dirpath, _, filenames in os.walk(output_dir) for filename in filenames if filename.endswith('.xml')}
+
+
+def diff_output_dirs(output_dir_a, output_dir_b, mode_a='a', mode_b='b'):
+    """Compare the XML files of the two output directories and return the statistics and the diffs by filename"""
+    files_a, files_b = xml_files(output_dir_a), xml_files(output_dir_b)
+    diffs = {}
+    for filename in sorted(files_a & files_b):
+        with open(os_path_join(output_dir_a, filename), 'rb') as fh_a, \
+                open(os_path_join(output_dir_b, filename), 'rb') as fh_b:
+            lines_a, lines_b = normalized_tei(fh_a.read()), normalized_tei(fh_b.read())
+        if lines_a != lines_b:
+            diffs[filename] = list(unified_diff(lines_a, lines_b, f'{mode_a}/{filename}', f'{mode_b}/{filename}',
+                                                lineterm=''))
+    stats = {'files': len(files_a | files_b), 'same': len(files_a & files_b) - len(diffs), 'different': len(diffs),
+             f'only_{mode_a}': sorted(files_a - files_b), f'only_{mode_b}': sorted(files_b - files_a)}
+    return stats, diffs
+
+
+def run_cleaner(write_out_mode, input_config, configs_dir, warc_dir, run_dir, extra_args=()):
+    """Run the cleaner through the command line interface into run_dir/out (the logs go into run_dir/log)"""
+    rmtree(run_dir, ignore_errors=True)
+    log_dir, output_dir = os_path_join(run_dir, 'log'), os_path_join(run_dir, 'out')
+    os.makedirs(log_dir)
+    os.makedirs(output_dir)
+    cmd = [sys.executable, '-m', 'html2tei', 'cleaner', '-i', input_config, '-c', configs_dir, '-l', log_dir,
+           '-w', warc_dir, '-o', output_dir, '-L', 'WARNING', '-m', write_out_mode, '-O', 'True', *extra_args]
+    with open(os_path_join(run_dir, 'stdout_stderr.txt'), 'wb') as log_fh:
+        returncode = run(cmd, stdin=DEVNULL, stdout=log_fh, stderr=log_fh).returncode
+    if returncode != 0:
+        raise RuntimeError(f'The cleaner exited with {returncode} (see {run_dir}/stdout_stderr.txt)!')
+    return output_dir
+
+
+def diff_write_out_modes(work_dir, input_config, configs_dir, warc_dir, mode_a='eltedh', mode_b='eltedh-lxml',
+                         extra_args=()):
+    """Run the cleaner with both write out modes into work_dir and compare the outputs (see diff_output_dirs)"""
+    output_dirs = [run_cleaner(mode, input_config, configs_dir, warc_dir, os_path_join(work_dir, mode), extra_args)
+                   for mode in (mode_a, mode_b)]
+    return diff_output_dirs(*output_dirs, mode_a, mode_b)
+
+
+def parse_args():
+    parser = add_generator_args(ArgumentParser(description=__doc__.split('\n', 2)[1]))
+    parser.add_argument('-i', '--input-config', type=str, default=None,
+                        help='The YAML file of the WARC files to process (WARC filename: portal name). By default,'
+                             ' a synthetic WARC is generated for the portal', metavar='FILE.yaml')
+    parser.add_argument('-w', '--warc-dir', type=str, default=None,
+                        help='The directory of the WARC files in the input config', metavar='DIR')
+    parser.add_argument('-W', '--work-dir', type=str, default='diff_work',
+                        help='The directory for the outputs of the modes (default: diff_work)', metavar='DIR')
+    parser.add_argument('--modes', type=str, nargs=2, default=('eltedh', 'eltedh-lxml'),
+                        help='The two write out modes to compare (default: eltedh eltedh-lxml)',
+                        metavar='WRITE_OUT_MODE')
+    parser.add_argument('--max-diffs', type=int, default=10,
+                        help='The number of different files to print the diff of (default: 10)', metavar='N')
+    parser.add_argument('extra_args', nargs='*', metavar='-- EXTRA_ARGS',
+                        help='Extra arguments for the cleaner (e.g. -- --processes 4)')
+    return parser
+
+
+def main():
+    args = vars(parse_args().parse_args())
+    work_dir = os_path_abspath(args['work_dir'])
+    configs_dir = os_path_abspath(args['configs_dir'])
+    input_config, warc_dir = args['input_config'], args['warc_dir']
+    if input_config is None:
+        warc_dir = os_path_join(work_dir, 'warc')
+        os.makedirs(warc_dir, exist_ok=True)
+        warc_name = f'{args["portal"]}_synthetic.warc.gz'
+        generate_synthetic_warc(os_path_join(warc_dir, warc_name), **generator_params_from_args(args))
+        input_config = os_path_join(work_dir, 'input.yaml')
+        with open(input_config, 'w', encoding='UTF-8') as fh:
+            print(f'{warc_name}: {args["portal"]}', file=fh)
+    elif warc_dir is None:
+        print('The WARC directory (-w) must be given with the input config!', file=sys.stderr)
+        exit(2)
+
+    mode_a, mode_b = args['modes']
+    stats, diffs = diff_write_out_modes(work_dir, os_path_abspath(input_config), configs_dir,
+                                        os_path_abspath(warc_dir), mode_a, mode_b, args['extra_args'])
+    for filename in list(diffs.keys())[:args['max_diffs']]:
+        print('\n'.join(diffs[filename]))
+    print(*(f'{k}={len(v) if isinstance(v, list) else v}' for k, v in stats.items()), file=sys.stderr)
+    if stats['different'] > 0 or len(stats[f'only_{mode_a}']) > 0 or len(stats[f'only_{mode_b}']) > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""Run the modes of HTML2TEI on a synthetic WARC and measure their throughput and peak memory usage
+
+Every mode is run through the command line interface in a separate process, the results (pages/s, MB/s, peak RSS)
+ are written to a JSON file to be able to compare releases. Measuring the peak RSS needs os.wait4 (Unix only).
+"""
+
+import os
+import sys
+import json
+import platform
+from argparse import ArgumentParser
+from time import perf_counter
+from subprocess import Popen, DEVNULL
+from datetime import datetime, timezone
+from os.path import join as os_path_join, abspath as os_path_abspath, getsize as os_path_getsize, \
+    isfile as os_path_isfile
+from shutil import copyfile, rmtree
+
+from synthetic_warc import add_generator_args, generator_params_from_args, generate_synthetic_warc
+
+from html2tei import WRITE_OUT_MODES
+from html2tei.version import __version__
+
+MODES = ('cleaner', 'inventory-maker', 'bigram-maker', 'content-tree', 'diff-tables')
+
+
+def run_and_measure(cmd, log_filename):
+    """Run the command and return the exit code, the wall-clock time in seconds and the peak RSS in MB
+        (the largest of the process and its worker processes)
+    """
+    with open(log_filename, 'wb') as log_fh:
+        start = perf_counter()
+        proc = Popen(cmd, stdin=DEVNULL, stdout=log_fh, stderr=log_fh)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = perf_counter() - start
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    peak_rss_mb = rusage.ru_maxrss / 1024  # KB on Linux
+    if sys.platform == 'darwin':
+        peak_rss_mb /= 1024  # Bytes on macOS
+    return proc.returncode, seconds, peak_rss_mb
+
+
+def html2tei_cmd(mode, input_config, configs_dir, log_dir, warc_dir, output_dir, extra_args):
+    return [sys.executable, '-m', 'html2tei', mode, '-i', input_config, '-c', configs_dir, '-l', log_dir,
+            '-w', warc_dir, '-o', output_dir, '-L', 'WARNING', *extra_args]
+
+
+def benchmark_tasks(modes, write_out_modes, output_debug, extra_args):
+    """Yield the name of the mode, the write out mode (for the cleaner) and the extra arguments of the runs"""
+    for mode in modes:
+        if mode == 'cleaner':
+            for write_out_mode in write_out_modes:
+                yield mode, write_out_mode, ['-m', write_out_mode, '-O', str(output_debug), *extra_args]
+        elif mode == 'diff-tables':
+            yield mode, None, []
+        else:
+            yield mode, None, extra_args
+
+
+def run_benchmarks(work_dir, configs_dir, portal_name, generator_params, modes=MODES, write_out_modes=WRITE_OUT_MODES,
+                   repeat=1, output_debug=True, extra_args=()):
+    """Generate the synthetic WARC into work_dir and run each mode repeat times on it
+        (diff-tables uses the tag table created by inventory-maker)
+    """
+    warc_dir = os_path_join(work_dir, 'warc')
+    os.makedirs(warc_dir, exist_ok=True)
+    warc_name = f'{portal_name}_synthetic.warc.gz'
+    warc_filename = os_path_join(warc_dir, warc_name)
+    warc_stats = generate_synthetic_warc(warc_filename, **generator_params)
+    warc_stats['warc_bytes'] = os_path_getsize(warc_filename)
+    input_config = os_path_join(work_dir, 'input.yaml')
+    with open(input_config, 'w', encoding='UTF-8') as fh:
+        print(f'{warc_name}: {portal_name}', file=fh)
+    payload_mb = warc_stats['payload_bytes'] / 2 ** 20
+
+    results = []
+    for mode, write_out_mode, args in benchmark_tasks(modes, write_out_modes, output_debug, extra_args):
+        run_name = mode if write_out_mode is None else f'{mode}_{write_out_mode}'
+        for repeat_num in range(repeat):
+            run_dir = os_path_join(work_dir, run_name)
+            rmtree(run_dir, ignore_errors=True)
+            log_dir, output_dir = os_path_join(run_dir, 'log'), os_path_join(run_dir, 'out')
+            os.makedirs(log_dir)
+            os.makedirs(output_dir)
+            pages = warc_stats['pages']
+            if mode == 'diff-tables':
+                # The table created by inventory-maker is compared to itself (all rows are traversed)
+                new_table = os_path_join(work_dir, 'inventory-maker', 'out', f'{portal_name}_text_tags_normal.tsv')
+                if not os_path_isfile(new_table):
+                    print(f'Skipping {run_name}: the table to compare does not exist (run inventory-maker before)!',
+                          file=sys.stderr)
+                    break
+                copyfile(new_table, os_path_join(output_dir, 'old.tsv'))
+                copyfile(new_table, os_path_join(output_dir, 'new.tsv'))
+                with open(new_table, encoding='UTF-8') as fh:
+                    pages = None  # The number of table rows is measured instead of pages
+                    rows = sum(1 for _ in fh) - 1
+                cmd = [sys.executable, '-m', 'html2tei', 'diff-tables', '--diff-dir', output_dir,
+                       '--old-filename', 'old.tsv', '--new-filename', 'new.tsv', '--merge-filename', 'merged.tsv']
+            else:
+                rows = None
+                cmd = html2tei_cmd(mode, input_config, configs_dir, log_dir, warc_dir, output_dir, args)
+            returncode, seconds, peak_rss_mb = run_and_measure(cmd, os_path_join(run_dir, 'stdout_stderr.txt'))
+            result = {'mode': mode, 'write_out_mode': write_out_mode, 'repeat': repeat_num, 'returncode': returncode,
+                      'seconds': seconds, 'peak_rss_megabytes': peak_rss_mb}
+            if pages is not None:
+                result['pages_per_second'] = pages / seconds
+                result['megabytes_per_second'] = payload_mb / seconds
+            else:
+                result['rows_per_second'] = rows / seconds
+            results.append(result)
+            print(run_name, *(f'{k}={v:.2f}' for k, v in result.items() if isinstance(v, float)),
+                  'OK' if returncode == 0 else f'FAILED ({returncode})', file=sys.stderr)
+
+    return {'html2tei_version': __version__, 'python_version': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'date': datetime.now(timezone.utc).isoformat(), 'portal': portal_name,
+            'generator_params': generator_params, 'warc_stats': warc_stats, 'results': results}
+
+
+def str2bool(v):
+    return v.lower() in ('yes', 'true', 't', 'y', '1')
+
+
+def parse_args():
+    parser = add_generator_args(ArgumentParser(description=__doc__.split('\n', 2)[1]))
+    parser.add_argument('-o', '--output', type=str, default='benchmark_results.json',
+                        help='The JSON file to write the results into (default: benchmark_results.json)',
+                        metavar='FILE.json')
+    parser.add_argument('-W', '--work-dir', type=str, default='benchmark_work',
+                        help='The directory for the synthetic WARC and the outputs (default: benchmark_work)',
+                        metavar='DIR')
+    parser.add_argument('--modes', type=str, nargs='+', choices=MODES, default=MODES,
+                        help='The modes to run (default: all)', metavar='MODE')
+    parser.add_argument('--write-out-modes', type=str, nargs='+', choices=WRITE_OUT_MODES.keys(),
+                        default=list(WRITE_OUT_MODES.keys()),
+                        help='The write out modes to run the cleaner with (default: all)', metavar='WRITE_OUT_MODE')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='Run each mode N times (default: 1)',
+                        metavar='N')
+    parser.add_argument('-O', '--output-debug', type=str2bool, default=True,
+                        help='Run the cleaner with output_debug (no validation, which needs the TEI schema from the'
+                             ' network) (default: True)', metavar='True/False')
+    parser.add_argument('extra_args', nargs='*', metavar='-- EXTRA_ARGS',
+                        help='Extra arguments for the modes (e.g. -- --processes 4)')
+    return parser
+
+
+def main():
+    args = vars(parse_args().parse_args())
+    work_dir = os_path_abspath(args['work_dir'])
+    configs_dir = os_path_abspath(args['configs_dir'])
+    res = run_benchmarks(work_dir, configs_dir, args['portal'], generator_params_from_args(args), args['modes'],
+                         args['write_out_modes'], args['repeat'], args['output_debug'], args['extra_args'])
+    with open(args['output'], 'w', encoding='UTF-8') as fh:
+        json.dump(res, fh, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    main()
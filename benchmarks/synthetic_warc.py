@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""Generate deterministic synthetic WARC files for benchmarking
+
+The generated pages mimic the layout of the news portals (metadata in the head, headline, article body in the article
+ root of the portal, pagination for multi-page articles). The metadata layout follows the p444 portal config, the URL
+ prefix and the article root are taken from the portal config given.
+"""
+
+from io import BytesIO
+from random import Random
+from math import log as math_log
+from argparse import ArgumentParser
+from os.path import join as os_path_join
+from datetime import datetime, timedelta, timezone
+
+from warcio.warcwriter import WARCWriter
+from warcio.statusandheaders import StatusAndHeaders
+
+from html2tei.workflow_helpers.read_config import import_python_file
+
+WORDS = ('alma', 'körte', 'szilva', 'barack', 'eper', 'málna', 'dinnye', 'szőlő', 'citrom', 'narancs', 'kormány',
+         'város', 'ügy', 'évben', 'szerint', 'például', 'hogy', 'és', 'egy', 'az', 'nem', 'volt', 'Budapest', 'őszi')
+INLINE_TAGS = ('strong', 'em', 'i', 'b', 'span', 'mark', 'sup')
+BLOCK_TAGS = ('p', 'p', 'p', 'div', 'div class="row"', 'blockquote', 'h2', 'h3', 'section', 'center',
+              'p class="MsoNormal"', 'div class="jeti-html"', 'div style="text-align: center"')
+START_DATE = datetime(2021, 2, 3, 4, 5, 6, tzinfo=timezone.utc)
+
+
+class SyntheticPageGenerator:
+    """Generate random HTML pages of news articles with a seeded random generator
+        (the same parameters and seed yields the same pages)
+    """
+    def __init__(self, seed, dom_depth, article_root):
+        self._rnd = Random(seed)
+        self._dom_depth = dom_depth
+        tagname, attrs = article_root
+        self._article_root_start = ' '.join([tagname] + [f'{k}="{v}"' for k, v in attrs.items()])
+        self._article_root_end = tagname
+
+    def words(self, min_num=1, max_num=12):
+        return ' '.join(self._rnd.choice(WORDS) for _ in range(self._rnd.randint(min_num, max_num)))
+
+    def inline(self, depth):
+        """Text with inline formatting and links"""
+        rnd = self._rnd
+        elems = []
+        for _ in range(rnd.randint(1, 4)):
+            r = rnd.random()
+            if depth <= 0 or r < 0.5:
+                elems.append(self.words())
+            elif r < 0.8:
+                tagname = rnd.choice(INLINE_TAGS)
+                elems.append(f'<{tagname}>{self.inline(depth - 1)}</{tagname}>')
+            elif r < 0.9:
+                elems.append(f'<a href="/{rnd.randint(2010, 2021)}/{rnd.randint(1, 12):02d}/{self.slug()}"'
+                             f' target="_blank">{self.inline(depth - 1)}</a>')
+            elif r < 0.95:
+                elems.append('<br>')
+            else:
+                elems.append('<!-- ad -->')
+        return ' '.join(elems)
+
+    def block(self, depth):
+        """A block element with random nesting at most depth deep"""
+        rnd = self._rnd
+        r = rnd.random()
+        if depth <= 1 or r < 0.5:
+            tag = rnd.choice(BLOCK_TAGS)
+            return f'<{tag}>{self.inline(depth - 1)}</{tag.split()[0]}>'
+        elif r < 0.6:
+            tagname = rnd.choice(('ul', 'ol'))
+            items = ''.join(f'<li>{self.inline(depth - 2)}</li>' for _ in range(rnd.randint(1, 5)))
+            return f'<{tagname}>{items}</{tagname}>'
+        elif r < 0.67:
+            rows = ''.join('<tr>' + ''.join(f'<td>{self.words(1, 3)}</td>' for _ in range(rnd.randint(1, 4))) +
+                           '</tr>' for _ in range(rnd.randint(1, 5)))
+            return f'<table><tbody>{rows}</tbody></table>'
+        elif r < 0.77:
+            caption = f'<figcaption>{self.words()}</figcaption>' if rnd.random() < 0.6 else ''
+            return f'<figure class="jeti-image"><img src="https://cdn.example.hu/{rnd.randint(1, 9999)}.jpg"' \
+                   f' alt="{self.words(1, 3)}">{caption}</figure>'
+        elif r < 0.8:
+            return f'<blockquote class="twitter-tweet" lang="hu"><p>{self.words()}</p></blockquote>' \
+                   '<script async src="https://platform.twitter.com/widgets.js"></script>'
+        elif r < 0.82:
+            return f'<iframe src="https://www.youtube.com/embed/{rnd.randint(1, 99999)}"></iframe>'
+        else:
+            tag = rnd.choice(BLOCK_TAGS[3:])
+            children = ''.join(self.block(depth - 1) for _ in range(rnd.randint(1, 3)))
+            return f'<{tag}>{children}</{tag.split()[0]}>'
+
+    def body(self, page_size):
+        """Generate blocks until the desired size (in bytes) is reached"""
+        blocks = []
+        size = 0
+        while size < page_size:
+            block = self.block(self._rnd.randint(1, self._dom_depth))
+            blocks.append(block)
+            size += len(block.encode('UTF-8'))
+        return ''.join(blocks)
+
+    def slug(self):
+        return '-'.join(self.words(2, 6).split())
+
+    def page(self, title, date_published, page_size, next_url=None):
+        """A whole HTML page of an article"""
+        pagination = ''
+        if next_url is not None:
+            pagination = f'<ul class="pagination"><li class="arrow"><a href="{next_url}">Következő oldal</a></li></ul>'
+        authors = ''.join(f'<a href="/author/{self._rnd.randint(1, 50)}">{self.words(2, 2)}</a>'
+                          for _ in range(self._rnd.randint(1, 2)))
+        date_str = date_published.strftime('%Y-%m-%dT%H:%M:%S+02:00')
+        return f'<!DOCTYPE html>\n<html lang="hu"><head><meta charset="UTF-8"><title>{title}</title>' \
+               f'<meta property="article:published_time" content="{date_str}">' \
+               f'<meta property="article:modified_time" content="{date_str}">' \
+               f'<meta name="description" content="{self.words()}">' \
+               f'<meta name="keywords" content="{",".join(self.words(1, 5).split())}"></head>' \
+               f'<body><header><nav><a href="/">Címlap</a></nav></header>' \
+               f'<div id="headline"><h1>{title}</h1><div class="byline__authors">{authors}</div>' \
+               f'<span class="byline__category">{self.words(1, 1)}</span></div>' \
+               f'<{self._article_root_start}>{self.body(page_size)}</{self._article_root_end}>{pagination}' \
+               f'<footer>{self.words()}</footer></body></html>'
+
+    def page_size(self, mu, sigma):
+        return int(self._rnd.lognormvariate(mu, sigma))
+
+    def num_of_pages(self, multipage_ratio, max_pages):
+        if self._rnd.random() < multipage_ratio:
+            return self._rnd.randint(2, max_pages)
+        return 1
+
+
+def read_portal_params(configs_dir, portal_name):
+    """Read the URL prefix and the article root from the portal-specific config"""
+    portal_spec_module = import_python_file(os_path_join(configs_dir, portal_name, f'{portal_name}_specific.py'))
+    portal_url_prefix = getattr(portal_spec_module, 'PORTAL_URL_PREFIX', 'https://dummy.hu')
+    article_root_params = getattr(portal_spec_module, 'ARTICLE_ROOT_PARAMS_SPEC', [])
+    if len(article_root_params) > 0:
+        (tagname, *_), attrs = article_root_params[0]
+        attrs = {k: v for k, v in attrs.items() if isinstance(v, str)}
+        article_root = (tagname, attrs)
+    else:
+        article_root = ('main', {})
+    return portal_url_prefix.rstrip('/'), article_root
+
+
+def write_record(writer, url, rec_type, payload, http_headers, record_num, date):
+    """Write one record with deterministic WARC headers (Record-ID and Date are random and current time by default)"""
+    warc_headers_dict = {'WARC-Record-ID': f'<urn:uuid:00000000-0000-4000-8000-{record_num:012d}>',
+                         'WARC-Date': date.strftime('%Y-%m-%dT%H:%M:%SZ')}
+    if rec_type == 'response':
+        warc_headers_dict['WARC-X-Detected-Encoding'] = 'UTF-8'
+    record = writer.create_warc_record(url, rec_type, payload=BytesIO(payload), http_headers=http_headers,
+                                       warc_headers_dict=warc_headers_dict)
+    writer.write_record(record)
+
+
+def generate_synthetic_warc(warc_filename, portal_url_prefix='https://444.hu', article_root=('main', {}),
+                            num_of_articles=1000, mean_page_kb=40, page_size_sigma=0.6, multipage_ratio=0.1,
+                            max_pages=5, dom_depth=6, seed=0):
+    """Write num_of_articles articles into warc_filename (gzipped WARC with request-response pairs)
+        The body size of the pages follows log-normal distribution with the mean_page_kb mean,
+        multipage_ratio of the articles have 2-max_pages pages, block elements are nested at most dom_depth deep.
+       Returns the statistics of the generated WARC
+    """
+    gen = SyntheticPageGenerator(seed, dom_depth, article_root)
+    mu = math_log(mean_page_kb * 1024) - page_size_sigma ** 2 / 2
+    stats = {'articles': 0, 'pages': 0, 'payload_bytes': 0}
+    with open(warc_filename, 'wb') as fh:
+        writer = WARCWriter(fh, gzip=True)
+        record_num = 0
+        write_record(writer, None, 'warcinfo', b'software: html2tei synthetic WARC generator\r\n', None, record_num,
+                     START_DATE)
+        for article_num in range(num_of_articles):
+            date_published = START_DATE - timedelta(hours=article_num)
+            base_url = f'{portal_url_prefix}/{date_published:%Y/%m/%d}/{gen.slug()}-{article_num}'
+            page_urls = [base_url] + [f'{base_url}?page={page_num}' for page_num in
+                                      range(2, gen.num_of_pages(multipage_ratio, max_pages) + 1)]
+            title = gen.words(3, 10).capitalize()
+            for page_num, page_url in enumerate(page_urls):
+                next_url = page_urls[page_num + 1] if page_num + 1 < len(page_urls) else None
+                html = gen.page(title, date_published, gen.page_size(mu, page_size_sigma), next_url).encode('UTF-8')
+                warc_date = START_DATE + timedelta(seconds=record_num)
+                record_num += 1
+                write_record(writer, page_url, 'request', b'',
+                             StatusAndHeaders('GET / HTTP/1.1', [], is_http_request=True), record_num, warc_date)
+                record_num += 1
+                write_record(writer, page_url, 'response', html,
+                             StatusAndHeaders('200 OK', [('Content-Type', 'text/html; charset=UTF-8')],
+                                              protocol='HTTP/1.1'), record_num, warc_date)
+                stats['pages'] += 1
+                stats['payload_bytes'] += len(html)
+            stats['articles'] += 1
+    return stats
+
+
+def add_generator_args(parser):
+    """Add the parameters of the generator to the argument parser (also used by run_benchmarks.py)"""
+    parser.add_argument('-c', '--configs-dir', type=str, default='configs',
+                        help='The directory for portal-specific configs (default: configs)', metavar='DIR')
+    parser.add_argument('--portal', type=str, default='p444',
+                        help='The portal config to take the URL prefix and the article root from (default: p444)',
+                        metavar='PORTAL')
+    parser.add_argument('-n', '--num-of-articles', type=int, default=1000,
+                        help='The number of articles (default: 1000)', metavar='N')
+    parser.add_argument('--mean-page-kb', type=float, default=40,
+                        help='The mean of the size of the article bodies in KB (default: 40)', metavar='KB')
+    parser.add_argument('--page-size-sigma', type=float, default=0.6,
+                        help='The sigma of the log-normal page size distribution (default: 0.6)', metavar='SIGMA')
+    parser.add_argument('--multipage-ratio', type=float, default=0.1,
+                        help='The ratio of the multi-page articles (default: 0.1)', metavar='RATIO')
+    parser.add_argument('--max-pages', type=int, default=5,
+                        help='The maximal number of pages of multi-page articles (default: 5)', metavar='N')
+    parser.add_argument('--dom-depth', type=int, default=6,
+                        help='The maximal depth of nested block elements (default: 6)', metavar='N')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the random generator (default: 0)',
+                        metavar='N')
+    return parser
+
+
+def generator_params_from_args(args):
+    """Convert the parsed arguments to the parameters of generate_synthetic_warc"""
+    portal_url_prefix, article_root = read_portal_params(args['configs_dir'], args['portal'])
+    return {'portal_url_prefix': portal_url_prefix, 'article_root': article_root,
+            'num_of_articles': args['num_of_articles'], 'mean_page_kb': args['mean_page_kb'],
+            'page_size_sigma': args['page_size_sigma'], 'multipage_ratio': args['multipage_ratio'],
+            'max_pages': args['max_pages'], 'dom_depth': args['dom_depth'], 'seed': args['seed']}
+
+
+def main():
+    parser = ArgumentParser(description='Generate a deterministic synthetic WARC for benchmarking')
+    parser.add_argument('-o', '--output', type=str, help='The WARC file to write', metavar='FILE.warc.gz',
+                        required=True)
+    args = vars(add_generator_args(parser).parse_args())
+    stats = generate_synthetic_warc(args['output'], **generator_params_from_args(args))
+    print(*(f'{k}: {v}' for k, v in stats.items()), sep='\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -76,6 +76,10 @@ def get_meta_from_articles_spec(tei_logger, url, bs):
     return data
 
 
+# get_meta_from_articles_spec decomposes tags, so it needs its own copy of the parsed page
+GET_META_MUTATES_TREE_SPEC = True
+
+
 def excluded_tags_spec(tag):
     if tag.name not in HTML_BASICS:
         tag.name = 'else'
@@ -18,4 +18,5 @@ from .modes.portal_article_cleaner import init_portal as portal_article_cleaner_
 # For the low level API: defining custom modes
 from .workflow_helpers.validate_hash_zip import init_output_writer
 from .tei_utils import create_new_tag_with_string, immediate_text, to_friendly
-from .workflow_helpers.processing_utils import run_single_process, run_multiple_process, dummy_fun, process_article
+from .workflow_helpers.processing_utils import run_single_process, run_multiple_process, dummy_fun, process_article, \
+    run_multiple_process_read_in_workers, run_multiple_process_map_reduce
@@ -5,6 +5,9 @@ from argparse import ArgumentParser, ArgumentTypeError
 
 from .workflow_helpers.processing_utils import run_main
 from .workflow_helpers.read_config import WRITE_OUT_MODES
+from .workflow_helpers.tei_template import TEI_SERIALIZERS
+from .workflow_helpers.validate_hash_zip import DEFAULT_TEI_SCHEMA, OUTPUT_SINKS
+from .output_sinks.zip_sink import ZIP_COMPRESSIONS
 from .modes.update_and_filter_tables import diff_all_tag_table
 from .modes.tag_bigrams_maker import init_portal as tag_bigrams_init_portal
 from .modes.html_content_tree import init_portal as content_tree_init_portal
@@ -64,6 +67,25 @@ def entrypoint():
         p = subparsers.add_parser(cmd, help=help_text)
         for _, (args, kwargs) in common_params.items():
             p.add_argument(*args, **kwargs)
+        p.add_argument('-M', '--multipage-chains', type=str2bool, nargs='?', const=True, default=False,
+                       help='Create the index of the pages of multi-page articles in parallel before processing',
+                       metavar='True/False')
+        p.add_argument('--persist-multipage-chains', type=str2bool, nargs='?', const=True, default=False,
+                       help='Store the index of the pages of multi-page articles next to the WARC file'
+                            ' and reuse it in the later runs', metavar='True/False')
+        p.add_argument('--concurrent-portals', type=str2bool, nargs='?', const=True, default=False,
+                       help='Process the portals of the input config at once in one shared process pool'
+                            ' instead of one after another', metavar='True/False')
+        p.add_argument('--processes', type=int, default=None,
+                       help='The number of worker processes in the process pool (default: number of CPUs)',
+                       metavar='N')
+        p.add_argument('--max-megabytes-in-flight', type=int, default=512,
+                       help='The memory budget of the articles sent to the process pool but not yet written out. Lower'
+                            ' values mean smaller peak memory usage, higher values mean less overhead (default: 512)',
+                       metavar='MB')
+        p.add_argument('--max-chunks-per-portal', type=int, default=None,
+                       help='The maximal number of chunks of articles in flight for one portal in the shared process'
+                            ' pool (default: twice the number of processes)', metavar='N')
         spdict[cmd] = p
 
     spdict['cleaner'].add_argument('-m', '--write-out-mode', type=str, choices=WRITE_OUT_MODES.keys(), default='eltedh',
@@ -81,6 +103,62 @@ def entrypoint():
                                    help='Run processing in parallel or all operation must be used sequentially',
                                    metavar='True/False')
 
+    spdict['cleaner'].add_argument('-R', '--read-in-workers', type=str2bool, nargs='?', const=True, default=False,
+                                   help='The parallel workers read and decode the WARC records themselves instead of'
+                                        ' the main process (only the positions of the records are distributed)',
+                                   metavar='True/False')
+
+    spdict['cleaner'].add_argument('--resume', type=str2bool, nargs='?', const=True, default=False,
+                                   help='Resume an interrupted run: skip the articles already in the URL logs and'
+                                        ' the output (the new files go into a new output shard)',
+                                   metavar='True/False')
+
+    spdict['cleaner'].add_argument('--time-stages', type=str2bool, nargs='?', const=True, default=False,
+                                   help='Measure the wall time of the processing stages for each article and'
+                                        ' write a report into the log directory (PORTAL_stage_times.tsv)',
+                                   metavar='True/False')
+
+    spdict['cleaner'].add_argument('--count-stage-nodes', type=str2bool, nargs='?', const=True, default=False,
+                                   help='Count the tags after each processing stage as well with --time-stages'
+                                        ' (walks the whole tree at every stage)', metavar='True/False')
+
+    spdict['cleaner'].add_argument('--tei-serializer', type=str, choices=TEI_SERIALIZERS, default='prettify',
+                                   help='The serializer of the TEI XML output: prettify (the original output), compact'
+                                        ' or indent (faster, the same XML apart from the whitespace between the tags)',
+                                   metavar='SERIALIZER')
+
+    spdict['cleaner'].add_argument('--tei-schema', type=str, default=DEFAULT_TEI_SCHEMA,
+                                   help='The RelaxNG schema to validate the output with: URL (downloaded only at the'
+                                        ' first use into ~/.cache/html2tei/schemas) or local file (e.g. for offline'
+                                        ' use or a reduced schema of the project)', metavar='URL_OR_FILE')
+
+    spdict['cleaner'].add_argument('--output-sink', type=str, choices=OUTPUT_SINKS.keys(), default='zip',
+                                   help='The format of the output of the valid TEI XMLs: zip, jsonl (JSON Lines with'
+                                        ' the metadata), tar.zst or parquet (the last two need the zstandard and'
+                                        ' pyarrow packages)', metavar='SINK')
+
+    spdict['cleaner'].add_argument('--zip-compression', type=str, choices=ZIP_COMPRESSIONS.keys(), default='stored',
+                                   help='The compression of the files in the output zipfile (compressed by the parallel'
+                                        ' workers): stored (no compression), deflate, bzip2 or lzma',
+                                   metavar='METHOD')
+
+    spdict['cleaner'].add_argument('--zip-compresslevel', type=int, default=None,
+                                   help='The compression level (deflate: 0-9, bzip2: 1-9, default: the default of the'
+                                        ' method)', metavar='N')
+
+    spdict['cleaner'].add_argument('--max-shard-megabytes', type=int, default=None,
+                                   help='Start a new output shard (e.g. PORTAL_1.zip, PORTAL_2.zip, ...) when the'
+                                        ' current one reaches this size (default: no limit)', metavar='MB')
+
+    spdict['cleaner'].add_argument('--max-shard-members', type=int, default=None,
+                                   help='Start a new output shard when the current one contains this many'
+                                        ' files (default: no limit)', metavar='N')
+
+    spdict['cleaner'].add_argument('--max-shard-minutes', type=float, default=0,
+                                   help='Start a new output shard when the current one is open for this many minutes:'
+                                        ' the closed shards are the checkpoints of an interrupted run for --resume'
+                                        ' (default: 0, no limit)', metavar='MINUTES')
+
     spdict['cleaner'].add_argument('-d', '--with-specific-dicts', dest='w_specific_dicts', type=str2bool, nargs='?',
                                    const=True, default=True, help='Load portal-specific dictionaries (tables)',
                                    metavar='True/False')
@@ -93,14 +171,23 @@ def entrypoint():
                                            help='The name of the task to appear in the logs', metavar='TASK_NAME')
     spdict['inventory-maker'].add_argument('-r', '--recursive', type=str2bool, nargs='?', const=True, default=True,
                                            help='Use just direct descendants or all', metavar='True/False')
+    spdict['inventory-maker'].add_argument('-p', '--run-parallel', type=str2bool, nargs='?', const=True, default=True,
+                                           help='Run processing in parallel (map-reduce) or all operation must be used '
+                                                'sequentially', metavar='True/False')
 
     spdict['bigram-maker'].add_argument('-t', '--task-name', type=str, default='Tag Bigrams Maker',
                                         help='The name of the task to appear in the logs', metavar='TASK_NAME')
     spdict['bigram-maker'].add_argument('-r', '--recursive', type=str2bool, nargs='?', const=True, default=True,
                                         help='Use just direct descendants or all', metavar='True/False')
+    spdict['bigram-maker'].add_argument('-p', '--run-parallel', type=str2bool, nargs='?', const=True, default=True,
+                                        help='Run processing in parallel (map-reduce) or all operation must be used '
+                                             'sequentially', metavar='True/False')
 
     spdict['content-tree'].add_argument('-t', '--task-name', type=str, default='HTML Content Tree',
                                         help='The name of the task to appear in the logs', metavar='TASK_NAME')
+    spdict['content-tree'].add_argument('-p', '--run-parallel', type=str2bool, nargs='?', const=True, default=True,
+                                        help='Run processing in parallel (map-reduce) or all operation must be used '
+                                             'sequentially', metavar='True/False')
 
     # A totally different subparser
     p = subparsers.add_parser('diff-tables', help='Diff Tag Tables')
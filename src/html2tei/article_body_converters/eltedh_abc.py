@@ -2,36 +2,46 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*
 
 import copy
+from collections import defaultdict
+
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString, Tag, Comment
 
 from ..basic_tag_dicts import *
 from ..correctors.link_corrector import link_corrector
 from ..correctors.unicode_error import unicode_test, article_encoding_correction
-from ..tei_utils import immediate_text, imtext_children_descendants_of_tag, to_friendly, \
+from ..tei_utils import immediate_text, imtext_children_descendants_of_tag, to_friendly, SubtreeSummaries, \
     real_text_length, language_attr_recognition, complex_wrapping, normal_tag_to_tei_xml_converter, unwrap_all, \
-    decompose_all
+    TextLengths, MAIN_CONTENT_STRING_TYPES, PendingMutations, TagSignatureCache, raw_tag_key
+from ..workflow_helpers.stage_timing import stage_checkpoint, stage_count
 
 TABLE_CELL = {'oszlop', 'tablazat_cimsor'}
 
 BLOCKS_MINUS_CIMSOR = BLOCKS
 
 MEDIA_MINUS_FIG = {'social_media', 'abra', 'beagyazott_tartalom', 'beagyazott_social'}
-UNUSED_TAGS = {'unwrap', 'null', 'default'}
 TABLES_VALID = {'sor_valid', 'oszlop_sor', 'oszlop_valid'}
 PARAGRAPH_AND_INLINES = ({'bekezdes'} | INLINE_TAGS)
 
+# The dictionary forms of the tags for each excluded_tags_fun (kept in each process across articles and portals)
+TAG_SIGNATURE_CACHES = {}
+
 
-# Only process_article is used outside of this file
+# Only process_article and prepare_article_body are used outside of this file
 
 def process_article(article_page_tups, tei_logger, spec_get_meta_fun, spec_body_params):
     """It executes our own metadata extraction and text extraction, normalization,
         TEI to XML conversion method per URL"""
     (one_url, warc_response_datetime, warc_id, raw_html) = article_page_tups
+    # The page is parsed only once: get_meta reads the tree (or a snapshot of it if the portal-specific config
+    #  declares that it modifies the tree: GET_META_MUTATES_TREE_SPEC) and then the converter takes the ownership
+    #  (the line breaks of the article body are replaced with spaces there, see replace_line_breaks)
     bs = BeautifulSoup(raw_html, 'lxml')
+    stage_checkpoint('parse_html', bs)
     meta = spec_get_meta_fun(tei_logger, one_url, bs)
+    stage_checkpoint('get_meta')
     if meta is not None:
-        converted_body_list = article_body_converter(tei_logger, one_url, raw_html, spec_body_params)
+        converted_body_list = article_body_converter(tei_logger, one_url, bs, spec_body_params)
         return meta, converted_body_list
     else:
         return None, None
@@ -56,18 +66,36 @@ def correct_and_store_link(tag, link, portal_url_prefix, portal_url_filter, extr
         tag.attrs['target'] = link_original
 
 
-def tag_freezer(bs_tag, excluded_tags_fun, link_attrs):
+def tag_signature_cache(excluded_tags_fun):
+    cache = TAG_SIGNATURE_CACHES.get(excluded_tags_fun)
+    if cache is None:
+        cache = TagSignatureCache()
+        TAG_SIGNATURE_CACHES[excluded_tags_fun] = cache
+    return cache
+
+
+def tag_freezer(bs_tag, excluded_tags_fun, link_attrs, signature_cache):
     """This function produces the dictionary form of the current tag.
-       It simplifies the different parts of the attributes, with merging the irrelevant variations of values
+       It simplifies the different parts of the attributes, with merging the irrelevant variations of values.
+       The result and the name of the tag after simplification (which may rename it) are cached by the raw tag
     """
-    if bs_tag.name in link_attrs or language_attr_recognition(bs_tag) is not None:
+    preserve_attrs = bs_tag.name in link_attrs or language_attr_recognition(bs_tag) is not None
+    raw_key = raw_tag_key(bs_tag)
+    cached = signature_cache.get(raw_key)
+    if cached is not None:
+        tag_exl, bs_tag.name = cached
+        if not preserve_attrs:
+            bs_tag.attrs.clear()
+    elif preserve_attrs:
         # When it has attributes to be preserved, which were marked in the configuration
         f_attrs = copy.deepcopy(bs_tag.attrs)
         tag_exl = to_friendly(bs_tag, excluded_tags_fun)
         bs_tag.attrs = f_attrs
+        signature_cache.put(raw_key, (tag_exl, bs_tag.name))
     else:  # No attributes are preserved
         tag_exl = to_friendly(bs_tag, excluded_tags_fun)
         bs_tag.attrs.clear()
+        signature_cache.put(raw_key, (tag_exl, bs_tag.name))
     return tag_exl
 
 
@@ -89,7 +117,7 @@ def disambiguate_table_or_frame(article, article_url, tei_logger):
             tag.name = 'doboz'
 
 
-def rename_by_bigram_rules(article, change_by_bigram, article_url, tei_logger):
+def rename_by_bigram_rules(article, change_by_bigram, pending, article_url, tei_logger):
     """You can specify rules to combine two tag. The combined labels overrides the role of
         the participants or their combined meaning
        a) to_merge: Rename it, if the second member of bigram is the only child of the first member and they contain
@@ -101,10 +129,11 @@ def rename_by_bigram_rules(article, change_by_bigram, article_url, tei_logger):
         (this is the most permissive condition)
     """
     tei_logger.log('DEBUG', f'rename_by_bigram_rules in {article_url}')
+    summaries = SubtreeSummaries()
     for tag in reversed(article.find_all(change_by_bigram.keys())):
         # The structures (which could be recursive) can be handled safely from the inside out (hence reversed).
         #  Iterating from the outside to the inside crosses the boundaries of the levels
-        naked_text, child_tags, desc_tags = imtext_children_descendants_of_tag(tag)
+        naked_text, child_tags, desc_tags = summaries[tag]
         # The inner dictionary's key is a tuple of second_tag_part and case
         second_tags_of_bigram = {tup[0] for tup in change_by_bigram[tag.name].keys()}
         if len(desc_tags & second_tags_of_bigram) > 0:
@@ -114,8 +143,10 @@ def rename_by_bigram_rules(article, change_by_bigram, article_url, tei_logger):
                     # https://www.nnk.gov.hu/index.php/koronavirus-tajekoztato/660-munkasszallok-mukodesere-vonatkozo
                     # -kozegeszsegugyi-jarvanyugyi-szabalyok table tag under attachment has no mean
                     for c in tag.find_all(second_part_tag):
-                        c.name = child_level_name
-                    tag.name = parent_level_name
+                        summaries.changed(c)
+                        pending.rename(c, child_level_name)
+                    summaries.changed(tag)
+                    pending.rename(tag, parent_level_name)
                     break
                 elif second_part_tag in child_tags and \
                         (case == 'det_by_any_child' or
@@ -127,12 +158,14 @@ def rename_by_bigram_rules(article, change_by_bigram, article_url, tei_logger):
                     # -koronavirus-2019-ncov-okozta-jarvany-aktualis-helyzete-az-egeszsegugyi-vilagszervezet-2020
                     # -januar-27-i-helyzetjelentese-alapjan <p><img>... = caption
                     for c in tag.find_all(second_part_tag, recursive=False):
-                        c.name = child_level_name
-                    tag.name = parent_level_name
+                        summaries.changed(c)
+                        pending.rename(c, child_level_name)
+                    summaries.changed(tag)
+                    pending.rename(tag, parent_level_name)
                     break
 
 
-def block_specific_renaming(article, block_dict, article_url, tei_logger):
+def block_specific_renaming(article, block_dict, pending, article_url, tei_logger):
     """Within special ("block") structures, some members must be given a different name.
        Mainly because of TEI rules
     """
@@ -147,14 +180,14 @@ def block_specific_renaming(article, block_dict, article_url, tei_logger):
                 if descendant_tag.child_tagname in BLOCKS and descendant_tag.name != 'cimsor':
                     break  # It cannot step inside the root of another block, the rules can change there
                 elif child_tagname in block_dict[block_root_name]['rename'].keys():
-                    descendant_tag.name = block_dict[block_root_name]['rename'][child_tagname]
+                    pending.rename(descendant_tag, block_dict[block_root_name]['rename'][child_tagname])
     for head in article.find_all('cimsor'):
         for head_desc in head.find_all():
             if head_desc.name not in INLINE_TAGS:
                 head_desc.unwrap()
 
 
-def block_specific_curation_of_internal_structure(article, block_dict, article_url, tei_logger):
+def block_specific_curation_of_internal_structure(article, block_dict, pending, article_url, tei_logger):
     """In HTML, certain tags are often used inconsistently or levels are duplicated.
        This function sorts the structures when the special blocks (lead, report, frame, table, list, gallery, quiz)
         contain each other.
@@ -163,13 +196,12 @@ def block_specific_curation_of_internal_structure(article, block_dict, article_u
        At the same time the rules required by the TEI
     """
     tei_logger.log('DEBUG', f'rename_by_bigram_rules in {article_url}')
+    text_lengths = TextLengths(article)  # Unwrapping keeps the text of the remaining tags unchanged
     for tag in article.find_all(BLOCKS):
         tag_name = tag.name
-        tag_text = tag.text.strip()
         # Block in block
         for tag_descendant in tag.find_all(BLOCKS):
-            ch_text = tag_descendant.text.strip()
-            if tag_name == tag_descendant.name and tag_text == ch_text:
+            if tag_name == tag_descendant.name and same_stripped_text(text_lengths, tag, tag_descendant):
                 # Double root
                 tag_descendant.unwrap()
             else:
@@ -180,7 +212,19 @@ def block_specific_curation_of_internal_structure(article, block_dict, article_u
                     tag_descendant.unwrap()
                 elif tag_descendant.name in block_tag_rules_dict['not_valid_as_outer_for']:
                     # A table in a quote: https://www.magyaridok.hu/belfold/185128-185128/ <idezet><table_text>
-                    tag.name = 'to_unwrap'
+                    pending.unwrap(tag)
+
+
+def same_stripped_text(text_lengths, tag, descendant):
+    """The same as tag.text.strip() == descendant.text.strip() for a descendant of the tag without building the texts:
+        the text of the descendant is a part of the text of the tag, so they are the same apart from the surrounding
+        whitespace if and only if the rest of the text of the tag is whitespace, i.e. if they have the same number of
+        non-whitespace characters (unless the tags count different types of strings, e.g. a renamed script tag)
+    """
+    if tag.interesting_string_types != MAIN_CONTENT_STRING_TYPES or \
+            descendant.interesting_string_types != MAIN_CONTENT_STRING_TYPES:
+        return tag.text.strip() == descendant.text.strip()
+    return text_lengths[tag] == text_lengths[descendant]
 
 
 def block_structure(article, bs, block_dict, article_url, tei_logger):
@@ -244,52 +288,98 @@ def missing_root_replacement(bs, divname, rec, root_name, tab):
             one_row = False
 
 
-def deal_with_paragraphs(article, article_url, tei_logger):
+def deal_with_paragraphs(article, pending, article_url, tei_logger):
     """Paragraphs, and tags equivalent to paragraphs (according to the TEI schema) are often overused in HTML.
        The not_valid_in_p tags in the TEI can be encoded with both <p> with different attributes and therefore cannot
         contain each other.
        In these cases, it must be decided which levels can be omitted for the TEI to be valid
     """
     tei_logger.log('DEBUG', f'deal_with_paragraphs in {article_url}')
+    summaries = SubtreeSummaries()
     for p_tag in article.find_all('bekezdes'):
-        p_naked_text, p_child_tags, p_desc_tags = imtext_children_descendants_of_tag(p_tag)
+        p_naked_text, p_child_tags, p_desc_tags = summaries[p_tag]
         if len(p_child_tags & PARAGRAPH_LIKE_TAGS) > 0 or (not p_naked_text and len(p_child_tags & INLINE_TAGS) == 0):
             # If a paragraph contains a label that is not valid within a paragraph and it has a more special meaning
             #  or it has no text of its own and contains a higher-ranking tag, so this paragraph level is unnecessary
+            summaries.changed(p_tag)
             p_tag.unwrap()
         elif not p_naked_text and 'bekezdes' in p_desc_tags and p_desc_tags < PARAGRAPH_AND_INLINES \
-                and len(p_tag.find_all('bekezdes')) == 1:
-            p_tag.find('bekezdes').name = 'to_unwrap'
+                and summaries.descendant_count(p_tag, 'bekezdes') == 1:
+            inner_p_tag = p_tag.find('bekezdes')
+            summaries.changed(inner_p_tag)
+            pending.unwrap(inner_p_tag)
     # It can be handled safely with two separate iterations. The second checks the labels equivalent to the paragraphs
     #  for non-valid combinations
     for p_like_tag in article.find_all(PARAGRAPH_LIKE_TAGS):
-        plike_naked_text, plike_child_tags, plike_desc_tags = imtext_children_descendants_of_tag(p_like_tag)
+        plike_naked_text, plike_child_tags, plike_desc_tags = summaries[p_like_tag]
         if 'bekezdes' in plike_desc_tags and plike_desc_tags < PARAGRAPH_AND_INLINES \
-                and len(p_like_tag.find_all('bekezdes')) == 1:
-            p_like_tag.find('bekezdes').name = 'to_unwrap'
+                and summaries.descendant_count(p_like_tag, 'bekezdes') == 1:
+            inner_p_tag = p_like_tag.find('bekezdes')
+            summaries.changed(inner_p_tag)
+            pending.unwrap(inner_p_tag)
 
 
 def handling_unnecessary_wrappers(article, article_url, tei_logger):
     """This function:
         - Interprets the levels inherited from HTML
         - Finds which level is redundant, or can be omitted for a clear structure free of duplication
+       Each tag is visited a constant number of times (the tags are not searched again for every candidate):
+        - The formatting tags are indexed by name to unwrap all tags of a name without searching the article
+        - Unwrapping other tags does not change if a formatting tag is in another of the same name
+           or if a paragraph-like tag is under a link, so these are collected in one walk after the first loop
     """
     tei_logger.log('DEBUG', f'unnecessary_wrappers in {article_url}')
-    for a_tag in article.find_all(name=lambda x: x.name not in BLOCKS):
-        naked_text, child_tags, desc_tags = imtext_children_descendants_of_tag(a_tag)
-        if len(child_tags) == 1 and a_tag.name in child_tags:
-            if not naked_text and len(child_tags) > 0:  # Duplicated level
+    all_tags = article.find_all()
+    hi_tags_by_name = defaultdict(list)
+    for tag in all_tags:
+        if tag.name in HI_TAGS:
+            hi_tags_by_name[tag.name].append(tag)
+
+    for a_tag in all_tags:
+        # The unwrapped tags are left without children, so they are skipped here
+        if a_tag.name not in BLOCKS and {c.name for c in a_tag.contents if isinstance(c, Tag)} == {a_tag.name}:
+            if immediate_text(a_tag) == 0:  # Duplicated level
                 a_tag.unwrap()
-            elif naked_text and a_tag.name in HI_TAGS:  # Variation of duplicated level
-                unwrap_all(article, a_tag.name)
-    for i_tag in article.find_all(HI_TAGS):
-        i_tagname = i_tag.name
-        # Double formatting
-        in_naked_text, in_child_tags, in_desc_tags = imtext_children_descendants_of_tag(i_tag)
-        if i_tagname in in_desc_tags:
-            unwrap_all(article, i_tagname)
-    for ref in article.find_all('hivatkozas'):
-        unwrap_all(ref, PARAGRAPH_LIKE_TAGS)
+            elif a_tag.name in HI_TAGS:  # Variation of duplicated level
+                unwrap_all_indexed(hi_tags_by_name, a_tag.name)
+
+    nested_hi_tag_names, p_like_tags_in_refs = hi_tags_in_themselves_and_p_like_tags_in_refs(article)
+    for i_tagname in nested_hi_tag_names:  # Double formatting
+        unwrap_all_indexed(hi_tags_by_name, i_tagname)
+    for p_like_tag in p_like_tags_in_refs:
+        p_like_tag.unwrap()
+
+
+def unwrap_all_indexed(tags_by_name, tag_name):
+    """The same as unwrap_all(article, tag_name) for the tags indexed by name (the ones not unwrapped yet)"""
+    for tag in tags_by_name.pop(tag_name, ()):
+        if tag.parent is not None:
+            tag.unwrap()
+
+
+def hi_tags_in_themselves_and_p_like_tags_in_refs(article):
+    """Walk the article once (keeping count of the names of the open ancestors) and return
+        1. The names of the formatting tags which occur in a tag of the same name
+        2. The paragraph-like tags under links (hivatkozas)
+    """
+    nested_hi_tag_names = set()
+    p_like_tags_in_refs = []
+    open_tag_names = defaultdict(int)
+    stack = [c for c in reversed(article.contents) if isinstance(c, Tag)]
+    while len(stack) > 0:
+        tag = stack.pop()
+        if isinstance(tag, str):  # The name of the tag which is closed here
+            open_tag_names[tag] -= 1
+            continue
+        tag_name = tag.name
+        if tag_name in HI_TAGS and open_tag_names[tag_name] > 0:
+            nested_hi_tag_names.add(tag_name)
+        elif tag_name in PARAGRAPH_LIKE_TAGS and open_tag_names['hivatkozas'] > 0:
+            p_like_tags_in_refs.append(tag)
+        open_tag_names[tag_name] += 1
+        stack.append(tag_name)
+        stack.extend(c for c in reversed(tag.contents) if isinstance(c, Tag))
+    return nested_hi_tag_names, p_like_tags_in_refs
 
 
 def handling_paragraphs_and_formatting_hierarchy(article, bs, article_url, tei_logger):
@@ -298,12 +388,14 @@ def handling_paragraphs_and_formatting_hierarchy(article, bs, article_url, tei_l
     """
     # Example: formatting tag ('strong') upper than <p>:
     # https://vs.hu/kozelet/osszes/video-jarokelok-koze-hajtott-az-autos-melbourne-ben-harman-meghaltak-0121
+    summaries = SubtreeSummaries()
     for i_tag in reversed(article.find_all(HI_TAGS)):
         # The structures (which could be recursive) can be handled safely from the inside out (hence reversed).
         #  Iterating from the outside to the inside crosses the boundaries of the levels
-        in_naked_text, in_child_tags, in_desc_tags = imtext_children_descendants_of_tag(i_tag)
+        in_naked_text, in_child_tags, in_desc_tags = summaries[i_tag]
         p_like_child = PARAGRAPH_LIKE_TAGS & in_child_tags
         if len(p_like_child) == 1 and in_child_tags.difference(in_desc_tags) <= HI_TAGS:
+            summaries.changed(i_tag)  # Its children are rewrapped and it is unwrapped
             p_like_child_name = p_like_child.pop()
             for inlines_child in i_tag.find_all(p_like_child_name, recursive=False):
                 inlines_child.wrap(bs.new_tag(p_like_child_name))
@@ -369,21 +461,24 @@ def isempty_figures_and_galleries(article, article_url, tei_logger):
     """Images and galleries cannot always be downloaded in their entirety, so the code considers which blocks are
         worth preserving. ('clues' that contain neither a caption nor a link can be discarded)
     """
+    text_lengths = TextLengths(article)
+    empty_galleries = []
     for fig in article.find_all('media_tartalom'):
-        if len(fig.text.strip()) == 0 and len(fig.attrs) == 0:
-            fig.decompose()
+        if text_lengths[fig] == 0 and len(fig.attrs) == 0:
+            text_lengths.decompose(fig)
     for isempty_galeries in article.find_all('galeria'):
         if isempty_galeries.find('media_tartalom') is None:
-            if real_text_length(isempty_galeries) > 0:
+            if text_lengths[isempty_galeries] > 0:
                 tei_logger.log('DEBUG', f'{article_url}: GALLERY WITH CAPTION, BUT WITHOUT ANY FIGURES? '
                                         f'{isempty_galeries}')
-            isempty_galeries.name = 'to_decompose'
-    decompose_all(article, 'to_decompose')
+            empty_galleries.append(isempty_galeries)
+    for tag in empty_galleries:
+        text_lengths.decompose(tag)
     for social_figure in article.find_all(MEDIA_MINUS_FIG):
         ref_tags = [c.name for c in social_figure.find_all(lambda tag: tag.has_attr('target'))]
-        if real_text_length(social_figure) == 0 and len(ref_tags) == 0 and not social_figure.has_attr('target'):
+        if text_lengths[social_figure] == 0 and len(ref_tags) == 0 and not social_figure.has_attr('target'):
             tei_logger.log('DEBUG', f'{article_url}: EMPTY SOCIAL MEDIA CONTENT OR FIGURE {social_figure}')
-            social_figure.decompose()
+            text_lengths.decompose(social_figure)
 
 
 def correct_lists(bs, l_article, article_url, tei_logger):
@@ -462,54 +557,79 @@ def real_lead_general_test(bs_article, article_url, tei_logger):
 
 
 def normal_tag_names_by_dict_new(article, bs, excluded_tags_fun, tag_normal_dict, link_attrs, url_prefix,
-                                 portal_url_filter, article_url, tei_logger):
+                                 portal_url_filter, pending, article_url, tei_logger):
     """This function generates the dictionary form of the tags, retrieves its normalized name from the dictionary,
         and then performs the renaming and other specific operations accordingly
     """
+    text_lengths = TextLengths(article)  # Renaming, wrapping and unwrapping keep the text of the tags unchanged
+    signature_cache = tag_signature_cache(excluded_tags_fun)
+    hits_before, misses_before = signature_cache.hits, signature_cache.misses
     for tag in article.find_all():
-        tag_exl = tag_freezer(tag, excluded_tags_fun, link_attrs)
-        if tag_exl in tag_normal_dict.keys():
-            # Look up the normalised name for the tag and return it with the attributes to be retained if there are any
-            normalized_name, extra_key = tag_normal_dict[tag_exl].split('\t', maxsplit=2)
-            if normalized_name in UNUSED_TAGS:
-                tag.name = 'to_unwrap'
-            elif normalized_name in BLOCKS or normalized_name == 'szakasz':
+        tag_exl = tag_freezer(tag, excluded_tags_fun, link_attrs, signature_cache)
+        tag_action = tag_normal_dict.get(tag_exl)
+        if tag_action is not None:
+            # The action compiled from the normalised name of the tag (see compile_tag_normal_table) with
+            #  the attributes to be retained if there are any
+            action, normalized_name, outer_level, extra_key = tag_action
+            if action == 'unwrap':
+                pending.unwrap(tag)
+            elif action == 'block':
                 tag.name = normalized_name
                 tag.attrs.clear()
-            elif normalized_name == 'decompose':
-                tag.name = 'to_decompose'
-            elif ';' in normalized_name:
-                inner_level, outer_level = normalized_name.split(';', maxsplit=1)
-                tag.wrap(bs.new_tag(outer_level))
+            elif action == 'decompose':
+                pending.decompose(tag)
+            elif action == 'wrap':
+                tag.wrap(pending.track(bs.new_tag(outer_level)))
                 tag.attrs.clear()
-                tag.name = inner_level
-            else:
-                tag.name = normalized_name
+                pending.rename(tag, normalized_name)
+            else:  # rename
+                pending.rename(tag, normalized_name)
                 if len(tag.attrs) != 0:
                     select_attributes_to_preserve(tag, extra_key, article_url, tei_logger)
                     if 'target' in tag.attrs.keys():
                         href = tag.attrs['target']
                         correct_and_store_link(tag, href, url_prefix, portal_url_filter, extra_key, article_url)
                         if normalized_name == 'media_hivatkozas' and 'target' not in tag.attrs:
-                            tag.name = 'to_unwrap'
-            if tag.name == 'social_media' and len(tag.text.strip()) == 0:
+                            pending.unwrap(tag)
+            if tag.name == 'social_media' and text_lengths[tag] == 0:
                 tag.name = 'beagyazott_social'
-            if len(tag.text.strip()) == 0 and tag.name not in TEMPORARILY_USED_TAGS \
+            if text_lengths[tag] == 0 and tag.name not in TEMPORARILY_USED_TAGS \
                     and tag.name not in MEDIA_DICT.keys() and tag.name not in USED_NOTEXT_TAGS \
                     and tag.name not in link_attrs and tag.name != 'to_decompose':
-                tag.name = 'to_unwrap'  # Tags that only currently do not contain text
+                pending.unwrap(tag)  # Tags that only currently do not contain text
         else:  # Unrated tags
             tei_logger.log('WARNING', f'{article_url} The tag is not in the dictionary.'
                                       f'The dictionary needs to be updated ({tag.name}, {tag})')
-            tag.name = 'to_unwrap'
-
-
-def article_body_converter(tei_logger, article_url, raw_html, spec_params):
-    """This function cleans and converts HTML content into a valid TEI XML"""
-    article_roots, decompose_fun, excluded_tags_fun, tag_normal_dict, link_attrs, block_dict, change_by_bigram, \
-        portal_url_prefix, portal_url_filter = spec_params
-    raw_html = raw_html.replace('<br>', ' ')
-    bs = BeautifulSoup(raw_html, 'lxml')
+            pending.unwrap(tag)
+    stage_count('tag_signature_cache_hits', signature_cache.hits - hits_before)
+    stage_count('tag_signature_cache_misses', signature_cache.misses - misses_before)
+
+
+def replace_line_breaks(article):
+    """Replace the <br> tags with spaces and join the strings around them (as if they were spaces in the HTML).
+       The output is not always the same as with the former replacement in the raw HTML before parsing it
+        (raw_html.replace('<br>', ' ')):
+        - the whitespace may differ around a <br> next to a whitespace-only string, as the parser drops some
+           whitespace-only strings (e.g. between block tags), which included the replaced spaces before
+        - a <br> in raw text (e.g. in script, or in noscript where the parser keeps its content as text)
+           and in comments and attribute values is kept
+        - the other spellings (<br/>, <BR>, <br class="...">) are replaced as well (they were unwrapped before)
+    """
+    br_tags = article.find_all('br')
+    if len(br_tags) > 0:
+        for br_tag in br_tags:
+            br_tag.replace_with(' ')
+        article.smooth()
+
+
+# This function is used outside of this file
+def prepare_article_body(tei_logger, article_url, bs, spec_params):
+    """Find the root of the article body, delete the portal-specific irrelevant parts and rename the tags
+        based on the tag table (the steps which use the portal-specific config functions on the BeautifulSoup tree).
+       Returns the root of the article body or None if it is not found
+    """
+    article_roots, decompose_fun, excluded_tags_fun, tag_normal_dict, link_attrs, _, _, portal_url_prefix, \
+        portal_url_filter = spec_params
     for args, kwargs in article_roots:
         article = bs.find(*args, **kwargs)
         if article is not None:
@@ -518,6 +638,7 @@ def article_body_converter(tei_logger, article_url, raw_html, spec_params):
         tei_logger.log('WARNING', f'{article_url} ARTICLE BODY ROOT NOT FOUND!')
         return None
 
+    replace_line_breaks(article)
     if unicode_test(article.text) > 25 or article.text.count("00e1") > 10:
         # These two numbers are an approximation to separate normal coded and faulty items.
         article = article_encoding_correction(article, decompose_fun)
@@ -526,9 +647,13 @@ def article_body_converter(tei_logger, article_url, raw_html, spec_params):
     article.name = 'article_body_root'
     for element in article(text=lambda text: isinstance(text, Comment)):
         element.extract()  # Delete the Comments
+    stage_checkpoint('find_root_and_decompose', article)
+    # The tags marked to be decomposed or unwrapped are collected here and deleted together at the sync points
+    pending = PendingMutations()
     # 1) Renaming based on manually evaluated tag table(dictionary)
     normal_tag_names_by_dict_new(article, bs, excluded_tags_fun, tag_normal_dict, link_attrs, portal_url_prefix,
-                                 portal_url_filter, article_url, tei_logger)
+                                 portal_url_filter, pending, article_url, tei_logger)
+    stage_checkpoint('dictionary_renaming', article)
 
     for un_tag in article.find_all('szakasz'):
         if immediate_text(un_tag) > 0:
@@ -537,59 +662,85 @@ def article_body_converter(tei_logger, article_url, raw_html, spec_params):
             un_tag.unwrap()
 
     # Decompose/unwrap
-    decompose_all(article, 'to_decompose')
-    unwrap_all(article, 'to_unwrap')
+    pending.sync()
+    stage_checkpoint('sections_decompose_unwrap', article)
+    return article
+
+
+def article_body_converter(tei_logger, article_url, bs, spec_params):
+    """This function cleans and converts HTML content (the parsed page which is modified in place)
+        into a valid TEI XML"""
+    _, _, _, _, link_attrs, block_dict, change_by_bigram, _, _ = spec_params
+    article = prepare_article_body(tei_logger, article_url, bs, spec_params)
+    if article is None:
+        return None
+    # The tags marked to be decomposed or unwrapped are collected here and deleted together at the sync points
+    pending = PendingMutations()
 
     # 2) BIGRAM RULES
     if len(change_by_bigram) > 0:
-        rename_by_bigram_rules(article, change_by_bigram, article_url, tei_logger)
+        rename_by_bigram_rules(article, change_by_bigram, pending, article_url, tei_logger)
+    stage_checkpoint('bigram_rules', article)
 
     # 3) FILTER: table/frame
     disambiguate_table_or_frame(article, article_url, tei_logger)
+    stage_checkpoint('table_or_frame', article)
 
     # 4) BLOCK specific RENAMING RULES
-    block_specific_renaming(article, block_dict, article_url, tei_logger)
+    block_specific_renaming(article, block_dict, pending, article_url, tei_logger)
 
     # Decompose/unwrap
-    decompose_all(article, 'to_decompose')
-    unwrap_all(article, 'to_unwrap')
+    pending.sync()
+    stage_checkpoint('block_renaming', article)
 
     # 5) Media
     handling_media_blocks_attrs_and_tags(article_url, article, tei_logger)
+    stage_checkpoint('media_handling', article)
 
     # 6) Cleaning: Delete tags that do not contain text and are used temporarily
+    text_lengths = TextLengths(article)  # Unwrapping keeps the text of the remaining tags unchanged
     for tag in article.find_all():
-        if len(tag.text.strip()) == 0 and tag.name not in USED_NOTEXT_TAGS and tag.name not in link_attrs:
+        if text_lengths[tag] == 0 and tag.name not in USED_NOTEXT_TAGS and tag.name not in link_attrs:
             tag.unwrap()
         if tag.name not in OUR_BUILTIN_TAGS:
-            tag.name = 'to_unwrap'
+            pending.unwrap(tag)
 
     real_lead_general_test(article, article_url, tei_logger)
+    stage_checkpoint('empty_tag_cleaning', article)
 
     # 7/a) Detect and delete unnecessary levels
     handling_unnecessary_wrappers(article, article_url, tei_logger)
-    unwrap_all(article, 'to_unwrap')
+    pending.sync()
+    stage_checkpoint('unnecessary_wrappers_1', article)
 
     # 7/b) Detect and delete unnecessary <p>-levels
-    deal_with_paragraphs(article, article_url, tei_logger)
+    deal_with_paragraphs(article, pending, article_url, tei_logger)
+    stage_checkpoint('paragraphs_1', article)
 
     # 8) Inline tags and paragraphs hierarchy
     handling_paragraphs_and_formatting_hierarchy(article, bs, article_url, tei_logger)
+    stage_checkpoint('paragraph_hierarchy', article)
 
     # 9) Checking block's structure
-    block_specific_curation_of_internal_structure(article, block_dict, article_url, tei_logger)
+    block_specific_curation_of_internal_structure(article, block_dict, pending, article_url, tei_logger)
+    stage_checkpoint('block_internal_structure', article)
 
     correct_table_structure(article, bs, article_url, tei_logger)
+    stage_checkpoint('table_structure', article)
 
-    deal_with_paragraphs(article, article_url, tei_logger)
+    deal_with_paragraphs(article, pending, article_url, tei_logger)
+    stage_checkpoint('paragraphs_2', article)
 
     block_structure(article, bs, block_dict, article_url, tei_logger)
 
-    unwrap_all(article, 'to_unwrap')
+    pending.sync()
+    stage_checkpoint('block_structure', article)
 
     handling_unnecessary_wrappers(article, article_url, tei_logger)
+    stage_checkpoint('unnecessary_wrappers_2', article)
 
     isempty_figures_and_galleries(article, article_url, tei_logger)
+    stage_checkpoint('empty_figures', article)
 
     # 10) Curating the media block's inner structure
     for media in article.find_all(MEDIA_DICT.keys()):
@@ -597,15 +748,18 @@ def article_body_converter(tei_logger, article_url, raw_html, spec_params):
         be packaged in a default tag. Copying the contents of the label is necessary precisely because of the difficulty
         of moving (deleted on its own) direct ('naked') texts. (Required because of TEI.)"""
         complex_wrapping(bs, media, 'bekezdes', article_url, tei_logger)
+    stage_checkpoint('media_inner_structure', article)
 
-    deal_with_paragraphs(article, article_url, tei_logger)
-    unwrap_all(article, 'to_unwrap')
+    deal_with_paragraphs(article, pending, article_url, tei_logger)
+    pending.sync()
     missing_root_replacement(bs, 'komment', False, 'komment_root', article)
+    stage_checkpoint('paragraphs_3', article)
 
     # 11) Rename to XML tags and insert the extra levels required by XML
     article.name = 'body'
     article.attrs.clear()
     normal_tag_to_tei_xml_converter(bs, article)
+    stage_checkpoint('tei_xml_conversion', article)
 
     # 12) Checking the structure of the article(<body>) and generating the output of the TEI file printout
     art_naked_text, art_child_tags, art_desc_tags = imtext_children_descendants_of_tag(article)
@@ -627,11 +781,13 @@ def article_body_converter(tei_logger, article_url, raw_html, spec_params):
 
     # If a headless list was inherited from the html source
     correct_lists(bs, article, article_url, tei_logger)
+    stage_checkpoint('body_structure', article)
 
     if real_text_length(article) == 0 and len(article.find_all()) == 0:
         tei_logger.log('WARNING', f'{article_url}: ARTICLE BODY IS EMPTY!')
         return 'EMPTY ARTICLE'
 
     tei_body_contents_list = prepare_tei_body(art_child_tags, art_naked_text, article, bs, article_url, tei_logger)
+    stage_checkpoint('prepare_tei_body')
 
     return tei_body_contents_list
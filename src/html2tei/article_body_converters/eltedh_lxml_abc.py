@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*
+
+"""The ELTEDH article body converter on lxml elements (eltedh-lxml write out mode)
+
+The steps which use the portal-specific config functions (finding the root of the article body, decomposing the
+ irrelevant parts and renaming the tags by the tag table) run on the BeautifulSoup tree as in the eltedh engine
+ (see prepare_article_body), then the tree is converted to lxml for the remaining steps which follow the functions of
+ eltedh_abc.py one by one. The resulting subtrees are converted back to BeautifulSoup tags for tei_writer.
+The strings of BeautifulSoup are kept apart in the joined texts (see STRING_BOUNDARY in lxml_tei_utils.py), so the
+ output is the same as the output of the eltedh engine (see benchmarks/diff_write_out_modes.py) with one exception:
+ the strings of script and style tags (if they are not decomposed) are counted in the texts of their ancestors, which
+ may change the decisions based on the text lengths
+"""
+
+from bs4 import BeautifulSoup
+from lxml.etree import iterwalk, tostring
+
+from ..basic_tag_dicts import *
+from ..lxml_tei_utils import new_element, set_attrs, lxml_tree_from_bs, bs_tags_from_lxml, contents, append_item, \
+    set_contents, text_of, find_all, find_children, find_first, extract, unwrap, wrap, unwrap_all, \
+    immediate_text, real_text_length, imtext_children_descendants_of_tag, TextLengths, SubtreeSummaries, \
+    PendingMutations, complex_wrapping, normal_tag_to_tei_xml_converter
+from ..workflow_helpers.stage_timing import stage_checkpoint
+from .eltedh_abc import prepare_article_body, TABLE_CELL, BLOCKS_MINUS_CIMSOR, MEDIA_MINUS_FIG, TABLES_VALID, \
+    PARAGRAPH_AND_INLINES
+
+
+# Only process_article is used outside of this file
+
+def process_article(article_page_tups, tei_logger, spec_get_meta_fun, spec_body_params):
+    """It executes our own metadata extraction and text extraction, normalization,
+        TEI to XML conversion method per URL"""
+    (one_url, warc_response_datetime, warc_id, raw_html) = article_page_tups
+    bs = BeautifulSoup(raw_html, 'lxml')
+    stage_checkpoint('parse_html', bs)
+    meta = spec_get_meta_fun(tei_logger, one_url, bs)
+    stage_checkpoint('get_meta')
+    if meta is not None:
+        converted_body_list = article_body_converter(tei_logger, one_url, bs, spec_body_params)
+        return meta, converted_body_list
+    else:
+        return None, None
+
+
+def disambiguate_table_or_frame(article, article_url, tei_logger):
+    """This function disambiguates if selected tags are real tables or just frames/boxes (a typical use in HTML)
+        based on the proportion of rows and columns in table tag
+    """
+    tei_logger.log('DEBUG', f'disambiguate_table_or_frame in {article_url}')
+    for tag in find_all(article, ('table_text',)):
+        cell, row = 0, 0
+        for table_c in tag.iterdescendants():
+            if table_c.tag in TABLE_CELL:
+                cell += 1
+            elif table_c.tag == 'sor':
+                row += 1
+            elif table_c.tag == 'table_text':
+                break
+        if cell == row or cell < 2:
+            tag.tag = 'doboz'
+
+
+def rename_by_bigram_rules(article, change_by_bigram, pending, article_url, tei_logger):
+    """You can specify rules to combine two tag. The combined labels overrides the role of
+        the participants or their combined meaning (see rename_by_bigram_rules in eltedh_abc.py)
+    """
+    tei_logger.log('DEBUG', f'rename_by_bigram_rules in {article_url}')
+    summaries = SubtreeSummaries()
+    for tag in reversed(find_all(article, change_by_bigram.keys())):
+        # The structures (which could be recursive) can be handled safely from the inside out (hence reversed).
+        #  Iterating from the outside to the inside crosses the boundaries of the levels
+        naked_text, child_tags, desc_tags = summaries[tag]
+        # The inner dictionary's key is a tuple of second_tag_part and case
+        second_tags_of_bigram = {tup[0] for tup in change_by_bigram[tag.tag].keys()}
+        if len(desc_tags & second_tags_of_bigram) > 0:
+            for second_part_tag, case in change_by_bigram[tag.tag].keys():
+                parent_level_name, child_level_name = change_by_bigram[tag.tag][(second_part_tag, case)]
+                if second_part_tag in desc_tags and case == 'det_by_any_desc':
+                    for c in find_all(tag, (second_part_tag,)):
+                        summaries.changed(c)
+                        pending.rename(c, child_level_name)
+                    summaries.changed(tag)
+                    pending.rename(tag, parent_level_name)
+                    break
+                elif second_part_tag in child_tags and \
+                        (case == 'det_by_any_child' or
+                         (len(child_tags) == 1 and ((not naked_text and case == 'to_merge')
+                                                    or case == 'det_by_child'))):
+                    for c in find_children(tag, second_part_tag):
+                        summaries.changed(c)
+                        pending.rename(c, child_level_name)
+                    summaries.changed(tag)
+                    pending.rename(tag, parent_level_name)
+                    break
+
+
+def block_specific_renaming(article, block_dict, pending, article_url, tei_logger):
+    """Within special ("block") structures, some members must be given a different name.
+       Mainly because of TEI rules
+    """
+    tei_logger.log('DEBUG', f'block_specific_renaming in {article_url}')
+    for block_root in reversed(find_all(article, BLOCKS)):
+        # The structures (which could be recursive) can be handled safely from the inside out (hence reversed).
+        #  Iterating from the outside to the inside crosses the boundaries of the levels
+        block_rename_rules = block_dict[block_root.tag]['rename']
+        if block_rename_rules.keys():
+            # The eltedh engine does not stop at the roots of the inner blocks either
+            #  (its check looks for a tag named child_tagname)
+            for descendant_tag in find_all(block_root):
+                child_tagname = descendant_tag.tag
+                if child_tagname in block_rename_rules.keys():
+                    pending.rename(descendant_tag, block_rename_rules[child_tagname])
+    for head in find_all(article, ('cimsor',)):
+        for head_desc in find_all(head):
+            if head_desc.tag not in INLINE_TAGS:
+                unwrap(head_desc)
+
+
+def block_specific_curation_of_internal_structure(article, block_dict, pending, article_url, tei_logger):
+    """The specified rules define the hierarchy between block's roots by which the code decides whether the current
+        occurrence is valid, or one excludes the interpretation of the other
+        (see block_specific_curation_of_internal_structure in eltedh_abc.py)
+    """
+    tei_logger.log('DEBUG', f'rename_by_bigram_rules in {article_url}')
+    text_lengths = TextLengths(article)  # Unwrapping keeps the text of the remaining elements unchanged
+    for tag in find_all(article, BLOCKS):
+        tag_name = tag.tag
+        # Block in block
+        for tag_descendant in find_all(tag, BLOCKS):
+            # The texts are the same apart from the surrounding whitespace (see same_stripped_text in eltedh_abc.py)
+            if tag_name == tag_descendant.tag and text_lengths[tag] == text_lengths[tag_descendant]:
+                # Double root
+                unwrap(tag_descendant)
+            else:
+                # Invalid structure
+                block_tag_rules_dict = block_dict[tag_name]
+                if tag_descendant.tag in block_tag_rules_dict['not_valid_inner_blocks']:
+                    unwrap(tag_descendant)
+                elif tag_descendant.tag in block_tag_rules_dict['not_valid_as_outer_for']:
+                    pending.unwrap(tag)
+
+
+def block_structure(article, block_dict, article_url, tei_logger):
+    """Arranges the internal structure of the block for a uniform structure
+        (see block_structure in eltedh_abc.py)
+    """
+    tei_logger.log('DEBUG', f'block_structure in {article_url}')
+    for block_tag in find_all(article, BLOCKS_MINUS_CIMSOR):
+        default_child_name = block_dict[block_tag.tag]['default']
+        complex_wrapping(block_tag, default_child_name, article_url, tei_logger)
+    for a_list in find_all(article, ('lista',)):
+        # The texts are wrapped as well (one by one in the eltedh engine)
+        list_contents = []
+        for list_root_child in contents(a_list):
+            if isinstance(list_root_child, str):
+                list_item = new_element('listaelem')
+                list_item.text = list_root_child
+                list_root_child = list_item
+            elif list_root_child.tag != 'listaelem':
+                list_item = new_element('listaelem')
+                append_item(list_item, list_root_child)  # The text after it is wrapped separately
+                list_root_child = list_item
+            list_contents.append(list_root_child)
+        set_contents(a_list, list_contents)
+
+
+def correct_table_structure(article, article_url, tei_logger):
+    """Corrects tables inherited from HTML that are corrupted or incomplete in structure"""
+    tei_logger.log('DEBUG', f'correct_table_structure in {article_url}')
+    for tab in find_all(article, ('table_text',)):
+        for table_root_direct_child in list(tab):
+            if table_root_direct_child.tag not in TABLES_VALID:  # Non table-member
+                unwrap(table_root_direct_child)
+        for table_root_direct_child in tab:
+            if table_root_direct_child.tag == 'sor_valid' and \
+                    len(find_children(table_root_direct_child, 'oszlop_valid')) == 0:
+                # No column in the row, so we make an 1×1 field
+                table_root_direct_child.tag = 'oszlop_sor'
+    for tab in find_all(article, ('table_text',)):
+        # No row around columns
+        if len(find_children(tab, 'oszlop_valid')) > 0:
+            missing_root_replacement('oszlop_valid', False, 'sor_valid', tab)
+        unwrap_all(tab, 'bekezdes')
+        for row in find_all(tab, ('sor_valid',)):
+            if immediate_text(row) > 0:
+                complex_wrapping(row, 'oszlop_valid', article_url, tei_logger)
+    for row in find_all(article, ('sor_valid',)):
+        for main_subtree in list(row):
+            if main_subtree.tag != 'oszlop_valid':
+                wrap(main_subtree, new_element('oszlop_valid'))
+
+
+def missing_root_replacement(divname, rec, root_name, tab):
+    """Replace when a block with a fixed structure (e.g., list, table rows) is missing the root.
+        It was not in HTML and this cannot be validated in TEI
+    """
+    row_root = None
+    for tag in find_all(tab) if rec else list(tab):
+        if tag.tag == divname and tag.getparent().tag != root_name:
+            if row_root is None:
+                row_root = new_element(root_name)
+                tag.addprevious(row_root)
+            append_item(row_root, extract(tag))
+        elif tag.tag != divname:
+            row_root = None
+
+
+def deal_with_paragraphs(article, pending, article_url, tei_logger):
+    """Paragraphs, and tags equivalent to paragraphs (according to the TEI schema) are often overused in HTML
+        (see deal_with_paragraphs in eltedh_abc.py)
+    """
+    tei_logger.log('DEBUG', f'deal_with_paragraphs in {article_url}')
+    summaries = SubtreeSummaries()
+    for p_tag in find_all(article, ('bekezdes',)):
+        p_naked_text, p_child_tags, p_desc_tags = summaries[p_tag]
+        if len(p_child_tags & PARAGRAPH_LIKE_TAGS) > 0 or (not p_naked_text and len(p_child_tags & INLINE_TAGS) == 0):
+            summaries.changed(p_tag)
+            unwrap(p_tag)
+        elif not p_naked_text and 'bekezdes' in p_desc_tags and p_desc_tags < PARAGRAPH_AND_INLINES \
+                and summaries.descendant_count(p_tag, 'bekezdes') == 1:
+            inner_p_tag = find_first(p_tag, 'bekezdes')
+            summaries.changed(inner_p_tag)
+            pending.unwrap(inner_p_tag)
+    # It can be handled safely with two separate iterations. The second checks the labels equivalent to the paragraphs
+    #  for non-valid combinations
+    for p_like_tag in find_all(article, PARAGRAPH_LIKE_TAGS):
+        plike_naked_text, plike_child_tags, plike_desc_tags = summaries[p_like_tag]
+        if 'bekezdes' in plike_desc_tags and plike_desc_tags < PARAGRAPH_AND_INLINES \
+                and summaries.descendant_count(p_like_tag, 'bekezdes') == 1:
+            inner_p_tag = find_first(p_like_tag, 'bekezdes')
+            summaries.changed(inner_p_tag)
+            pending.unwrap(inner_p_tag)
+
+
+def handling_unnecessary_wrappers(article, article_url, tei_logger):
+    """This function:
+        - Interprets the levels inherited from HTML
+        - Finds which level is redundant, or can be omitted for a clear structure free of duplication
+       (see handling_unnecessary_wrappers in eltedh_abc.py)
+    """
+    tei_logger.log('DEBUG', f'unnecessary_wrappers in {article_url}')
+    all_tags = find_all(article)
+    hi_tags_by_name = {}
+    for tag in all_tags:
+        if tag.tag in HI_TAGS:
+            hi_tags_by_name.setdefault(tag.tag, []).append(tag)
+
+    for a_tag in all_tags:
+        # The unwrapped tags are left without children, so they are skipped here
+        if a_tag.tag not in BLOCKS and len(a_tag) > 0 and all(c.tag == a_tag.tag for c in a_tag):
+            if immediate_text(a_tag) == 0:  # Duplicated level
+                unwrap(a_tag)
+            elif a_tag.tag in HI_TAGS:  # Variation of duplicated level
+                unwrap_all_indexed(hi_tags_by_name, a_tag.tag)
+
+    nested_hi_tag_names, p_like_tags_in_refs = hi_tags_in_themselves_and_p_like_tags_in_refs(article)
+    for i_tagname in nested_hi_tag_names:  # Double formatting
+        unwrap_all_indexed(hi_tags_by_name, i_tagname)
+    for p_like_tag in p_like_tags_in_refs:
+        unwrap(p_like_tag)
+
+
+def unwrap_all_indexed(tags_by_name, tag_name):
+    """The same as unwrap_all(article, tag_name) for the tags indexed by name (the ones not unwrapped yet)"""
+    for tag in tags_by_name.pop(tag_name, ()):
+        if tag.getparent() is not None:
+            unwrap(tag)
+
+
+def hi_tags_in_themselves_and_p_like_tags_in_refs(article):
+    """Walk the article once (keeping count of the names of the open ancestors) and return
+        1. The names of the formatting tags which occur in a tag of the same name
+        2. The paragraph-like tags under links (hivatkozas)
+    """
+    nested_hi_tag_names = set()
+    p_like_tags_in_refs = []
+    open_tag_names = {}
+    for event, tag in iterwalk(article, events=('start', 'end')):
+        tag_name = tag.tag
+        if event == 'end':
+            open_tag_names[tag_name] -= 1
+            continue
+        if tag_name in HI_TAGS and open_tag_names.get(tag_name, 0) > 0:
+            nested_hi_tag_names.add(tag_name)
+        elif tag_name in PARAGRAPH_LIKE_TAGS and open_tag_names.get('hivatkozas', 0) > 0:
+            p_like_tags_in_refs.append(tag)
+        open_tag_names[tag_name] = open_tag_names.get(tag_name, 0) + 1
+    return nested_hi_tag_names, p_like_tags_in_refs
+
+
+def handling_paragraphs_and_formatting_hierarchy(article, article_url, tei_logger):
+    """Formatting should be at the lowest level.
+       If it is higher than the paragraph, this code restores the hierarchy while preserving the scope of formatting
+    """
+    summaries = SubtreeSummaries()
+    for i_tag in reversed(find_all(article, HI_TAGS)):
+        # The structures (which could be recursive) can be handled safely from the inside out (hence reversed).
+        #  Iterating from the outside to the inside crosses the boundaries of the levels
+        in_naked_text, in_child_tags, in_desc_tags = summaries[i_tag]
+        p_like_child = PARAGRAPH_LIKE_TAGS & in_child_tags
+        if len(p_like_child) == 1 and in_child_tags.difference(in_desc_tags) <= HI_TAGS:
+            summaries.changed(i_tag)  # Its children are rewrapped and it is unwrapped
+            p_like_child_name = p_like_child.pop()
+            for inlines_child in find_children(i_tag, p_like_child_name):
+                wrap(inlines_child, new_element(p_like_child_name))
+                if len(inlines_child.attrib) > 0:
+                    tei_logger.log('DEBUG', f'{article_url}: UNEXPECTED ATTRIBUTE HERE:'
+                                            f'{inlines_child.tag}{dict(inlines_child.attrib)}')
+                inlines_child.tag = i_tag.tag
+            if in_naked_text:
+                complex_wrapping(i_tag, i_tag.tag, article_url, tei_logger)
+            unwrap(i_tag)
+
+
+def handling_media_blocks_attrs_and_tags(article_url, article, tei_logger):
+    """1. rootless media_link > evaluation
+       2. Automatic elimination of duplicate levels
+       3. independent image and gallery automatic recognition, correction
+       4. where expected, "transporting" the reference to the root
+    """
+    for direct_facs in article:
+        if direct_facs.tag == 'media_hivatkozas':
+            direct_facs.tag = 'media_tartalom'
+
+    for media in reversed(find_all(article, MEDIA_DICT.keys())):
+        # The structures (which could be recursive) can be handled safely from the inside out (hence reversed).
+        #  Iterating from the outside to the inside crosses the boundaries of the levels
+        if 'target' in media.attrib or media.tag == 'social_media':
+            for media_inner_tag in find_all(media):
+                if media_inner_tag.tag == 'media_hivatkozas':
+                    media_inner_tag.tag = 'hivatkozas'
+                elif media_inner_tag.tag not in MEDIA_DICT[media.tag] and media_inner_tag.tag not in INLINE_TAGS:
+                    unwrap(media_inner_tag)
+        else:
+            media_facs_list_new = [dict(facs.attrib) for facs in find_all(media, ('media_hivatkozas',))
+                                   if 'target' in facs.attrib]
+            if len(media_facs_list_new) == 1:
+                set_attrs(media, media_facs_list_new[0])
+                unwrap(find_first(media, 'media_hivatkozas'))
+            elif len(media_facs_list_new) > 1:  # convert into gallery
+                for facs in find_all(media, ('media_hivatkozas',)):
+                    facs.tag = 'media_tartalom'
+                media.tag = 'galeria'
+
+    for caption in find_all(article, FIGURE_REND_ATTRS.keys()):
+        if len(caption.attrib) == 0 and find_first(caption, tuple(FIGURE_REND_ATTRS.keys())) is not None:
+            unwrap(caption)
+
+    for media in find_all(article, MEDIA_DICT.keys()):
+        for media_inner_tag in find_all(media):
+            if media_inner_tag.tag not in MEDIA_DICT.keys() and media_inner_tag.tag not in MEDIA_DICT[media.tag] \
+                    and media_inner_tag.tag not in INLINE_TAGS:
+                unwrap(media_inner_tag)
+            elif media_inner_tag.tag in MEDIA_DICT.keys():
+                if len(media.attrib) == 0:
+                    unwrap(media)
+                else:
+                    tei_logger.log('DEBUG', f'{article_url}: MEDIA ELEMENT IN MEDIA ELEMENT')
+
+    for rest_media_reference in find_all(article, ('media_hivatkozas',)):
+        rest_media_reference.tag = 'media_tartalom'
+
+
+def isempty_figures_and_galleries(article, article_url, tei_logger):
+    """Images and galleries cannot always be downloaded in their entirety, so the code considers which blocks are
+        worth preserving. ('clues' that contain neither a caption nor a link can be discarded)
+    """
+    text_lengths = TextLengths(article)
+    empty_galleries = []
+    for fig in find_all(article, ('media_tartalom',)):
+        if text_lengths[fig] == 0 and len(fig.attrib) == 0:
+            text_lengths.decompose(fig)
+    for isempty_galeries in find_all(article, ('galeria',)):
+        if find_first(isempty_galeries, 'media_tartalom') is None:
+            if text_lengths[isempty_galeries] > 0:
+                tei_logger.log('DEBUG', f'{article_url}: GALLERY WITH CAPTION, BUT WITHOUT ANY FIGURES? '
+                                        f'{tostring(isempty_galeries, encoding=str, with_tail=False)}')
+            empty_galleries.append(isempty_galeries)
+    for tag in empty_galleries:
+        text_lengths.decompose(tag)
+    for social_figure in find_all(article, MEDIA_MINUS_FIG):
+        has_ref = any('target' in c.attrib for c in social_figure.iterdescendants())
+        if text_lengths[social_figure] == 0 and not has_ref and 'target' not in social_figure.attrib:
+            tei_logger.log('DEBUG', f'{article_url}: EMPTY SOCIAL MEDIA CONTENT OR FIGURE '
+                                    f'{tostring(social_figure, encoding=str, with_tail=False)}')
+            text_lengths.decompose(social_figure)
+
+
+def correct_lists(l_article, article_url, tei_logger):
+    """This function corrects irregular lists which was inherited from HTML"""
+    tei_logger.log('DEBUG', f'correct_lists in {article_url}')
+    for li in find_all(l_article, ('item',)):
+        if li.getparent().tag != 'list':
+            missing_root_replacement('item', True, 'list', l_article)
+            break
+
+
+def prepare_tei_body(art_child_tags, art_naked_text, article, article_url, tei_logger):
+    """Going through the first level below the article root, it prepares the main subtrees before
+        writing out as TEI XML.
+       If it finds direct text or an inline tag by iterating through the direct subtrees of the body, it converts it
+        to a paragraph
+    """
+    tei_logger.log('DEBUG', f'prepare_tei_body in {article_url}')
+    tei_body_contents_list = []
+    if art_naked_text or len(INLINE_TAGS & art_child_tags) > 0:
+        concatenated_naked_and_freetag = None
+        for c in contents(article):
+            if isinstance(c, str) and len(c.strip()) > 0 or not isinstance(c, str) and c.tag in INLINE_TAGS:
+                if concatenated_naked_and_freetag is None:
+                    concatenated_naked_and_freetag = new_element('p')
+                append_item(concatenated_naked_and_freetag, c)
+            elif not isinstance(c, str):
+                if concatenated_naked_and_freetag is not None:
+                    tei_body_contents_list.append(concatenated_naked_and_freetag)
+                    concatenated_naked_and_freetag = None
+                tei_body_contents_list.append(c)
+        if concatenated_naked_and_freetag is not None:
+            tei_body_contents_list.append(concatenated_naked_and_freetag)
+    else:
+        # If no packaging was required for any of the subtrees, the output should still be a list.
+        #  At this stage, the texts may contain unnecessary line breaks, and so we throw away them as well
+        tei_body_contents_list = list(article)
+    return tei_body_contents_list
+
+
+def real_lead_general_test(article, article_url, tei_logger):
+    """Verification: If the lead is not at the beginning of the article, it may indicate that the lead tag is
+        being used inconsistently
+    """
+    for i, lead in enumerate(find_all(article, ('vez_bekezdes',))):
+        lead_text = text_of(lead)
+        if text_of(article).find(lead_text[0:20]) > 5 and i > 0:
+            tei_logger.log('DEBUG', f'{article_url} The lead is not at the beginning of the article. {lead_text[0:10]}')
+            lead.tag = 'bekezdes'
+
+
+def article_body_converter(tei_logger, article_url, bs, spec_params):
+    """This function cleans and converts HTML content (the parsed page which is modified in place)
+        into a valid TEI XML"""
+    _, _, _, _, link_attrs, block_dict, change_by_bigram, _, _ = spec_params
+    bs_article = prepare_article_body(tei_logger, article_url, bs, spec_params)
+    if bs_article is None:
+        return None
+    # The elements parsed as empty elements (e.g. <img>) for the conversion back to BeautifulSoup
+    void_elements = set()
+    article = lxml_tree_from_bs(bs_article, void_elements)
+    stage_checkpoint('convert_to_lxml', article)
+    # The tags marked to be decomposed or unwrapped are collected here and deleted together at the sync points
+    pending = PendingMutations()
+
+    # 2) BIGRAM RULES
+    if len(change_by_bigram) > 0:
+        rename_by_bigram_rules(article, change_by_bigram, pending, article_url, tei_logger)
+    stage_checkpoint('bigram_rules', article)
+
+    # 3) FILTER: table/frame
+    disambiguate_table_or_frame(article, article_url, tei_logger)
+    stage_checkpoint('table_or_frame', article)
+
+    # 4) BLOCK specific RENAMING RULES
+    block_specific_renaming(article, block_dict, pending, article_url, tei_logger)
+
+    # Decompose/unwrap
+    pending.sync()
+    stage_checkpoint('block_renaming', article)
+
+    # 5) Media
+    handling_media_blocks_attrs_and_tags(article_url, article, tei_logger)
+    stage_checkpoint('media_handling', article)
+
+    # 6) Cleaning: Delete tags that do not contain text and are used temporarily
+    text_lengths = TextLengths(article)  # Unwrapping keeps the text of the remaining tags unchanged
+    for tag in find_all(article):
+        if text_lengths[tag] == 0 and tag.tag not in USED_NOTEXT_TAGS and tag.tag not in link_attrs:
+            unwrap(tag)
+        if tag.tag not in OUR_BUILTIN_TAGS:
+            pending.unwrap(tag)
+
+    real_lead_general_test(article, article_url, tei_logger)
+    stage_checkpoint('empty_tag_cleaning', article)
+
+    # 7/a) Detect and delete unnecessary levels
+    handling_unnecessary_wrappers(article, article_url, tei_logger)
+    pending.sync()
+    stage_checkpoint('unnecessary_wrappers_1', article)
+
+    # 7/b) Detect and delete unnecessary <p>-levels
+    deal_with_paragraphs(article, pending, article_url, tei_logger)
+    stage_checkpoint('paragraphs_1', article)
+
+    # 8) Inline tags and paragraphs hierarchy
+    handling_paragraphs_and_formatting_hierarchy(article, article_url, tei_logger)
+    stage_checkpoint('paragraph_hierarchy', article)
+
+    # 9) Checking block's structure
+    block_specific_curation_of_internal_structure(article, block_dict, pending, article_url, tei_logger)
+    stage_checkpoint('block_internal_structure', article)
+
+    correct_table_structure(article, article_url, tei_logger)
+    stage_checkpoint('table_structure', article)
+
+    deal_with_paragraphs(article, pending, article_url, tei_logger)
+    stage_checkpoint('paragraphs_2', article)
+
+    block_structure(article, block_dict, article_url, tei_logger)
+
+    pending.sync()
+    stage_checkpoint('block_structure', article)
+
+    handling_unnecessary_wrappers(article, article_url, tei_logger)
+    stage_checkpoint('unnecessary_wrappers_2', article)
+
+    isempty_figures_and_galleries(article, article_url, tei_logger)
+    stage_checkpoint('empty_figures', article)
+
+    # 10) Curating the media block's inner structure
+    for media in find_all(article, MEDIA_DICT.keys()):
+        complex_wrapping(media, 'bekezdes', article_url, tei_logger)
+    stage_checkpoint('media_inner_structure', article)
+
+    deal_with_paragraphs(article, pending, article_url, tei_logger)
+    pending.sync()
+    missing_root_replacement('komment', False, 'komment_root', article)
+    stage_checkpoint('paragraphs_3', article)
+
+    # 11) Rename to XML tags and insert the extra levels required by XML
+    article.tag = 'body'
+    normal_tag_to_tei_xml_converter(article)
+    stage_checkpoint('tei_xml_conversion', article)
+
+    # 12) Checking the structure of the article(<body>) and generating the output of the TEI file printout
+    art_naked_text, art_child_tags, art_desc_tags = imtext_children_descendants_of_tag(article)
+
+    # The TEI schema does not tolerates when the direct subtrees of the article body are '<figure>-s', so an extra
+    #  <p>-level must be inserted (at least in the case of the first occurrence)
+    if 'figure' in art_child_tags and len(art_child_tags) == 1:
+        for art_child in article:
+            if art_child.tag == 'figure':
+                wrap(art_child, new_element('p'))
+                break
+
+    # Not valid by TEI schema if there is only one figure in the floatingText (an extra 'p' level must be inserted)
+    for flo in find_all(article, ('body',)):
+        if len(flo) == 1 and flo[0].tag == 'figure':
+            wrap(flo, new_element('body'))
+            flo.tag = 'p'
+
+    # If a headless list was inherited from the html source
+    correct_lists(article, article_url, tei_logger)
+    stage_checkpoint('body_structure', article)
+
+    if real_text_length(article) == 0 and len(article) == 0:
+        tei_logger.log('WARNING', f'{article_url}: ARTICLE BODY IS EMPTY!')
+        return 'EMPTY ARTICLE'
+
+    tei_body_contents_list = prepare_tei_body(art_child_tags, art_naked_text, article, article_url, tei_logger)
+    stage_checkpoint('prepare_tei_body')
+
+    tei_body_contents_list = bs_tags_from_lxml(tei_body_contents_list, bs, void_elements)
+    stage_checkpoint('convert_to_bs')
+
+    return tei_body_contents_list
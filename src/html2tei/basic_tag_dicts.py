@@ -5,6 +5,8 @@
 # eltedh_abc.py + tei_utils.py
 INLINE_TAGS = {'felkover', 'dolt', 'kiemelt', 'hivatkozas', 'alahuzott', 'athuzott', 'felsoindex', 'alsoindex',
                'inline_idezet', 'hi', 'ref'}
+# read_config.py (the normalized names in the tag tables meaning unwrap)
+UNUSED_TAGS = {'unwrap', 'null', 'default'}
 # eltedh_abc.py
 HI_TAGS = INLINE_TAGS.difference({'media_hivatkozas', 'hivatkozas'})
 
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""The lxml counterparts of the helpers in tei_utils.py used by the eltedh-lxml article body converter
+
+The tree model of lxml differs from the one of BeautifulSoup: the strings are not nodes, but the text (before the first
+ child) and the tail (after the element) of the elements. The helpers below keep the texts in place when the elements
+ are moved, therefore the tail of an element must not be moved together with the element (unlike in lxml).
+BeautifulSoup keeps the strings separate when the tags between them are unwrapped or deleted (and prettify() writes
+ them into separate lines), therefore the joined texts are separated by STRING_BOUNDARY: the texts are split there into
+ the strings of BeautifulSoup (see contents) and it is ignored by the text lengths
+"""
+
+import re
+from collections import Counter
+
+from bs4.element import Tag, NavigableString, PreformattedString, CData
+from lxml import etree
+
+from .basic_tag_dicts import INLINE_TAGS, MEDIA_DICT, XML_CONVERT_DICT, TAGNAME_AND_ATTR_TABLE, FIGURE_REND_ATTRS
+
+XML_NAMESPACE = '{http://www.w3.org/XML/1998/namespace}'
+# The normalized names which are not valid as XML names (e.g. containing space) are stored with this prefix. They are
+#  not in OUR_BUILTIN_TAGS, so they are unwrapped before the output (see article_body_converter)
+INVALID_NAME_PREFIX = 'html2tei-invalid-name-'
+# The characters which are not allowed in XML (lxml does not accept them, BeautifulSoup writes them out)
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+MARKER_NAMES = {'to_decompose', 'to_unwrap'}  # The tags to be deleted at the next sync of PendingMutations
+# A noncharacter (valid in XML, but not used in texts) which separates the strings of BeautifulSoup in the texts
+STRING_BOUNDARY = '\ufdd0'
+
+
+def new_element(name, **attrs):
+    """The same as bs.new_tag(name, **attrs)"""
+    return etree.Element(name, attrs)
+
+
+def valid_name(name):
+    try:
+        etree.QName(name)
+    except ValueError:
+        return f'{INVALID_NAME_PREFIX}{name.encode("UTF-8").hex()}'
+    return name
+
+
+def set_name(element, name):
+    try:
+        element.tag = name
+    except ValueError:
+        element.tag = valid_name(name)
+
+
+def xml_safe(text):
+    return XML_INVALID_CHARS.sub('', text)
+
+
+def set_attrs(element, attrs):
+    """The same as tag.attrs = attrs"""
+    element.attrib.clear()
+    element.attrib.update(attrs)
+
+
+def lxml_tree_from_bs(bs_root, void_elements):
+    """Build an lxml tree from the BeautifulSoup tree (the attributes of the root are not needed)
+        The elements which were parsed as empty elements (e.g. <img>) are collected into void_elements,
+        as BeautifulSoup writes them as empty element tags (e.g. <figure/>) when they are still empty at the end.
+       The comment-like strings (e.g. Declaration) are dropped
+    """
+    root = etree.Element(bs_root.name)
+    stack = [(bs_root, root)]
+    while len(stack) > 0:
+        bs_tag, element = stack.pop()
+        texts = []
+        last_child = None
+        for child in bs_tag.contents:
+            if isinstance(child, Tag):
+                if len(texts) > 0:
+                    set_text_before_child(element, last_child, STRING_BOUNDARY.join(texts))
+                    texts = []
+                try:
+                    last_child = etree.SubElement(element, child.name)
+                except ValueError:
+                    last_child = etree.SubElement(element, valid_name(child.name))
+                for attr_name, attr_value in child.attrs.items():
+                    if attr_name.startswith('xml:'):
+                        attr_name = f'{XML_NAMESPACE}{attr_name[4:]}'
+                    if isinstance(attr_value, list):  # The multi-valued attributes (e.g. class)
+                        attr_value = ' '.join(attr_value)
+                    try:
+                        last_child.set(attr_name, attr_value)
+                    except ValueError:
+                        last_child.set(attr_name, xml_safe(attr_value))
+                if child.can_be_empty_element:
+                    void_elements.add(last_child)
+                stack.append((child, last_child))
+            elif not isinstance(child, PreformattedString) or isinstance(child, CData):
+                texts.append(child.replace(STRING_BOUNDARY, ''))
+        if len(texts) > 0:
+            set_text_before_child(element, last_child, STRING_BOUNDARY.join(texts))
+    return root
+
+
+def set_text_before_child(element, last_child, text):
+    """Set the text of the element or the tail of its last child added so far"""
+    try:
+        if last_child is None:
+            element.text = text
+        else:
+            last_child.tail = text
+    except ValueError:
+        set_text_before_child(element, last_child, xml_safe(text))
+
+
+def bs_tags_from_lxml(elements, bs, void_elements):
+    """Convert the lxml subtrees into BeautifulSoup tags (created by the soup of the page as in the eltedh engine)"""
+    bs_tags = []
+    stack = []
+    for element in elements:
+        bs_tag = bs_tag_from_element(element, bs, void_elements)
+        bs_tags.append(bs_tag)
+        stack.append((element, bs_tag))
+    while len(stack) > 0:
+        element, bs_tag = stack.pop()
+        append_strings(bs_tag, element.text)
+        for child in element:
+            bs_child = bs_tag_from_element(child, bs, void_elements)
+            bs_tag.append(bs_child)
+            stack.append((child, bs_child))
+            append_strings(bs_tag, child.tail)
+    return bs_tags
+
+
+def append_strings(bs_tag, text):
+    """Append the strings of the text separately (as they are in the eltedh engine)"""
+    if text:
+        for string in text.split(STRING_BOUNDARY):
+            if len(string) > 0:
+                bs_tag.append(NavigableString(string))
+
+
+def bs_tag_from_element(element, bs, void_elements):
+    attrs = {}
+    for attr_name, attr_value in element.attrib.items():
+        if attr_name.startswith(XML_NAMESPACE):
+            attr_name = f'xml:{attr_name[len(XML_NAMESPACE):]}'
+        attrs[attr_name] = attr_value
+    bs_tag = bs.new_tag(element.tag, attrs=attrs)
+    bs_tag.can_be_empty_element = element in void_elements
+    return bs_tag
+
+
+def join_texts(text, other_text):
+    """Join the texts with STRING_BOUNDARY (where any of them can be None or empty)"""
+    if not text:
+        return other_text
+    if not other_text:
+        return text
+    return f'{text}{STRING_BOUNDARY}{other_text}'
+
+
+def contents(element):
+    """The same as tag.contents: the strings (str) and the child elements in document order"""
+    items = []
+    if element.text:
+        items.extend(element.text.split(STRING_BOUNDARY))
+    for child in element:
+        items.append(child)
+        if child.tail:
+            items.extend(child.tail.split(STRING_BOUNDARY))
+    return items
+
+
+def append_item(element, item):
+    """Append a text or an element (without its tail) to the end of the element"""
+    if isinstance(item, str):
+        last_child = element[-1] if len(element) > 0 else None
+        if last_child is None:
+            element.text = join_texts(element.text, item)
+        else:
+            last_child.tail = join_texts(last_child.tail, item)
+    else:
+        item.tail = None
+        element.append(item)
+
+
+def set_contents(element, items):
+    """The same as tag.clear() and tag.extend(items): the items are texts and elements"""
+    element.text = None
+    del element[:]
+    for item in items:
+        append_item(element, item)
+
+
+def text_of(element):
+    """The same as tag.text"""
+    return ''.join(element.itertext()).replace(STRING_BOUNDARY, '')
+
+
+def find_all(element, names=None):
+    """The same as tag.find_all(names) (the descendants in document order)"""
+    if names is None:
+        return list(element.iterdescendants())
+    return list(element.iterdescendants(*names))
+
+
+def find_children(element, name):
+    """The same as tag.find_all(name, recursive=False)"""
+    return [child for child in element if child.tag == name]
+
+
+def find_first(element, name):
+    """The same as tag.find(name)"""
+    return next(element.iterdescendants(name), None)
+
+
+def own_texts(element):
+    """The texts immediately under the element"""
+    if element.text:
+        yield element.text
+    for child in element:
+        if child.tail:
+            yield child.tail
+
+
+def add_text_before(element, text):
+    """Append the text to the text just before the element
+        (the tail of the previous sibling or the text of the parent)
+    """
+    if not text:
+        return
+    previous = element.getprevious()
+    if previous is not None:
+        previous.tail = join_texts(previous.tail, text)
+    else:
+        parent = element.getparent()
+        parent.text = join_texts(parent.text, text)
+
+
+def extract(element):
+    """The same as tag.extract(): the element is removed from the tree, the text after it remains in place"""
+    parent = element.getparent()
+    if parent is not None:
+        add_text_before(element, element.tail)
+        element.tail = None
+        parent.remove(element)
+    return element
+
+
+def unwrap(element):
+    """The same as tag.unwrap(): replace the element with its contents and leave it empty without parent"""
+    parent = element.getparent()
+    if parent is None:
+        raise ValueError('Cannot replace an element with its contents when that element is not part of a tree.')
+    children = list(element)
+    if len(children) > 0:
+        add_text_before(element, element.text)
+        last_child = children[-1]
+        if element.tail:
+            last_child.tail = join_texts(last_child.tail, element.tail)
+    else:
+        add_text_before(element, join_texts(element.text, element.tail))
+    index = parent.index(element)
+    element.text = None
+    element.tail = None
+    parent[index:index + 1] = children
+
+
+def wrap(element, wrapper):
+    """The same as tag.wrap(wrapper): the text after the element remains after the wrapper"""
+    wrapper.tail = element.tail
+    element.tail = None
+    element.getparent().replace(element, wrapper)
+    wrapper.append(element)
+    return wrapper
+
+
+def decompose(element):
+    """The same as tag.decompose() (the text after the element remains in place)"""
+    extract(element)
+    element.clear()
+
+
+def unwrap_all(article, tag_name):
+    for tag in find_all(article, (tag_name,) if isinstance(tag_name, str) else tag_name):
+        unwrap(tag)
+
+
+def non_whitespace_length(text):
+    if not text:
+        return 0
+    return len(''.join(text.replace(STRING_BOUNDARY, ' ').split()))
+
+
+def immediate_text(element):
+    """This function counts the number of words (non-whitespace text) immediately under the parameter element"""
+    return sum(len(text.replace(STRING_BOUNDARY, ' ').split()) for text in own_texts(element))
+
+
+def real_text_length(element):
+    """This function counts non-whitespace characters in text under the parameter element recursively!"""
+    return sum(non_whitespace_length(text) for text in element.itertext())
+
+
+def imtext_children_descendants_of_tag(element):
+    """This function return the following information on the parameter element:
+        1. Whether there is non-whitespace text immediately below the element
+        2. The names of direct children
+        3. The names of all descendant elements
+    """
+    naked_text = immediate_text(element) > 0
+    child_tags = {c.tag for c in element}
+    descendants_tags = {c.tag for c in element.iterdescendants()}
+    return naked_text, child_tags, descendants_tags
+
+
+class SubtreeSummaries:
+    """The summaries of the elements for imtext_children_descendants_of_tag(element) computed bottom-up and cached
+        (see SubtreeSummaries in tei_utils.py, the modifications must be reported with changed(element) before)
+    """
+    __slots__ = ('_summaries',)
+
+    def __init__(self):
+        self._summaries = {}  # The element proxies are kept alive by the keys, so their identity does not change
+
+    def _summary(self, element):
+        summary = self._summaries.get(element)
+        if summary is None:
+            elements_to_compute = []
+            stack = [element]
+            while len(stack) > 0:
+                e = stack.pop()
+                elements_to_compute.append(e)
+                stack.extend(c for c in e if c not in self._summaries)
+            for e in reversed(elements_to_compute):  # All descendants come before their ancestor
+                child_names, descendant_names = Counter(), Counter()
+                for c in e:
+                    child_names[c.tag] += 1
+                    descendant_names[c.tag] += 1
+                    descendant_names.update(self._summaries[c][2])
+                self._summaries[e] = (immediate_text(e) > 0, child_names, descendant_names)
+            summary = self._summaries[element]
+        return summary
+
+    def __getitem__(self, element):
+        """The same as imtext_children_descendants_of_tag(element)"""
+        naked_text, child_names, descendant_names = self._summary(element)
+        return naked_text, set(child_names), set(descendant_names)
+
+    def descendant_count(self, element, name):
+        """The same as len(find_all(element, (name,)))"""
+        return self._summary(element)[2][name]
+
+    def changed(self, element):
+        while element is not None and self._summaries.pop(element, None) is not None:
+            element = element.getparent()
+
+
+class TextLengths:
+    """The number of non-whitespace characters in the text of each element under (and including) root
+        (see TextLengths in tei_utils.py) computed in one post-order pass
+    """
+    def __init__(self, root):
+        self._lengths = {}  # The element proxies are kept alive by the keys, so their identity does not change
+        for element in reversed([root, *root.iterdescendants()]):  # All descendants come before their ancestor
+            length = non_whitespace_length(element.text)
+            for child in element:
+                length += self._lengths[child] + non_whitespace_length(child.tail)
+            self._lengths[element] = length
+
+    def __getitem__(self, element):
+        length = self._lengths.get(element)
+        if length is None:
+            length = real_text_length(element)
+        return length
+
+    def decompose(self, element):
+        """Decompose the element and subtract its text length from its ancestors"""
+        length = self[element]
+        for ancestor in element.iterancestors():
+            if ancestor in self._lengths:
+                self._lengths[ancestor] -= length
+        decompose(element)
+
+
+class PendingMutations:
+    """Mark elements to be decomposed or unwrapped later and apply them at the sync points in one go
+        (see PendingMutations in tei_utils.py)
+    """
+    __slots__ = ('_marked',)
+
+    def __init__(self):
+        self._marked = []
+
+    def track(self, element):
+        """Register the element if it has a marker name (e.g. a new element) and return it"""
+        if element.tag in MARKER_NAMES:
+            self._marked.append(element)
+        return element
+
+    def rename(self, element, new_name):
+        set_name(element, new_name)
+        self.track(element)
+
+    def unwrap(self, element):
+        self.rename(element, 'to_unwrap')
+
+    def decompose(self, element):
+        self.rename(element, 'to_decompose')
+
+    def sync(self):
+        """Apply the marks on the elements which still have the marker name and are still in the tree"""
+        marked, self._marked = self._marked, []
+        to_unwrap = []
+        for element in marked:
+            if element.getparent() is not None:
+                if element.tag == 'to_decompose':
+                    decompose(element)
+                elif element.tag == 'to_unwrap':
+                    to_unwrap.append(element)
+        for element in to_unwrap:
+            if element.getparent() is not None:  # Unwrapped already if it is marked twice
+                unwrap(element)
+
+
+def complex_wrapping(root_tag, default_wrapper, article_url, tei_logger):
+    """Wrap the texts and inline elements directly under root_tag into default_wrapper elements
+        (see complex_wrapping in tei_utils.py)
+    """
+    tei_logger.log('DEBUG', f'complex_wrapping in {article_url}')
+    naked_text = immediate_text(root_tag) > 0
+    child_tags = {c.tag for c in root_tag}
+    if child_tags <= INLINE_TAGS and root_tag.tag not in MEDIA_DICT.keys():
+        wrap(root_tag, new_element(root_tag.tag))
+        root_tag.tag = default_wrapper
+    elif naked_text or len(INLINE_TAGS & child_tags) > 0 or \
+            (child_tags <= INLINE_TAGS and root_tag.tag in MEDIA_DICT.keys()):
+        root_contents = []
+        naked_text_and_inline_tag = None
+        for elem in contents(root_tag):
+            if isinstance(elem, str) and not elem.isspace() or not isinstance(elem, str) and elem.tag in INLINE_TAGS:
+                if naked_text_and_inline_tag is None:
+                    naked_text_and_inline_tag = new_element(default_wrapper)
+                append_item(naked_text_and_inline_tag, elem)
+            elif not isinstance(elem, str):
+                if naked_text_and_inline_tag is not None:
+                    root_contents.append(naked_text_and_inline_tag)
+                root_contents.append(elem)
+                naked_text_and_inline_tag = None
+        if naked_text_and_inline_tag is not None:
+            root_contents.append(naked_text_and_inline_tag)
+        set_contents(root_tag, root_contents)
+
+
+def normal_tag_to_tei_xml_converter(article):
+    """It replaces the temporary label names with valid TEI labels and inserts the extra levels required by the TEI"""
+    for tag in find_all(article):
+        tag_name = tag.tag
+        if tag_name in XML_CONVERT_DICT.keys():
+            tag.tag = XML_CONVERT_DICT[tag_name]
+        elif tag_name in TAGNAME_AND_ATTR_TABLE:
+            tag.tag = TAGNAME_AND_ATTR_TABLE[tag_name][0]
+            set_attrs(tag, {'rend': TAGNAME_AND_ATTR_TABLE[tag_name][1]})
+        elif tag_name == 'vez_bekezdes':
+            wrap(tag, new_element('floatingText', type='lead'))
+            tag.tag = 'body'
+        elif tag_name == 'doboz':
+            f = next((c for c in article if c.tag == 'media_tartalom'), None)
+            if f is not None:
+                wrap(f, new_element('p'))
+            wrap(tag, new_element('floatingText', type='frame'))
+            tag.tag = 'body'
+        elif tag_name == 'kviz':
+            wrap(tag, new_element('floatingText', type='quiz'))
+            tag.tag = 'body'
+        elif tag_name == 'forum':
+            wrap(tag, new_element('div', type='forum'))
+            tag.tag = 'body'
+        elif tag_name == 'galeria':
+            wrap(tag, new_element('floatingText', type='gallery'))
+            tag.tag = 'body'
+            for f in find_children(tag, 'media_tartalom'):
+                wrap(f, new_element('p'))
+        elif tag_name == 'kozvetites':
+            tag.tag = 'div'
+            set_attrs(tag, {'type': 'feed'})
+        elif tag_name == 'komment':
+            tag.tag = 'div'
+            set_attrs(tag, {'type': 'comment'})
+        elif tag_name == 'komment_root':
+            tag.tag = 'div'
+            set_attrs(tag, {'type': 'comments_container'})
+        elif tag_name == 'valaszblokk':
+            tag.tag = 'list'
+            set_attrs(tag, {'type': 'quiz'})
+        elif tag_name == 'social_media':
+            flo_root = new_element('floatingText', type='social_media_content')
+            convert_link_to_facs_and_make_notes(flo_root, tag)
+            flo_root.attrib.update(tag.attrib)
+            wrap(tag, flo_root)
+            tag.tag = 'body'
+            tag.attrib.clear()
+            if len(tag) == 0:
+                tag.append(new_element('p'))
+        elif tag_name in FIGURE_REND_ATTRS:
+            rend = FIGURE_REND_ATTRS[tag_name]
+            tag.tag = 'figure'
+            tag.set('rend', rend)
+            convert_link_to_facs_and_make_notes(tag, tag)
+        elif tag_name == 'oszlop_sor':
+            wrap(tag, new_element('row'))
+            tag.tag = 'cell'
+        elif tag_name == 'oszlop_valid':
+            tag.tag = 'cell'
+            for p in find_children(tag, 'bekezdes'):
+                unwrap(p)
+        elif tag_name == 'hivatkozas':
+            tag.tag = 'ref'
+            if 'original' in tag.attrib:
+                if 'target' in tag.attrib:
+                    tag.set('type', 'corrected')
+                else:
+                    tag.set('type', 'deleted')
+                tag.set('resp', 'script')
+                note = new_element('note')
+                origi_ref = etree.SubElement(note, 'ref', type='original')
+                origi_ref.text = tag.get('original')
+                tag.append(note)
+                del tag.attrib['original']
+
+
+def convert_link_to_facs_and_make_notes(flo_root, tag):
+    """Helper function to normal_tag_to_tei_xml_converter"""
+    if 'target' in tag.attrib:
+        flo_root.set('facs', tag.get('target'))
+        del tag.attrib['target']
+    if 'original' in tag.attrib:
+        tag.set('type', 'corrected')
+        tag.set('resp', 'script')
+
+        note = new_element('note')
+        note.text = tag.get('original')
+        del tag.attrib['original']
+        note.set('corresp', 'facs')
+        tag.append(note)
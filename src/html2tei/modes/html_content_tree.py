@@ -7,7 +7,8 @@ from os.path import join as os_path_join
 from json import dumps as json_dumps, loads as json_loads
 
 from ..tei_utils import to_friendly
-from ..workflow_helpers.processing_utils import run_single_process, dummy_fun, process_article
+from ..workflow_helpers.processing_utils import run_single_process, run_multiple_process_map_reduce, dummy_fun, \
+    process_article
 
 
 def collect_tags_recursively(out_dict, article_url, tag, excluded_tags_fun):
@@ -33,16 +34,30 @@ def nested_dict():
     return defaultdict(nested_dict)  # Recursive definition!
 
 
+def merge_nested_dicts(local_out_dict, out_dict, out_files):
+    """Merge the tree of a worker into the accumulator (union of the nested dictionaries).
+       This is a recursive function!
+    """
+    for tag_name, local_children in local_out_dict.items():
+        merge_nested_dicts(local_children, out_dict[tag_name], out_files)
+
+
 def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_level_params, rest_config_params):
     """Init variables for processing a portal: HTML Content Tree (This is the only public function of this file)"""
-    _ = log_dir, run_params, warc_level_params  # Silence IDE
+    _ = log_dir, warc_level_params  # Silence IDE
 
     article_root_params, decompose_spec, excluded_tags_spec = rest_config_params[1:4]
 
+    run_parallel = run_params.get('run_parallel', False)
+
     # The internal structure of the accumulator is defined in nested_dict function
     accumulator = nested_dict()
-    # No files and after processing needed for each article
-    after_article_fun, after_article_params, log_file_names_and_modes = dummy_fun, (), ()
+    if run_parallel:
+        # The local accumulators of the workers are merged into the accumulator after each batch of articles
+        after_article_fun, after_article_params, log_file_names_and_modes = merge_nested_dicts, accumulator, ()
+    else:
+        # No files and after processing needed for each article
+        after_article_fun, after_article_params, log_file_names_and_modes = dummy_fun, (), ()
     # Filenames for the final function
     final_filenames_and_modes = ((os_path_join(output_dir, f'{portal_name}_tree.txt'), 'w'),)
     # Run this function after all articles are processed
@@ -60,8 +75,11 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
     #  - the parameters for the subfunction (accumulator)
     process_article_params = (tei_logger, article_root_params, decompose_spec, excluded_tags_spec,
                               collect_tags_recursively, (accumulator,))
-    # Runner function (some task can be run only in single-process mode)
-    run_fun = run_single_process
+    # Runner function (map-reduce in parallel mode)
+    if run_parallel:
+        run_fun = run_multiple_process_map_reduce
+    else:
+        run_fun = run_single_process
 
     return accumulator, after_article_fun, after_article_params, log_file_names_and_modes, final_filenames_and_modes, \
         final_fun, process_article_fun, process_article_params, run_fun
@@ -1,32 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
-from copy import copy
+from functools import partial
 from collections import defaultdict
 from uuid import uuid5, NAMESPACE_URL
 from os.path import join as os_path_join
 from datetime import datetime, MAXYEAR, MINYEAR
 
-from bs4 import BeautifulSoup
+from ..workflow_helpers.validate_hash_zip import DEFAULT_TEI_SCHEMA, init_output_writer, validate_and_hash_tei, \
+    keep_complete_lines
+from ..workflow_helpers.tei_template import TEI_SERIALIZERS, tei_template, TeiArticle
+from ..workflow_helpers.stage_timing import start_stage_timing, stop_stage_timing, stage_checkpoint, StageStatistics
+from ..workflow_helpers.processing_utils import run_single_process, run_multiple_process, \
+    run_multiple_process_read_in_workers
 
-from ..tei_utils import create_new_tag_with_string
-from ..workflow_helpers.validate_hash_zip import init_output_writer
-from ..workflow_helpers.processing_utils import run_single_process, run_multiple_process
 
-DUPL_METAS = {'sch:keywords', 'sch:author', 'sch:contentLocation', 'sch:artist', 'sch:source'}
-
-
-def tei_writer(warc_date, warc_id, xml_string, meta_data, article_body_contents, multipage_warc_datas=None):
+def tei_writer(warc_date, warc_id, xml_string, meta_data, article_body_contents, multipage_warc_datas=None,
+               tei_serializer='prettify', return_tree=False):
     """
     Function for writing an article into a file in TEI format
      The input dictionary is used to generate tags from key-value pairs except special keys which are handled separately
     :param warc_date:
     :param warc_id:
-    :param xml_string:
+    :param xml_string: the base TEI XML of the portal (parsed only once in each process, see TeiTemplate)
     :param meta_data: a prepared dictionary contains the meta-data to be written
     :param article_body_contents: a list of Tag()-s which is written without further examination.
        Note: Individual subtrees must be cleaned before this function!
     :param multipage_warc_datas
+    :param tei_serializer: the serializer of the TEI XML (see TEI_SERIALIZERS)
+    :param return_tree: return the lxml tree of the TEI XML as well (None if it was serialized by prettify,
+       see TeiTemplate.write_with_tree)
     """
     url = meta_data['sch:url']
     art_date_pub = meta_data['sch:datePublished']
@@ -39,144 +42,38 @@ def tei_writer(warc_date, warc_id, xml_string, meta_data, article_body_contents,
         meta_data['sch:datePublished'] = art_date_pub.isoformat()
     else:
         art_date_pub_fn = 'unknown_date'
-    art_date_mod = ''
+    art_date_mod = None
     if 'sch:dateModified' in meta_data.keys():
         art_date_mod = meta_data['sch:dateModified'].isoformat()
         meta_data['sch:dateModified'] = art_date_mod
     final_name = os_path_join(str(art_date_pub_fn), tei_pid)
     final_suff = '.xml'
-    article_author = None
-    article_title = meta_data['sch:name']
-    if 'sch:author' in meta_data.keys():
+    article_author = ()
+    if 'sch:author' in meta_data.keys() and meta_data['sch:author'] is not None:
         article_author = meta_data['sch:author']
-    beauty_xml = BeautifulSoup(xml_string, features='lxml-xml')
-
-    # TEI <fileDesc>
-    file_title = beauty_xml.find('titleStmt')
-    if article_title is not None:
-        file_title = beauty_xml.find('titleStmt')
-        file_title.title.string = article_title
-    idno = beauty_xml.find('idno')
-    idno.string = str(tei_pid)
-
-    # Adding the writer in the code below because it should be in sourceDesc in the same way
+    article_sources = ()
     if 'sch:source' in meta_data.keys():
-        for one_source in meta_data['sch:source']:
-            org_tag = beauty_xml.new_tag('orgName')
-            org_tag.string = one_source
-            source_org_root = beauty_xml.new_tag('respStmt')
-            source_org_root.append(beauty_xml.new_tag('resp'))
-            source_org_root.append(org_tag)
-            file_title.append(source_org_root)
-
-    # TEI <sourceDesc><bibl>
-    sourcedesc = beauty_xml.find('sourceDesc')
-    source_date_tag = sourcedesc.find_all('date')[2]
-    if art_date_pub is not None:
-        source_date_tag.attrs = {'when': art_date_pub.isoformat()}
-    else:
-        source_date_tag.attrs = {'when-custom': 'unknown'}
-    if article_title is not None:
-        sourcedesc.title.string = article_title
-    if article_author is not None and len(article_author) != 0:
-        for author_name in article_author:
-            author_tag = beauty_xml.new_tag('author')
-            one_name = beauty_xml.new_tag('persName')
-            one_name.string = author_name.strip()
-            author_tag.append(one_name)
-            file_title.append(author_tag)
-            sourcedesc_author = copy(author_tag)
-            sourcedesc.find('title').insert_after(sourcedesc_author)
-
-    # XENODATA 1: metadata of article source
-    xeno_meta_datas = beauty_xml.find('rdf:Description')
-    xeno_meta_datas.attrs['rdf:about'] = url
-    for k, v in meta_data.items():
-        if v is not None:
-            if k == 'subsection':
-                one_meta = beauty_xml.new_tag('sch:articleSection')
-                one_meta.string = v
-                xeno_meta_datas.find('sch:articleSection').append(one_meta)
-            elif k in DUPL_METAS:
-                for dupl in v:
-                    create_new_tag_with_string(beauty_xml, dupl, k, xeno_meta_datas)
-            else:
-                if k == 'sch:inLanguage':
-                    xeno_meta_datas.find('sch:inLanguage').string = v
-                else:
-                    create_new_tag_with_string(beauty_xml, v, k, xeno_meta_datas)
-
-    # XENODATA 2: warc data
-    xeno_tei_rdf = ''
-    for rdf in beauty_xml.find_all('rdf:Description'):
-        if rdf.attrs['rdf:about'] == 'teiPid':
-            xeno_tei_rdf = rdf
-            rdf.attrs['rdf:about'] = tei_pid
-
-    # XENO 3: TEI file data + article warc response data
-    xeno_tei_rdf.find('sch:identifier').string = warc_id[1:-1]
-    current_time = datetime.today().isoformat()
-    xeno_tei_rdf.find('sch:sdDatePublished').string = current_time
-    warc_date_string = warc_date.isoformat()
-    xeno_tei_rdf.find('sch:lastReviewed').string = warc_date_string
-
-    # revisionDesc
-    revision_desc = beauty_xml.find('revisionDesc')
-    # Default change tag is already present in the XML skeleton
-    change = revision_desc.change
-    change.attrs['when'] = current_time
-    change.attrs['source'] = tei_pid
-    if 'sch:dateModified' in meta_data.keys():
-        change_art_modified = beauty_xml.new_tag('change', when=art_date_mod, source=url)
-        change_art_modified.string = 'article modified'
-        revision_desc.append(change_art_modified)
-
-    # FILL TEI BODY
-    body = beauty_xml.body
-    if article_title is None:
-        article_title = 'unknown'
-    article_title_tag = beauty_xml.new_tag('head', type='title')
-    article_title_tag.string = article_title
-    body.append(article_title_tag)
+        article_sources = meta_data['sch:source']
+    article_alternate_title = None
     if 'sch:alternateName' in meta_data.keys():
         article_alternate_title = meta_data['sch:alternateName']
-        article_subtitle_tag = beauty_xml.new_tag('head', type='subtitle')
-        article_subtitle_tag.string = article_alternate_title
-        body.append(article_subtitle_tag)
-    if article_body_contents == 'EMPTY ARTICLE':
-        tei_change = beauty_xml.find('change', source=True)
-        empty_body_note = beauty_xml.new_tag('note')
-        tei_change.append(empty_body_note)
-        empty_body_note.string = 'A cikk tartalma az archiválás pillanatában nem volt elérhető./' \
-                                 'The content of the article was not available at the time of archiving.'
-        body.append(beauty_xml.new_tag('p'))
-    elif isinstance(article_body_contents, list):
+
+    if isinstance(article_body_contents, list):
         for i, main_subtrees in enumerate(article_body_contents):
             if main_subtrees.name == 'div' and 'type' in main_subtrees.attrs.keys() and \
                     main_subtrees.attrs['type'] == 'comments_container':
                 main_subtrees.attrs['corresp'] = tei_pid
                 main_subtrees.attrs['source'] = url
                 break
-        body.extend(article_body_contents)
-    elif isinstance(article_body_contents, dict):
-        for url, page_contents in article_body_contents.items():
-            div = beauty_xml.new_tag('div')
-            div.attrs = {'source': url, 'type': 'page'}
-            div.extend(page_contents)
-            body.append(div)
-    if multipage_warc_datas is not None:
-        note_tag = beauty_xml.new_tag('note')
-        note_tag.string = 'WARC response data per URL:'
-        for url_k, (w_id, w_d) in multipage_warc_datas.items():
-            note_p = beauty_xml.new_tag('p')
-            create_new_tag_with_string(beauty_xml, url_k, 'ref', note_p)
-            create_new_tag_with_string(beauty_xml, w_id[1:-1], 'idno', note_p)
-            create_new_tag_with_string(beauty_xml, w_d.isoformat(), 'date', note_p)
-            note_tag.append(note_p)
-        tei_change = beauty_xml.find('change', source=True)
-        tei_change.append(note_tag)
-    pretty_xml = beauty_xml.prettify().encode('UTF-8')
-    return final_name, final_suff, pretty_xml, art_date_pub
+
+    article = TeiArticle(tei_pid, url, meta_data['sch:name'], article_alternate_title, article_sources, article_author,
+                         art_date_pub.isoformat() if art_date_pub is not None else None, art_date_mod, meta_data,
+                         warc_id[1:-1], warc_date.isoformat(), datetime.today().isoformat(), article_body_contents,
+                         multipage_warc_datas)
+    tei_xml, tei_tree = tei_template(xml_string, tei_serializer).write_with_tree(article)
+    if return_tree:
+        return final_name, final_suff, tei_xml, art_date_pub, tei_tree
+    return final_name, final_suff, tei_xml, art_date_pub
 
 
 def merge_multipage_article_metadata(multipage_article):
@@ -221,15 +118,18 @@ def process_multipage_article(article_tup_list, process_article_and_spec_params)
     """Process the pages of multi-page articles one after the other"""
     # Get the url, WARC response date and WARC ID for the first page of the article
     first_url, first_article_warc_resp_date, first_article_warc_id, _ = article_tup_list[0]
-    (tei_logger, base_xml_string, get_meta_fun, write_out_mode), spec_body_params = process_article_and_spec_params
+    (tei_logger, base_xml_string, get_meta_fun, write_out_mode, _, _, _, _), spec_body_params = \
+        process_article_and_spec_params
     multipage_article = []
     for article_tup in article_tup_list:
         # Pass to the paragraph extractor function and collect WARC metadata to list
         metas_in_dict, converted_body = write_out_mode(article_tup, tei_logger, get_meta_fun, spec_body_params)
+        stage_checkpoint('write_out_mode')
         multipage_article.append((metas_in_dict, converted_body, article_tup))
 
     merged_meta_dict, converted_body_dict, all_warc_datas_tup_for_note = \
         merge_multipage_article_metadata(multipage_article)
+    stage_checkpoint('merge_multipage_metadata')
     return first_url, first_article_warc_resp_date, first_article_warc_id, base_xml_string, merged_meta_dict, \
         converted_body_dict, all_warc_datas_tup_for_note
 
@@ -242,14 +142,18 @@ def process_article_clean(params):
         (e.g. writing the output to files)
     """
     article_tup_list, process_article_and_spec_params = params
-    converted_body, tei_data = None, (None, None, None, None)
+    converted_body, tei_data, tei_verdict = None, (None, None, None, None), None
+    (tei_logger, base_xml_string, get_meta_fun, write_out_mode, time_stages, count_stage_nodes, tei_serializer,
+     tei_check_params), spec_body_params = process_article_and_spec_params
+    if time_stages:
+        start_stage_timing(count_stage_nodes)
     if len(article_tup_list) == 1:  # Process single-page article
-        (tei_logger, base_xml_string, get_meta_fun, write_out_mode), spec_body_params = process_article_and_spec_params
         first_page_of_article = article_tup_list[0]
         first_url, warc_response_datetime, warc_id, raw_html = first_page_of_article
 
         metas_in_dict, converted_body = write_out_mode(first_page_of_article, tei_logger, get_meta_fun,
                                                        spec_body_params)
+        stage_checkpoint('write_out_mode')  # The rest of the write-out mode after its last checkpoint (if any)
         all_warc_datas_tup_for_note = None
     else:  # Process multi-page article
         # write_out_mode is passed into process_multipage_article with process_article_and_spec_params
@@ -266,34 +170,57 @@ def process_article_clean(params):
             all_warc_datas_tup_for_note = process_multipage_article(article_tup_list, process_article_and_spec_params)
     # Create TEI XML if the conversion was successful
     if metas_in_dict is not None and converted_body is not None:
-        tei_data = tei_writer(warc_response_datetime, warc_id, base_xml_string, metas_in_dict, converted_body,
-                              all_warc_datas_tup_for_note)
+        *tei_data, tei_tree = tei_writer(warc_response_datetime, warc_id, base_xml_string, metas_in_dict,
+                                         converted_body, all_warc_datas_tup_for_note, tei_serializer, return_tree=True)
+        stage_checkpoint('tei_writer')
+        # Validate, hash and compress the TEI XML here (in parallel) instead of the output writer (sequential)
+        #  The tree built by tei_writer is validated (if there is any) instead of parsing the serialized form again
+        if tei_check_params is not None:
+            tei_verdict = validate_and_hash_tei(tei_data[2], tei_check_params, tei_logger, tei_tree)
+            stage_checkpoint('validate_and_hash_tei')
 
-    return first_url, tei_data
+    # The stage times and counters are None if time_stages is False
+    return first_url, tei_data, warc_response_datetime, tei_verdict, stop_stage_timing()
 
 
-def after_clean(ret, validator_hasher_compressor, file_handles):
+def after_clean(ret, validator_hasher_compressor_and_stage_statistics, file_handles):
     """This function write the processed article (process_article_clean, tei_writer) into the output:
         - the URL to the url_list or bad_article_urls file
         - the XML to the validator_hasher_compressor
-       The input parameters are the url and the output of tei_writer.
+        - the stage times and counters to the stage statistics (if the stages were timed)
+       The input parameters are the url, the output of tei_writer, the WARC date of the (first page of the) article,
+        the verdict of validate_and_hash_tei (None if the XML is validated and hashed by the
+        validator_hasher_compressor) and the stage times and counters.
+       The URLs are written out immediately (they are the completion journal of a killed run: every file in a closed
+        shard of the output must be listed, see read_completion_journal)
        The function returns the extracted publish_date or None if no tei_string could be extracted
     """
-    url, (desired_filename, filename_suff, tei_string, publish_date) = ret
+    url, (desired_filename, filename_suff, tei_string, publish_date), warc_date, tei_verdict, \
+        stage_times_and_counters = ret
+    validator_hasher_compressor, stage_statistics = validator_hasher_compressor_and_stage_statistics
     url_list, bad_article_urls, date_container = file_handles
+    if stage_times_and_counters is not None:
+        stage_statistics.add(url, *stage_times_and_counters)
     if tei_string is not None:
-        final_filename = validator_hasher_compressor.process_one_file(url, desired_filename, filename_suff, tei_string)
-        print(url, final_filename, file=url_list)
+        final_filename = validator_hasher_compressor.process_one_file(url, desired_filename, filename_suff, tei_string,
+                                                                      tei_verdict, publish_date, warc_date)
+        print(url, final_filename, file=url_list, flush=True)
         if publish_date is not None:
             return publish_date
     else:
-        print(url, file=bad_article_urls)
+        print(url, file=bad_article_urls, flush=True)
 
 
-def final_clean(dates, out_files, warc_date_interval, tei_logger):
-    """Produce the final form of the aggregated information after a WARC has been processed: dates into the logger"""
+def final_clean(stage_statistics, output_writer, dates, out_files, warc_date_interval, tei_logger):
+    """Produce the final form of the aggregated information after a WARC has been processed: dates into the logger
+        and the stage time report into the stage times file and the stage counters into the logger
+         (if the stages were timed). The output writer is closed (e.g. the buffered records are written)
+    """
+    output_writer.close()
     date_min, date_max = dates
-    _ = out_files  # Silence IDE
+    if len(out_files) > 0:
+        stage_statistics.write_report(out_files[0])
+        stage_statistics.log_counters(tei_logger)
     if date_max != datetime(MINYEAR, 1, 1) and date_min != datetime(MAXYEAR, 1, 1):
         tei_logger.log('INFO', 'first date:', date_min.isoformat())
         tei_logger.log('INFO', 'last date:', date_max.isoformat())
@@ -301,6 +228,20 @@ def final_clean(dates, out_files, warc_date_interval, tei_logger):
     tei_logger.log('INFO', 'warc last date:', warc_date_interval['date_max'])
 
 
+def read_completion_journal(url_list_filename, bad_article_urls_filename, output_writer):
+    """Read the URLs of the articles done in a previous (interrupted) run from the url_list and bad_article_urls files
+        written by after_clean. An article in the url_list counts only if its file is actually stored by the output
+        writer (e.g. not in an incomplete zipfile), the other lines are dropped as the articles will be processed again
+    """
+    def is_stored(line):
+        _, final_filename = line.rsplit(' ', maxsplit=1)
+        return output_writer.is_stored(final_filename)
+
+    done_urls = {line.rsplit(' ', maxsplit=1)[0] for line in keep_complete_lines(url_list_filename, is_stored)}
+    done_urls.update(keep_complete_lines(bad_article_urls_filename))
+    return done_urls
+
+
 def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_level_params, rest_config_params):
     """Init variables for processing a portal: Portal Article Cleaner (This is the only public function of this file)"""
 
@@ -329,16 +270,61 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
     # The function to run after processing each article with process_article_clean
     #  (involves writing to files, which must be done sequentially even if the rest is done in parallel)
     after_article_fun = after_clean
-    # The only extra parameter for after_article_fun is the output writer class (validator-hasher-compressor)
-    after_article_params = init_output_writer(output_dir, portal_name, output_debug, tei_logger)
+    resume = run_params.get('resume', False)
+    # The RelaxNG schema to validate the output with (URL or local file, see relaxng_validator)
+    tei_schema = run_params.get('tei_schema', DEFAULT_TEI_SCHEMA)
+    # The format of the output of the valid TEI XMLs (see OUTPUT_SINKS), the limits of its shards
+    #  and the compression of the zipfile members (compressed in the workers)
+    output_sink = run_params.get('output_sink', 'zip')
+    max_shard_megabytes = run_params.get('max_shard_megabytes')
+    # The shards are also closed periodically as the checkpoints of an interrupted run (0 or None: no limit)
+    max_shard_minutes = run_params.get('max_shard_minutes')
+    sink_params = {'max_shard_bytes': max_shard_megabytes * 2**20 if max_shard_megabytes is not None else None,
+                   'max_shard_members': run_params.get('max_shard_members'),
+                   'max_shard_seconds': max_shard_minutes * 60 if max_shard_minutes else None}
+    if output_sink == 'zip':
+        sink_params['compression'] = run_params.get('zip_compression', 'stored')
+        sink_params['compresslevel'] = run_params.get('zip_compresslevel')
+    elif run_params.get('zip_compression', 'stored') != 'stored' or run_params.get('zip_compresslevel') is not None:
+        tei_logger.log('WARNING', f'The zipfile compression parameters are ignored by the {output_sink} output sink!')
+    output_writer = init_output_writer(output_dir, portal_name, output_debug, tei_logger, resume, tei_schema,
+                                       output_sink, sink_params)
+    # The serializer of the TEI XML output (prettify is the original, byte-compatible output)
+    tei_serializer = run_params.get('tei_serializer', 'prettify')
+    if tei_serializer not in TEI_SERIALIZERS:
+        tei_logger.log('CRITICAL', f'{tei_serializer} is not in the allowed value set ({set(TEI_SERIALIZERS)})!')
+        exit(1)
+    # Check the base TEI XML (the workers parse it once for themselves)
+    try:
+        tei_template(portal_xml_string, tei_serializer)
+    except ValueError as err:
+        tei_logger.log('CRITICAL', f'{portal_name}: {err}!')
+        exit(1)
+    # Time the stages of processing and report the aggregated times (opt-in as it has some overhead)
+    time_stages = run_params.get('time_stages', False)
+    count_stage_nodes = run_params.get('count_stage_nodes', False)
+    stage_statistics = StageStatistics()
+    # The extra parameters for after_article_fun are the output writer class (validator-hasher-compressor)
+    #  and the aggregator of the stage times
+    after_article_params = (output_writer, stage_statistics)
     # The filenames (and modes) to be written into in after_article_fun
-    log_file_names_and_modes = ((os_path_join(log_dir, f'{portal_name}_urls.txt'), 'a'),
-                                (os_path_join(log_dir, f'{portal_name}_bad_urls.txt'), 'a'),
+    #  (url_list and bad_article_urls are the completion journal of the portal used for resuming)
+    url_list_filename = os_path_join(log_dir, f'{portal_name}_urls.txt')
+    bad_article_urls_filename = os_path_join(log_dir, f'{portal_name}_bad_urls.txt')
+    log_file_names_and_modes = ((url_list_filename, 'a'),
+                                (bad_article_urls_filename, 'a'),
                                 (os_path_join(log_dir, f'{portal_name}_date_container.txt'), 'a'))
+    if resume:
+        # Skip the articles done in the previous run (the URLs are filtered in aggregated_multipage_articles_gen)
+        done_urls = read_completion_journal(url_list_filename, bad_article_urls_filename, output_writer)
+        warc_level_params[8].update(done_urls)
+        tei_logger.log('INFO', f'Resuming: {len(done_urls)} articles are already done')
     # Filenames for the final function
     final_filenames_and_modes = ()
+    if time_stages:
+        final_filenames_and_modes = ((os_path_join(log_dir, f'{portal_name}_stage_times.tsv'), 'w'),)
     # Run this function after all articles are processed
-    final_fun = final_clean
+    final_fun = partial(final_clean, stage_statistics, output_writer)
     # Process articles one by one with this function
     process_article_fun = process_article_clean
     # Task specific params (process_article_clean):
@@ -346,14 +332,21 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
     #  - the portal-specific base TEI XML in string format
     #  - the portal-specific get_meta function
     #  - the write-out mode (e.g. Custom Article Body Converter, JusText, Newspaper3k)
-    process_article_clean_params = [tei_logger, portal_xml_string, get_meta_fun_spec, write_out_mode]  # Must be list!
+    #  - time the stages of processing or not
+    #  - count the tags after the stages or not (it walks the whole tree at every stage)
+    #  - the serializer of the TEI XML output
+    #  - the schema, the hash algorithms and the compression of the output writer to validate, hash and compress
+    #     the TEI XML before writing it (None if the output writer does not validate, see validate_and_hash_tei)
+    process_article_clean_params = [tei_logger, portal_xml_string, get_meta_fun_spec, write_out_mode,
+                                    time_stages, count_stage_nodes, tei_serializer,
+                                    output_writer.tei_check_params]  # Must be list!
     # Params for write_out_mode from the loaded portal-specific configuration
     # The different write_out_mode implementations are defined in article_body_converters"
     #  - article root params for find_all
     #  - portal-specific decompose functions
     #  - portal-specific simplification rules for the different parts of the attributes,
     #     with merging the irrelevant variations of values
-    #  - tag_normal_dict the normalized names of the tags mapped to the simplified tagnames
+    #  - tag_normal_dict the compiled actions (normalized names) of the tags mapped to the simplified tagnames
     #  - links tagnames which could contain attributes to be preserved to help later disambiguation (div, etc.)
     #  - portal_specific_block_rules portal-specific block renaming rules
     #  - bigram_rules_spec portal-specific bigram rules
@@ -365,7 +358,10 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
     process_article_params = (process_article_clean_params, portalspec_params_and_dicts)
 
     # Runner function (some task can be run only in single-process mode)
-    if run_parallel:
+    if run_parallel and run_params.get('read_in_workers', False):
+        # The workers read and decode the WARC records themselves
+        run_fun = run_multiple_process_read_in_workers
+    elif run_parallel:
         run_fun = run_multiple_process
     else:
         run_fun = run_single_process
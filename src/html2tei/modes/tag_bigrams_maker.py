@@ -6,7 +6,8 @@ from os.path import join as os_path_join
 from random import sample as random_sample
 
 from ..tei_utils import to_friendly
-from ..workflow_helpers.processing_utils import run_single_process, dummy_fun, process_article
+from ..workflow_helpers.processing_utils import run_single_process, run_multiple_process_map_reduce, dummy_fun, \
+    process_article
 
 
 def summarize_tag_bigrams(tag_dict, mode_recursive, article_url, article_body_root, excluded_tags_fun):
@@ -31,6 +32,20 @@ def summarize_tag_bigrams(tag_dict, mode_recursive, article_url, article_body_ro
                 tag_dict[a_b_name][1].add(article_url)
 
 
+def new_bigram_summary():
+    """The default value of the accumulator (see summarize_tag_bigrams)"""
+    return [0, set()]
+
+
+def merge_bigram_dicts(local_tag_dict, tag_dict, out_files):
+    """Merge the bigram summaries of a worker into the accumulator (the frequencies add, the URL sets are united)"""
+    _ = out_files  # Silence IDE
+    for a_b_name, (freq, all_links) in local_tag_dict.items():
+        bigram_summary = tag_dict[a_b_name]
+        bigram_summary[0] += freq
+        bigram_summary[1].update(all_links)
+
+
 def final_bigram(dates, out_files, tag_dict, tei_logger):
     """Produce the final form of the aggregated information after a WARC has been processed into the table:
         - the frequency for each tag bigram
@@ -56,10 +71,16 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
         tei_logger.log('CRITICAL', 'recursive is not set in run_params!')
         exit(1)
 
+    run_parallel = run_params.get('run_parallel', False)
+
     # The internal structure of the accumulator is defined in summarize_tag_bigrams function
-    accumulator = defaultdict(lambda: [0, set()])
-    # No files and after processing needed for each article
-    after_article_fun, after_article_params, log_file_names_and_modes = dummy_fun, (), ()
+    accumulator = defaultdict(new_bigram_summary)
+    if run_parallel:
+        # The local accumulators of the workers are merged into the accumulator after each batch of articles
+        after_article_fun, after_article_params, log_file_names_and_modes = merge_bigram_dicts, accumulator, ()
+    else:
+        # No files and after processing needed for each article
+        after_article_fun, after_article_params, log_file_names_and_modes = dummy_fun, (), ()
     # Filenames for the final function
     final_filenames_and_modes = ((os_path_join(output_dir, f'{portal_name}_bigrams.tsv'), 'w'),)
     # Run this function after all articles are processed
@@ -77,8 +98,11 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
     #  - the parameters for the subfunction
     process_article_params = (tei_logger, article_root_params, decompose_spec, excluded_tags_spec,
                               summarize_tag_bigrams, (accumulator, recursive))
-    # Runner function (some task can be run only in single-process mode)
-    run_fun = run_single_process
+    # Runner function (map-reduce in parallel mode)
+    if run_parallel:
+        run_fun = run_multiple_process_map_reduce
+    else:
+        run_fun = run_single_process
 
     return accumulator, after_article_fun, after_article_params, log_file_names_and_modes, final_filenames_and_modes, \
         final_fun, process_article_fun, process_article_params, run_fun
@@ -6,7 +6,8 @@ from os.path import join as os_path_join
 from random import sample as random_sample
 
 from ..tei_utils import immediate_text, to_friendly
-from ..workflow_helpers.processing_utils import run_single_process, dummy_fun, process_article
+from ..workflow_helpers.processing_utils import run_single_process, run_multiple_process_map_reduce, dummy_fun, \
+    process_article
 
 
 def summarize_children_or_subtree(tag_dict, recursive, article_url, article_body_root, excluded_tags_fun):
@@ -28,6 +29,23 @@ def summarize_children_or_subtree(tag_dict, recursive, article_url, article_body
         tag_dict[tag_name][4] += immediate_text(article_tag)
 
 
+def new_tag_summary():
+    """The default value of the accumulator (see summarize_children_or_subtree)"""
+    return [0, 0, 0, set(), 0]
+
+
+def merge_tag_dicts(local_tag_dict, tag_dict, out_files):
+    """Merge the tag summaries of a worker into the accumulator (the counts and sums add, the URL sets are united)"""
+    _ = out_files  # Silence IDE
+    for tag_name, (freq, no_of_words, no_of_descendants, all_links, len_of_immediate_text) in local_tag_dict.items():
+        tag_summary = tag_dict[tag_name]
+        tag_summary[0] += freq
+        tag_summary[1] += no_of_words
+        tag_summary[2] += no_of_descendants
+        tag_summary[3].update(all_links)
+        tag_summary[4] += len_of_immediate_text
+
+
 def final_summarize_children_or_subtree(dates, out_files, tag_dict, tei_logger):
     """Produce the final form of the aggregated information after a WARC has been processed into text or notext tables:
         - the frequency for each tag
@@ -73,10 +91,16 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
         tei_logger.log('CRITICAL', 'recursive is not set in run_params!')
         exit(1)
 
+    run_parallel = run_params.get('run_parallel', False)
+
     # The internal structure of the accumulator is defined in summarize_children_or_subtree function
-    accumulator = defaultdict(lambda: [0, 0, 0, set(), 0])
-    # No files and after processing needed for each article
-    after_article_fun, after_article_params, log_file_names_and_modes = dummy_fun, (), ()
+    accumulator = defaultdict(new_tag_summary)
+    if run_parallel:
+        # The local accumulators of the workers are merged into the accumulator after each batch of articles
+        after_article_fun, after_article_params, log_file_names_and_modes = merge_tag_dicts, accumulator, ()
+    else:
+        # No files and after processing needed for each article
+        after_article_fun, after_article_params, log_file_names_and_modes = dummy_fun, (), ()
     # Filenames for the final function
     final_filenames_and_modes = ((os_path_join(output_dir, f'{portal_name}_notext_tags_normal.tsv'), 'w'),
                                  (os_path_join(output_dir, f'{portal_name}_text_tags_normal.tsv'), 'w'))
@@ -95,8 +119,11 @@ def init_portal(log_dir, output_dir, run_params, portal_name, tei_logger, warc_l
     #  - the parameters for the subfunction
     process_article_params = (tei_logger, article_root_params, decompose_spec, excluded_tags_spec,
                               summarize_children_or_subtree, (accumulator, recursive))
-    # Runner function (some task can be run only in single-process mode)
-    run_fun = run_single_process
+    # Runner function (map-reduce in parallel mode)
+    if run_parallel:
+        run_fun = run_multiple_process_map_reduce
+    else:
+        run_fun = run_single_process
 
     return accumulator, after_article_fun, after_article_params, log_file_names_and_modes, final_filenames_and_modes, \
         final_fun, process_article_fun, process_article_params, run_fun
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from time import monotonic
+from os import replace as os_replace
+from itertools import dropwhile
+from os.path import exists as os_path_exists, splitext as os_path_splitext
+
+# The size of the records collected before writing them into the shard at once (see ShardedOutputSink)
+DEFAULT_BUFFER_BYTES = 8 * 2**20
+
+# Only ShardedOutputSink is used outside of this file
+
+
+def shard_filenames(filename, ext=None):
+    """Generate the filenames of the shards of an output file: NAME.EXT, NAME_1.EXT, NAME_2.EXT, ...
+        (EXT is the extension of the filename if ext is not set, e.g. for multi-part extensions as .tar.zst)
+    """
+    if ext is None:
+        filename_base, ext = os_path_splitext(filename)
+    else:
+        filename_base = filename[:-len(ext)]
+    yield filename
+    shard_num = 1
+    while True:
+        yield f'{filename_base}_{shard_num}{ext}'
+        shard_num += 1
+
+
+class ShardedOutputSink:
+    """The output of the valid TEI XMLs (the sink of ValidatorHasherCompressor) written in shards:
+        the records (filename, TEI XML, metadata, compressed zipfile member) are collected until their size reaches
+        buffer_bytes and they are written into the current shard at once (bulk writes).
+        A new shard (NAME.EXT, NAME_1.EXT, ...) is started when the current one reaches max_shard_bytes
+        or max_shard_members or it is open for max_shard_seconds (default: no limit). The closed shards are the
+        checkpoints of a killed run (the current shard is usually incomplete and can not be read).
+       When resuming an interrupted run the existing shards are never modified, the records go into a new shard.
+        The shards which can not be read are moved aside (NAME.EXT.broken) and their records are processed again.
+       The subclasses define the format: EXTENSION, _open_shard, _write_records, _close_shard and read_member_names
+        (which raises one of the exceptions in INCOMPLETE_SHARD_ERRORS for shards that can not be read)
+    """
+    EXTENSION = None
+    INCOMPLETE_SHARD_ERRORS = ()
+    # The compression of the zipfile members done in advance (e.g. in the workers, see validate_and_hash_tei)
+    compression = None
+    compresslevel = None
+
+    def __init__(self, tei_logger, filename, resume=False, max_shard_bytes=None, max_shard_members=None,
+                 max_shard_seconds=None, buffer_bytes=DEFAULT_BUFFER_BYTES):
+        self._tei_logger = tei_logger
+        self._max_shard_bytes = max_shard_bytes
+        self._max_shard_members = max_shard_members
+        self._max_shard_seconds = max_shard_seconds
+        self._buffer_bytes = buffer_bytes
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._shard_members = 0
+        self._shard_bytes = 0
+        self._shard_opened_at = 0
+        self._shard_open = False
+
+        self._shard_filenames = shard_filenames(filename, self.EXTENSION)
+        self.stored_filenames = set()
+        if resume:
+            filename = self._read_stored_filenames_from_shards(filename)
+            tei_logger.log('INFO', f'Resuming into {filename}')
+            # The next shards follow the first new one
+            self._shard_filenames = dropwhile(lambda shard_filename: shard_filename != filename,
+                                              self._shard_filenames)
+        self._open_next_shard()
+
+    def __del__(self):
+        # Else the buffered records and the essential records of the shard will not be written!
+        if getattr(self, '_shard_open', False):
+            self.close()
+
+    def _read_stored_filenames_from_shards(self, filename):
+        """Read the names of the files stored in the existing shards into stored_filenames and return the name
+            of the first new shard. An incomplete shard (e.g. a zipfile of a killed run without its central directory)
+            can not be read, so the files in it are not considered as stored and it is moved aside
+            (its name is not reused as the new shards follow the existing ones)
+        """
+        for shard_filename in shard_filenames(filename, self.EXTENSION):
+            if not os_path_exists(shard_filename):
+                return shard_filename
+            try:
+                self.stored_filenames.update(self.read_member_names(shard_filename))
+            except self.INCOMPLETE_SHARD_ERRORS:
+                os_replace(shard_filename, f'{shard_filename}.broken')
+                self._tei_logger.log('WARNING', f'{shard_filename} is incomplete, it is moved to'
+                                                f' {shard_filename}.broken and the articles stored in it will be'
+                                                f' processed again!')
+
+    def _open_next_shard(self):
+        self._open_shard(next(self._shard_filenames))
+        self._shard_open = True
+        self._shard_members = 0
+        self._shard_bytes = 0
+        self._shard_opened_at = monotonic()
+
+    def _flush(self):
+        if len(self._buffer) > 0:
+            self._shard_bytes += self._write_records(self._buffer)
+            self._buffer = []
+            self._buffered_bytes = 0
+
+    def _shard_is_full(self):
+        """Check if the current shard reached its maximal size or number of members or it is open for the maximal
+            time (an empty shard is never full)
+        """
+        shard_bytes = self._shard_bytes + self._buffered_bytes
+        return self._shard_members > 0 and \
+            (self._max_shard_members is not None and self._shard_members >= self._max_shard_members or
+             self._max_shard_bytes is not None and shard_bytes >= self._max_shard_bytes or
+             self._max_shard_seconds is not None and monotonic() - self._shard_opened_at >= self._max_shard_seconds)
+
+    def write(self, xml_filename, raw_xml_str, metadata, compressed_member=None):
+        """Write the record of a valid TEI XML: metadata is the dictionary of the URL, the TEI PID, the publication
+            date and the WARC date of the article (ISO format, the publication date can be None) and compressed_member
+            is the compressed zipfile member (see compress_member) or None
+        """
+        if self._shard_is_full():
+            self._flush()
+            self._close_shard()
+            self._open_next_shard()
+        self._buffer.append((xml_filename, raw_xml_str, metadata, compressed_member))
+        self._buffered_bytes += len(raw_xml_str) if compressed_member is None else len(compressed_member[2])
+        self._shard_members += 1
+        if self._buffered_bytes >= self._buffer_bytes:
+            self._flush()
+
+    def close(self):
+        """Write the buffered records and close the current shard"""
+        if self._shard_open:
+            self._shard_open = False
+            self._flush()
+            self._close_shard()
+
+    def _open_shard(self, shard_filename):
+        raise NotImplementedError
+
+    def _write_records(self, records):
+        """Write the records into the current shard and return the number of the bytes written"""
+        raise NotImplementedError
+
+    def _close_shard(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def read_member_names(shard_filename):
+        raise NotImplementedError
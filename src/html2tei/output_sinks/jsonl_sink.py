@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from json import dumps as json_dumps, loads as json_loads, JSONDecodeError
+
+from .base_sink import ShardedOutputSink
+
+# Only OutputSink is used outside of this file
+
+
+class OutputSink(ShardedOutputSink):
+    """JSON Lines shards (NAME.jsonl, NAME_1.jsonl, ...): one JSON object for each TEI XML with the filename,
+        the metadata (url, tei_pid, date_published, warc_date) and the TEI XML as string (tei), the shards can be read
+        and split line by line
+    """
+    EXTENSION = '.jsonl'
+    INCOMPLETE_SHARD_ERRORS = (UnicodeDecodeError, JSONDecodeError)
+
+    def __init__(self, tei_logger, filename, resume=False, max_shard_bytes=None, max_shard_members=None,
+                 max_shard_seconds=None):
+        self._fh = None
+        super().__init__(tei_logger, filename, resume, max_shard_bytes, max_shard_members, max_shard_seconds)
+
+    def _open_shard(self, shard_filename):
+        self._fh = open(shard_filename, 'wb')
+
+    def _write_records(self, records):
+        lines = [json_dumps({'filename': xml_filename, **metadata, 'tei': raw_xml_str.decode('UTF-8')},
+                            ensure_ascii=False).encode('UTF-8') + b'\n'
+                 for xml_filename, raw_xml_str, metadata, _ in records]
+        self._fh.writelines(lines)
+        return sum(len(line) for line in lines)
+
+    def _close_shard(self):
+        self._fh.close()
+
+    @staticmethod
+    def read_member_names(shard_filename):
+        """The last line of a killed run may be incomplete (JSONDecodeError), the shard is incomplete then"""
+        with open(shard_filename, 'rb') as fh:
+            return [json_loads(line)['filename'] for line in fh]
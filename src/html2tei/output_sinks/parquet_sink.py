@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .base_sink import ShardedOutputSink
+
+# The columns of the table: the metadata of the article (the dates are in ISO format) and the TEI XML
+TEI_TABLE_SCHEMA = pa.schema([('filename', pa.string()), ('url', pa.string()), ('tei_pid', pa.string()),
+                              ('date_published', pa.string()), ('warc_date', pa.string()), ('tei', pa.binary())])
+
+# Only OutputSink is used outside of this file
+
+
+class OutputSink(ShardedOutputSink):
+    """Parquet shards (NAME.parquet, NAME_1.parquet, ...) with one row for each TEI XML (see TEI_TABLE_SCHEMA).
+        The buffered records are written as one row group (compressed by zstd), so the shards can be read and split
+        by row groups (e.g. pyarrow, pandas, Spark or DuckDB)
+    """
+    EXTENSION = '.parquet'
+    INCOMPLETE_SHARD_ERRORS = (pa.ArrowInvalid, OSError)
+
+    def __init__(self, tei_logger, filename, resume=False, max_shard_bytes=None, max_shard_members=None,
+                 max_shard_seconds=None):
+        self._parquet_writer = None
+        super().__init__(tei_logger, filename, resume, max_shard_bytes, max_shard_members, max_shard_seconds)
+
+    def _open_shard(self, shard_filename):
+        self._parquet_writer = pq.ParquetWriter(shard_filename, TEI_TABLE_SCHEMA, compression='zstd')
+
+    def _write_records(self, records):
+        rows = [{'filename': xml_filename, **metadata, 'tei': raw_xml_str}
+                for xml_filename, raw_xml_str, metadata, _ in records]
+        table = pa.Table.from_pylist(rows, schema=TEI_TABLE_SCHEMA)
+        self._parquet_writer.write_table(table)
+        return table.nbytes  # The uncompressed size of the row group
+
+    def _close_shard(self):
+        self._parquet_writer.close()
+
+    @staticmethod
+    def read_member_names(shard_filename):
+        return pq.read_table(shard_filename, columns=['filename']).column('filename').to_pylist()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from io import BytesIO
+from time import time
+from tarfile import open as tarfile_open, TarInfo, TarError, PAX_FORMAT
+
+from zstandard import ZstdCompressor, ZstdDecompressor, ZstdError
+
+from .base_sink import ShardedOutputSink
+
+# Only OutputSink is used outside of this file
+
+
+class OutputSink(ShardedOutputSink):
+    """Zstandard compressed tar shards (NAME.tar.zst, NAME_1.tar.zst, ...) written as a stream with one member for
+        each TEI XML and its metadata (url, tei_pid, date_published, warc_date) in the PAX headers of the member
+        (prefixed with html2tei.). The shards can be read sequentially (e.g. tar -I zstd -xf or webdataset)
+    """
+    EXTENSION = '.tar.zst'
+    INCOMPLETE_SHARD_ERRORS = (TarError, ZstdError, EOFError)
+
+    def __init__(self, tei_logger, filename, resume=False, max_shard_bytes=None, max_shard_members=None,
+                 max_shard_seconds=None):
+        self._zstd_compressor = ZstdCompressor()
+        self._fh = None
+        self._zstd_writer = None
+        self._tarfile = None
+        super().__init__(tei_logger, filename, resume, max_shard_bytes, max_shard_members, max_shard_seconds)
+
+    def _open_shard(self, shard_filename):
+        self._fh = open(shard_filename, 'wb')
+        self._zstd_writer = self._zstd_compressor.stream_writer(self._fh, closefd=False)
+        self._tarfile = tarfile_open(fileobj=self._zstd_writer, mode='w|', format=PAX_FORMAT)
+
+    def _write_records(self, records):
+        start_pos = self._fh.tell()
+        mtime = time()
+        for xml_filename, raw_xml_str, metadata, _ in records:
+            tarinfo = TarInfo(xml_filename)
+            tarinfo.size = len(raw_xml_str)
+            tarinfo.mtime = mtime
+            tarinfo.mode = 0o600
+            tarinfo.pax_headers = {f'html2tei.{key}': value for key, value in metadata.items() if value is not None}
+            self._tarfile.addfile(tarinfo, BytesIO(raw_xml_str))
+        return self._fh.tell() - start_pos  # The compressed bytes (the rest is in the buffer of the compressor)
+
+    def _close_shard(self):
+        self._tarfile.close()
+        self._zstd_writer.close()
+        self._fh.close()
+
+    @staticmethod
+    def read_member_names(shard_filename):
+        with open(shard_filename, 'rb') as fh, ZstdDecompressor().stream_reader(fh) as zstd_reader, \
+                tarfile_open(fileobj=zstd_reader, mode='r|') as tarfile:
+            return [tarinfo.name for tarinfo in tarfile]
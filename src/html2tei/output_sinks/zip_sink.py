@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from zlib import crc32
+from time import time, localtime
+from zipfile import ZipFile, ZipInfo, BadZipFile, ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA
+
+from .base_sink import ShardedOutputSink
+
+try:
+    from zipfile import _get_compressor as zipfile_get_compressor
+except ImportError:  # A private function of the zipfile module: the members are compressed by ZipFile.writestr
+    zipfile_get_compressor = None
+
+# The compression methods of the zipfile members (the ones the zipfile module can read back)
+ZIP_COMPRESSIONS = {'stored': ZIP_STORED, 'deflate': ZIP_DEFLATED, 'bzip2': ZIP_BZIP2, 'lzma': ZIP_LZMA}
+
+# The private attributes of ZipFile used by write_compressed_member (the members compressed in advance
+#  are written by ZipFile.writestr if any of them is missing, e.g. in a later version of the zipfile module)
+ZIPFILE_INTERNALS = ('_lock', '_writecheck', '_didModify', 'start_dir', 'fp', 'filelist', 'NameToInfo')
+
+# Only ZIP_COMPRESSIONS, compress_member and OutputSink are used outside of this file
+
+
+def compress_member(raw_bytes, compression, compresslevel=None):
+    """Compress the content of a zipfile member the same way as ZipFile.writestr does
+        and return its size, CRC and compressed content (None if it is stored without compression
+        or the zipfile module has no private _get_compressor function)
+    """
+    if zipfile_get_compressor is None:
+        return None
+    compressor = zipfile_get_compressor(compression, compresslevel)
+    if compressor is None:
+        return None
+    return len(raw_bytes), crc32(raw_bytes), compressor.compress(raw_bytes) + compressor.flush()
+
+
+def write_compressed_member(zipfile, filename, member):
+    """Write a zipfile member compressed in advance (see compress_member) without compressing it again.
+        The zipfile module has no interface for this, so the steps of ZipFile.writestr are done here
+         (ZipFile._open_to_write and _ZipWriteFile.close for seekable files without ZIP64)
+         with the private attributes of ZipFile (see ZIPFILE_INTERNALS)
+    """
+    file_size, crc, compressed_bytes = member
+    zinfo = ZipInfo(filename, date_time=localtime(time())[:6])
+    zinfo.compress_type = zipfile.compression
+    zinfo.external_attr = 0o600 << 16  # permissions: ?rw-------
+    zinfo.file_size = file_size
+    zinfo.compress_size = len(compressed_bytes)
+    zinfo.CRC = crc
+    if zinfo.compress_type == ZIP_LZMA:
+        zinfo.flag_bits |= 0x02  # Compressed data includes an end-of-stream (EOS) marker
+    with zipfile._lock:
+        zipfile.fp.seek(zipfile.start_dir)
+        zinfo.header_offset = zipfile.fp.tell()
+        zipfile._writecheck(zinfo)
+        zipfile._didModify = True
+        zipfile.fp.write(zinfo.FileHeader(False))
+        zipfile.fp.write(compressed_bytes)
+        zipfile.start_dir = zipfile.fp.tell()
+        zipfile.filelist.append(zinfo)
+        zipfile.NameToInfo[zinfo.filename] = zinfo
+
+
+class OutputSink(ShardedOutputSink):
+    """Zipfile shards (NAME.zip, NAME_1.zip, ...) with one member for each TEI XML (the metadata is not stored).
+        The members are compressed with compression (see ZIP_COMPRESSIONS, default: stored without compression)
+         in advance (e.g. in the workers, see validate_and_hash_tei) or by ZipFile.writestr
+         (also the ones compressed in advance if ZipFile does not have the attributes in ZIPFILE_INTERNALS).
+        The records are written immediately (the zipfile is buffered by the compression in advance)
+    """
+    EXTENSION = '.zip'
+    INCOMPLETE_SHARD_ERRORS = (BadZipFile,)
+
+    def __init__(self, tei_logger, filename, resume=False, max_shard_bytes=None, max_shard_members=None,
+                 max_shard_seconds=None, compression='stored', compresslevel=None):
+        # Check the compression parameters before anything is written
+        if compression not in ZIP_COMPRESSIONS:
+            tei_logger.log('CRITICAL', f'{compression} is not in the allowed value set ({set(ZIP_COMPRESSIONS)})!')
+            exit(1)
+        self.compression = ZIP_COMPRESSIONS[compression]
+        self.compresslevel = compresslevel
+        try:
+            compress_member(b'', self.compression, compresslevel)
+        except ValueError as err:
+            tei_logger.log('CRITICAL', f'{compresslevel} is not a valid compression level for {compression} ({err})!')
+            exit(1)
+        self._zipfile = None
+        self._write_compressed_members = False
+        super().__init__(tei_logger, filename, resume, max_shard_bytes, max_shard_members, max_shard_seconds,
+                         buffer_bytes=0)
+
+    def _open_shard(self, shard_filename):
+        self._zipfile = ZipFile(shard_filename, 'w', self.compression, compresslevel=self.compresslevel)
+        self._write_compressed_members = all(hasattr(self._zipfile, name) for name in ZIPFILE_INTERNALS)
+
+    def _write_records(self, records):
+        written_bytes = 0
+        for xml_filename, raw_xml_str, _, compressed_member in records:
+            if compressed_member is not None and self._write_compressed_members:
+                write_compressed_member(self._zipfile, xml_filename, compressed_member)
+            else:
+                self._zipfile.writestr(xml_filename, raw_xml_str)
+            written_bytes += self._zipfile.getinfo(xml_filename).compress_size
+        return written_bytes
+
+    def _close_shard(self):
+        self._zipfile.close()
+
+    @staticmethod
+    def read_member_names(shard_filename):
+        with ZipFile(shard_filename) as zipfile:
+            return zipfile.namelist()
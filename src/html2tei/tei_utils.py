@@ -2,10 +2,10 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
 from copy import copy
-from collections import defaultdict
+from collections import Counter, defaultdict, OrderedDict
 
 from bs4 import Tag
-from bs4.element import NavigableString, Comment
+from bs4.element import NavigableString, Comment, CData
 
 from .correctors.excluded_tags_collection import excluded_tags_general
 from .basic_tag_dicts import INLINE_TAGS, MEDIA_DICT, XML_CONVERT_DICT, TAGNAME_AND_ATTR_TABLE, FIGURE_REND_ATTRS
@@ -32,6 +32,50 @@ def to_friendly(ch, excluded_tags_fun):
     return f'<{ch.name}{attrs}>'
 
 
+TAG_SIGNATURE_CACHE_SIZE = 2 ** 16  # The number of distinct raw tags kept in a TagSignatureCache
+
+
+def raw_tag_key(tag):
+    """The hashable form of the name and the attributes (in their original order) of the tag"""
+    return tag.name, tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in tag.attrs.items())
+
+
+# This class is used outside of this file
+class TagSignatureCache:
+    """A bounded cache of the dictionary forms of the tags (see to_friendly) by their raw forms (see raw_tag_key),
+        as the same tags repeat in all articles of a portal. The least recently used entries are evicted.
+       The values are computed by the caller on the tag itself, so the excluded_tags_fun of the portal can modify
+        the tag as before, but only if it depends solely on the name and the attributes of the tag
+    """
+    def __init__(self, max_size=TAG_SIGNATURE_CACHE_SIZE):
+        self._max_size = max_size
+        self._signatures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the stored value or None"""
+        value = self._signatures.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._signatures.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._signatures[key] = value
+        if len(self._signatures) > self._max_size:
+            self._signatures.popitem(last=False)
+            self.evictions += 1
+
+    def statistics(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._signatures), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0}
+
+
 def immediate_text(tag):
     """This function counts the number of words (non-whitespace text)
         immediately under the parameter tag excluding comments
@@ -46,6 +90,52 @@ def real_text_length(tag):
     return sum(int(not i.isspace()) for i in tag.text)
 
 
+MAIN_CONTENT_STRING_TYPES = {NavigableString, CData}  # The strings counted in tag.text for normal tags
+MARKER_NAMES = {'to_decompose', 'to_unwrap'}  # The tags to be deleted at the next sync of PendingMutations
+
+
+class TextLengths:
+    """The number of non-whitespace characters in the text of each tag under (and including) root
+        (the same as real_text_length(tag) or len(tag.text.strip()) == 0) computed in one post-order pass.
+       Looking up a tag is O(1) instead of concatenating its whole subtree:
+        - Renaming and unwrapping tags keep the lengths valid (the text of the remaining tags does not change)
+        - Tags must be decomposed with the decompose method to update the lengths of their ancestors
+        - Other modifications (e.g. inserting strings) invalidate the lengths (a new instance must be created)
+       Tags with special string types (e.g. script, style) and tags not in the tree at creation are computed directly
+    """
+    def __init__(self, root):
+        self._tags = [root, *root.find_all()]  # Pre-order, keeps the tags alive to keep their ids unique
+        self._lengths = {}
+        for tag in reversed(self._tags):  # All descendants come before their ancestor
+            length = 0
+            for child in tag.contents:
+                if isinstance(child, Tag):
+                    length += self._lengths[id(child)]
+                elif type(child) in MAIN_CONTENT_STRING_TYPES:
+                    length += len(''.join(child.split()))
+            self._lengths[id(tag)] = length
+
+    def __getitem__(self, tag):
+        length = self._lengths.get(id(tag))
+        if length is None or tag.interesting_string_types not in (None, MAIN_CONTENT_STRING_TYPES):
+            length = real_text_length(tag)
+        return length
+
+    def decompose(self, tag):
+        """Decompose the tag and subtract its text length from its ancestors"""
+        length = self._lengths.get(id(tag))
+        if length is None:
+            length = sum(len(''.join(string.split())) for string in tag.descendants
+                         if type(string) in MAIN_CONTENT_STRING_TYPES)
+        parent = tag.parent
+        while parent is not None:
+            parent_id = id(parent)
+            if parent_id in self._lengths:
+                self._lengths[parent_id] -= length
+            parent = parent.parent
+        tag.decompose()
+
+
 def imtext_children_descendants_of_tag(tag):
     """This function return the following information on the parameter tag:
         1. The number of words (non-whitespace text) immediately below the tag
@@ -58,6 +148,60 @@ def imtext_children_descendants_of_tag(tag):
     return naked_text, child_tags, descendants_tags
 
 
+# This class is used outside of this file
+class SubtreeSummaries:
+    """The summaries of the tags for imtext_children_descendants_of_tag(tag): whether the tag has words immediately
+        below it and the multisets of the names of its children and of its descendants.
+       A summary is computed from the summaries of the children (bottom-up, once for each tag) and cached,
+        so looking up a tag costs O(children × distinct names) instead of searching its whole subtree:
+        - Every modification must be reported with changed(tag) before it happens, where tag is the renamed,
+           unwrapped or decomposed tag (or the one whose contents are modified). This drops the cached summaries
+           along the ancestor path, which are recomputed on the next lookup
+        - The tags not in the cache (e.g. the new tags) are computed on lookup
+       A cached tag always has its whole subtree cached, so changed() can stop at the first ancestor not in the cache
+    """
+    __slots__ = ('_summaries',)
+
+    def __init__(self):
+        self._summaries = {}  # id(tag) -> (tag, naked_text, child_names, descendant_names), tag keeps the id unique
+
+    def _summary(self, tag):
+        summary = self._summaries.get(id(tag))
+        if summary is None:
+            tags_to_compute = []
+            stack = [tag]
+            while len(stack) > 0:
+                t = stack.pop()
+                tags_to_compute.append(t)
+                stack.extend(c for c in t.contents if isinstance(c, Tag) and id(c) not in self._summaries)
+            for t in reversed(tags_to_compute):  # All descendants come before their ancestor
+                naked_text = False
+                child_names, descendant_names = Counter(), Counter()
+                for c in t.contents:
+                    if isinstance(c, Tag):
+                        child_names[c.name] += 1
+                        descendant_names[c.name] += 1
+                        descendant_names.update(self._summaries[id(c)][3])
+                    elif not naked_text and isinstance(c, NavigableString) and not isinstance(c, Comment):
+                        naked_text = len(c.split()) > 0  # The same as immediate_text(t) > 0
+                self._summaries[id(t)] = (t, naked_text, child_names, descendant_names)
+            summary = self._summaries[id(tag)]
+        return summary
+
+    def __getitem__(self, tag):
+        """The same as imtext_children_descendants_of_tag(tag)"""
+        _, naked_text, child_names, descendant_names = self._summary(tag)
+        return naked_text, set(child_names), set(descendant_names)
+
+    def descendant_count(self, tag, name):
+        """The same as len(tag.find_all(name))"""
+        return self._summary(tag)[3][name]
+
+    def changed(self, tag):
+        while tag is not None and self._summaries.pop(id(tag), None) is not None:
+            tag = tag.parent
+
+
 def unwrap_all(article, tag_name):
     for tag in article.find_all(tag_name):
         tag.unwrap()
@@ -68,6 +212,55 @@ def decompose_all(article, tag_name):
         tag.decompose()
 
 
+# This class is used outside of this file
+class PendingMutations:
+    """Mark tags to be decomposed or unwrapped later (renamed to 'to_decompose' or 'to_unwrap') and apply them
+        at the sync points in one go: sync() is the same as decompose_all(article, 'to_decompose') followed by
+        unwrap_all(article, 'to_unwrap'), but it visits only the marked tags instead of searching the whole article.
+       The marked tags keep their marker names until the sync as the passes in between can depend on them,
+        therefore every rename that can produce a marker name (e.g. the ones read from the configuration)
+        must go through rename() or track()
+    """
+    __slots__ = ('_marked',)
+
+    def __init__(self):
+        self._marked = []
+
+    def track(self, tag):
+        """Register the tag if it has a marker name (e.g. a new tag) and return it"""
+        if tag.name in MARKER_NAMES:
+            self._marked.append(tag)
+        return tag
+
+    def rename(self, tag, new_name):
+        tag.name = new_name
+        self.track(tag)
+
+    def unwrap(self, tag):
+        self.rename(tag, 'to_unwrap')
+
+    def decompose(self, tag):
+        self.rename(tag, 'to_decompose')
+
+    def sync(self):
+        """Apply the marks on the tags which still have the marker name and are still in the tree
+            (the order of unwrapping does not matter, the tags inside the decomposed ones are skipped).
+           The tags leave the tree between the sync points only by being unwrapped or decomposed (including their
+            descendants), which leaves them without parent, the moved subtrees are always reinserted
+        """
+        marked, self._marked = self._marked, []
+        to_unwrap = []
+        for tag in marked:
+            if tag.parent is not None:  # Tag.decomposed is slow: it searches the subtree for the missing attribute
+                if tag.name == 'to_decompose':
+                    tag.decompose()
+                elif tag.name == 'to_unwrap':
+                    to_unwrap.append(tag)
+        for tag in to_unwrap:
+            if tag.parent is not None:  # Unwrapped already if it is marked twice
+                tag.unwrap()
+
+
 def decomposing(article, decompose_params):
     """Going through the list of tags to be deleted, it performs the (bs4) decomposing"""
     for args, kwargs in decompose_params:
@@ -87,10 +280,112 @@ def mark_media_descendants(whole_article, media_params):
     return whole_article
 
 
+UNSUPPORTED_SELECTOR_KEYWORDS = {'attrs', 'string', 'text', 'recursive', 'limit'}
+
+# The compiled forms of the selector lists of the portals (e.g. DECOMP and MEDIA_LIST) by the identity of the lists,
+#  which are module level constants in the portal-specific configs (kept in each process across articles)
+COMPILED_SELECTOR_LISTS = {}
+
+
+def attribute_value_matches(attr_value, values):
+    """The rules of find_all() (see bs4.filter.SoupStrainer._attribute_match) for a value of True (the attribute
+        is present) or a set of strings, which match any of the values of a multi-valued attribute (e.g. class)
+        or all of them joined with space"""
+    if attr_value is None:
+        return False
+    if values is True:
+        return True
+    if isinstance(attr_value, list):
+        return any(v in values for v in attr_value) or (len(attr_value) != 1 and ' '.join(attr_value) in values)
+    return attr_value in values
+
+
+class CompiledSelectors:
+    """A selector list ([(args, kwargs), ...] for find_all(): the name of the tag and the values of its attributes)
+        indexed by the name of the tag, then by the attribute predicates, to match the tags one by one
+        during a single traversal instead of calling find_all() for each selector
+    """
+    __slots__ = ('_predicates_by_name',)
+
+    def __init__(self, predicates_by_name):
+        self._predicates_by_name = predicates_by_name
+
+    @staticmethod
+    def compile(selectors):
+        """Return None if any of the selectors can not be compiled (e.g. regular expressions or functions)"""
+        predicates_by_name = defaultdict(tuple)
+        for args, kwargs in selectors:
+            if len(args) != 1 or not isinstance(args[0], str):
+                return None
+            predicate = []
+            for attr, value in kwargs.items():
+                if attr in UNSUPPORTED_SELECTOR_KEYWORDS:
+                    return None
+                if attr == 'class_':
+                    attr = 'class'
+                if value is not True:
+                    if isinstance(value, str):
+                        value = [value]
+                    if not isinstance(value, (list, tuple)) or len(value) == 0 or \
+                            not all(isinstance(v, str) for v in value):
+                        return None
+                    value = frozenset(value)
+                predicate.append((attr, value))
+            predicates_by_name[args[0]] += (tuple(predicate),)
+        return CompiledSelectors(dict(predicates_by_name))
+
+    def matches(self, tag):
+        predicates = self._predicates_by_name.get(tag.name, ())
+        if tag.prefix:  # find_all() matches the prefixed name also
+            predicates += self._predicates_by_name.get(f'{tag.prefix}:{tag.name}', ())
+        attrs = tag.attrs
+        for predicate in predicates:
+            for attr, values in predicate:
+                if not attribute_value_matches(attrs.get(attr), values):
+                    break
+            else:
+                return True
+        return False
+
+
+def compiled_selectors(selectors):
+    compiled = COMPILED_SELECTOR_LISTS.get(id(selectors))
+    if compiled is None:
+        # The list is stored along with its compiled form, so its id can not be reused while it is cached
+        compiled = (selectors, CompiledSelectors.compile(selectors))
+        COMPILED_SELECTOR_LISTS[id(selectors)] = compiled
+    return compiled[1]
+
+
 def decompose_listed_subtrees_and_mark_media_descendants(article_dec, decomp, media_list):
-    """This function combines marking the lower level of the media blocks and deleting tags to be deleted"""
-    decomposing(article_dec, decomp)
-    mark_media_descendants(article_dec, media_list)
+    """This function combines marking the lower level of the media blocks and deleting tags to be deleted.
+       It gives the same result as decomposing() followed by mark_media_descendants(), but in a single traversal
+        with the compiled selector lists: the tags are matched against decomp by their original names first
+        (the subtrees of the matching ones are deleted), then the descendants of the tags matching media_list
+        are renamed (media blocks inside media blocks are renamed the same way, as their roots are descendants too).
+       The selector lists are compiled at their first use and must not be modified afterwards
+    """
+    compiled_decomp, compiled_media_list = compiled_selectors(decomp), compiled_selectors(media_list)
+    if compiled_decomp is None or compiled_media_list is None:
+        decomposing(article_dec, decomp)
+        mark_media_descendants(article_dec, media_list)
+        return
+
+    to_decompose = []
+    stack = [(tag, False) for tag in reversed(article_dec.contents) if isinstance(tag, Tag)]
+    while len(stack) > 0:
+        tag, in_media = stack.pop()
+        if compiled_decomp.matches(tag):
+            to_decompose.append(tag)  # Its descendants are skipped as they are deleted with it
+            continue
+        if in_media:
+            if not tag.name.startswith('0_MDESC_'):
+                tag.name = f'0_MDESC_{tag.name}'
+        else:
+            in_media = compiled_media_list.matches(tag)
+        stack.extend((child, in_media) for child in reversed(tag.contents) if isinstance(child, Tag))
+    for tag in to_decompose:
+        tag.decompose()
 
 
 def tei_defaultdict(mandatory_keys=('sch:url', 'sch:name'), missing_value=None):
@@ -138,7 +433,9 @@ def complex_wrapping(bs, root_tag, default_wrapper, article_url, tei_logger):
         under the root are wrapped in this method to a paragraph tag, which is the default divider
     """
     tei_logger.log('DEBUG', f'complex_wrapping in {article_url}')
-    naked_text, child_tags, desc_tags = imtext_children_descendants_of_tag(root_tag)
+    # The names of the descendants are not needed (searching them for every block would be quadratic in nested blocks)
+    naked_text = immediate_text(root_tag) > 0
+    child_tags = {c.name for c in root_tag.find_all(recursive=False)}
     if child_tags <= INLINE_TAGS and root_tag.name not in MEDIA_DICT.keys():
         root_tag.wrap(bs.new_tag(root_tag.name))
         root_tag.name = default_wrapper
@@ -2,14 +2,25 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
 
-from multiprocessing import Pool, Manager
-from contextlib import contextmanager
-from os.path import isdir as os_path_isdir
+from io import BytesIO
+from re import compile as re_compile
+from copy import deepcopy
+from queue import SimpleQueue
+from functools import partial
+from hashlib import sha256
+from inspect import getsourcefile
+from json import dump as json_dump, dumps as json_dumps, load as json_load
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Pool, Manager, cpu_count
+from contextlib import contextmanager, ExitStack
+from os import stat as os_stat, replace as os_replace
+from os.path import isdir as os_path_isdir, isfile as os_path_isfile, getsize as os_path_getsize
 from threading import Lock as threading_Lock
 from datetime import datetime, MINYEAR, MAXYEAR
 from locale import setlocale, LC_ALL, Error as locale_Error
 
 from bs4 import BeautifulSoup
+from warcio.archiveiterator import ArchiveIterator
 from webarticlecurator import WarcCachingDownloader
 
 from ..correctors.unicode_error import unicode_test
@@ -30,44 +41,75 @@ def extract_resp_record_data(resp):
     return warc_response_datetime, warc_id, raw_html
 
 
+def read_page_of_article(article_url, get_resp_record_fun, transform_to_html_fun, warc_logger):
+    """Read one page of an article and return the article URL, response date, WARC ID, raw HTML tuple"""
+    resp = get_resp_record_fun(article_url)
+    warc_response_datetime, warc_id, raw_html = extract_resp_record_data(resp)
+    raw_html = transform_to_html_fun(article_url, raw_html, warc_logger)
+    return article_url, warc_response_datetime, warc_id, raw_html
+
+
+def gather_pages_of_article(article_url, get_resp_record_fun, url_index, blacklist, next_page_of_article_fun,
+                            transform_to_html_fun, warc_logger, warc_filenames):
+    """Read the page of the article URL and follow the next pages (if there are any) to create the list of
+        article URL, response date, WARC ID, raw HTML tuples (a multi-page article is treated as one entry)
+    """
+    article = []
+    while article_url is not None:
+        # Process URL and append page data to article list
+        page = read_page_of_article(article_url, get_resp_record_fun, transform_to_html_fun, warc_logger)
+        article.append(page)
+
+        # Generate next page URL
+        article_url = next_page_of_article_fun(page[3])
+
+        if article_url is None or article_url in blacklist:
+            article_url = None
+        elif article_url not in url_index:
+            article_url = None
+            warc_logger.log('CRITICAL', f'The next_page URL {article_url} does not present'
+                                        f' in the archive {warc_filenames}!')
+    return article
+
+
 def aggregated_multipage_articles_gen(warc_level_params, run_parameters):
     """Create a generator of article, response date, WARC ID, raw HTML tuples
        where multi-page articles are treated as one entry
     """
     # We use these variables here, the others are passed blindly to the other processing levels
     warc_filenames, blacklist, multipage_compile, warc_logger, date_interval, next_page_of_article_fun, \
-        transform_to_html_fun = warc_level_params
+        transform_to_html_fun, multipage_chains, skip_urls = warc_level_params
 
     # Init WARC cache
     warc_reader = WarcCachingDownloader(warc_filenames, None, warc_logger, just_cache=True,
                                         download_params={'strict_mode': True, 'check_digest': True})
+
+    def get_resp_record(url):
+        _, _, resp = warc_reader.get_records(url)  # From WebArticleCurator
+        return resp
+
     # Set defaults
     date_max = datetime(MINYEAR, 1, 1)
     date_min = datetime(MAXYEAR, 1, 1)
 
-    for article_url in warc_reader.url_index:
-        if article_url in blacklist or multipage_compile.match(article_url):
-            continue
-        # Articles first pages not on blacklist
-        article = []
-        while article_url is not None:
-            # Process URL and append page data to article list
-            _, _, resp = warc_reader.get_records(article_url)  # From WebArticleCurator
-            warc_response_datetime, warc_id, raw_html = extract_resp_record_data(resp)
+    if multipage_chains is not None:
+        # Just walk the precomputed chains (see create_multipage_chain_index)
+        articles = ([read_page_of_article(page_url, get_resp_record, transform_to_html_fun, warc_logger)
+                     for page_url in page_urls]
+                    for article_url, page_urls in multipage_chains.items() if article_url not in skip_urls)
+    else:
+        # Articles first pages not on blacklist (and not skipped)
+        articles = (gather_pages_of_article(article_url, get_resp_record, warc_reader.url_index, blacklist,
+                                            next_page_of_article_fun, transform_to_html_fun, warc_logger,
+                                            warc_filenames)
+                    for article_url in warc_reader.url_index
+                    if article_url not in blacklist and article_url not in skip_urls and
+                    not multipage_compile.match(article_url))
+
+    for article in articles:
+        for _, warc_response_datetime, _, _ in article:
             date_min = min(date_min, warc_response_datetime)
             date_max = max(date_max, warc_response_datetime)
-            raw_html = transform_to_html_fun(article_url, raw_html, warc_logger)
-            article.append((article_url, warc_response_datetime, warc_id, raw_html))
-
-            # Generate next page URL
-            article_url = next_page_of_article_fun(raw_html)
-
-            if article_url is None or article_url in blacklist:
-                article_url = None
-            elif article_url not in warc_reader.url_index:
-                article_url = None
-                warc_logger.log('CRITICAL', f'The next_page URL {article_url} does not present'
-                                            f' in the archive {warc_filenames}!')
 
         yield article, run_parameters  # Return the gathered article
 
@@ -76,6 +118,124 @@ def aggregated_multipage_articles_gen(warc_level_params, run_parameters):
     date_interval['date_max'] = date_max
 
 
+def create_warc_offset_index(warc_filenames, warc_logger):
+    """Create a URL -> (WARC filename, offset, length) index of the response records sorted by their position
+        in the WARC files to be able to read them from anywhere (e.g. in the worker processes) without any WARC reader
+    """
+    warc_reader = WarcCachingDownloader(warc_filenames, None, warc_logger, just_cache=True,
+                                        download_params={'strict_mode': True, 'check_digest': True})
+    warc_index = {}
+    for url in warc_reader.url_index:
+        cache, _, (resp_offset, resp_length) = warc_reader.get_records_offset(url)  # From WebArticleCurator
+        warc_index[url] = (cache.filename, resp_offset, resp_length)
+    # Sequential reading order for the better locality of the reads
+    warc_index = dict(sorted(warc_index.items(), key=lambda url_and_pos: url_and_pos[1]))
+    return warc_index
+
+
+def read_warc_record(warc_filename, offset, length):
+    """Read (and decompress) one WARC record by its offset and length from the memory-mapped WARC file.
+        The memory maps are kept open for the whole life of the (worker) process
+    """
+    warc_mmap = WARC_MMAPS.get(warc_filename)
+    if warc_mmap is None:
+        with open(warc_filename, 'rb') as fh:
+            warc_mmap = mmap(fh.fileno(), 0, access=ACCESS_READ)
+        WARC_MMAPS[warc_filename] = warc_mmap
+    return next(iter(ArchiveIterator(BytesIO(warc_mmap[offset:offset + length]), check_digests='raise')))
+
+
+def find_page_urls_of_article(params):
+    """Follow the next pages of the article from the position of its first page (WARC filename, offset, length, URL)
+        and return the URLs of its pages (the task of the pre-pass of create_multipage_chain_index)
+    """
+    (_, _, _, article_url), (warc_index, blacklist, next_page_of_article_fun, transform_to_html_fun, warc_logger,
+                             warc_filenames) = params
+    article = gather_pages_of_article(article_url, lambda url: read_warc_record(*warc_index[url]), warc_index,
+                                      blacklist, next_page_of_article_fun, transform_to_html_fun, warc_logger,
+                                      warc_filenames)
+    return [page_url for page_url, _, _, _ in article]
+
+
+def create_multipage_chain_index(warc_filenames, blacklist, multipage_compile, warc_logger, next_page_of_article_fun,
+                                 transform_to_html_fun):
+    """Create the first page URL -> ordered page URLs index of the articles in parallel,
+        so next_page_of_article_fun (which usually parses the whole page) is not called in the serial part
+    """
+    warc_index = create_warc_offset_index(warc_filenames, warc_logger)
+    multipage_chains = {}
+    with Manager() as man:
+        log_queue = man.Queue()
+        with warc_logger.init_mp_logging_context(log_queue) as mp_logger:
+            page_reading_params = (warc_index, blacklist, next_page_of_article_fun, transform_to_html_fun, mp_logger,
+                                   warc_filenames)
+            with Pool(initializer=init_worker_context, initargs=(find_page_urls_of_article, page_reading_params)) as p:
+                # Articles first pages not on blacklist
+                first_page_descriptors = ((warc_filename, offset, length, article_url)
+                                          for article_url, (warc_filename, offset, length) in warc_index.items()
+                                          if article_url not in blacklist and not multipage_compile.match(article_url))
+                for page_urls in p.imap(run_main_function_in_worker, first_page_descriptors, chunksize=100):
+                    multipage_chains[page_urls[0]] = page_urls
+    return multipage_chains
+
+
+def multipage_chain_index_key(warc_filename, blacklist, multipage_compile, next_page_of_article_fun,
+                              transform_to_html_fun):
+    """The key of the persisted multi-page chain index: the SHA-256 hash of everything the chains depend on,
+        the portal config (the blacklist, the pattern of the multi-page URLs and the source files of the functions
+        which find the pages of the articles) and the WARC file (its size and modification time, it is not read)
+    """
+    warc_stat = os_stat(warc_filename)
+    key = sha256(json_dumps([sorted(blacklist), multipage_compile.pattern, warc_stat.st_size, warc_stat.st_mtime_ns],
+                            ensure_ascii=False).encode('UTF-8'))
+    for fun in (next_page_of_article_fun, transform_to_html_fun):
+        try:
+            with open(getsourcefile(fun), 'rb') as fh:
+                key.update(fh.read())
+        except (TypeError, OSError):  # E.g. a built-in function
+            key.update(repr(fun).encode('UTF-8'))
+    return key.hexdigest()
+
+
+def load_or_create_multipage_chain_index(warc_level_params, persist=False):
+    """Fill the multi-page chain index of warc_level_params (if it is requested). When persist is True the index
+        is stored next to the WARC file along with its key (see multipage_chain_index_key) and it is reused
+        in the later runs if the key is the same (i.e. the portal config and the WARC file are not changed).
+       Must be called before the runners initialise the multiprocess logging as it uses its own process pool
+    """
+    warc_filenames, blacklist, multipage_compile, warc_logger, _, next_page_of_article_fun, transform_to_html_fun, \
+        multipage_chains, _ = warc_level_params
+    if multipage_chains is None:
+        return
+
+    multipage_chains.clear()
+    multipage_chains_filename = f'{warc_filenames}.multipage_chains.json'
+    if persist:
+        key = multipage_chain_index_key(warc_filenames, blacklist, multipage_compile, next_page_of_article_fun,
+                                        transform_to_html_fun)
+        if os_path_isfile(multipage_chains_filename):
+            try:
+                with open(multipage_chains_filename, encoding='UTF-8') as fh:
+                    persisted_index = json_load(fh)
+            except ValueError:  # E.g. an incomplete file
+                persisted_index = None
+            if isinstance(persisted_index, dict) and persisted_index.get('key') == key:
+                warc_logger.log('INFO', f'Loading multi-page chain index from {multipage_chains_filename}')
+                multipage_chains.update(persisted_index['multipage_chains'])
+                return
+            warc_logger.log('INFO', f'{multipage_chains_filename} is outdated or invalid, it is created again')
+
+    warc_logger.log('INFO', 'Creating multi-page chain index')
+    multipage_chains.update(create_multipage_chain_index(warc_filenames, blacklist, multipage_compile, warc_logger,
+                                                         next_page_of_article_fun, transform_to_html_fun))
+    if persist:
+        warc_logger.log('INFO', f'Writing multi-page chain index to {multipage_chains_filename}')
+        with open(f'{multipage_chains_filename}.part', 'w', encoding='UTF-8') as fh:
+            json_dump({'key': key, 'multipage_chains': multipage_chains}, fh, ensure_ascii=False)
+        # A killed run never leaves a partial file behind
+        os_replace(f'{multipage_chains_filename}.part', multipage_chains_filename)
+
+
 @contextmanager
 def open_multiple_files(args):
     """A helper function to open multiple files at once in a contextmanager"""
@@ -101,23 +261,315 @@ def run_single_process(warc_level_params, file_names_and_modes, main_function, s
             yield after_function(ret, after_params, fhandles)
 
 
+# The default memory budget of the articles in flight in the process pools (see run_jobs_in_pool)
+MAX_BYTES_IN_FLIGHT = 512 * 2**20
+# The static parameters of the portals (keyed by the portal) installed once into each worker process of the pool
+#  (see init_worker_contexts) and the ones of the portal of the currently running task (see run_tasks_in_worker)
+WORKER_CONTEXTS = {}
+WORKER_CONTEXT = {}
+# The WARC files opened (memory-mapped) in the current process (see read_warc_record)
+WARC_MMAPS = {}
+
+
+def init_worker_context(main_function, sub_functions, page_reading_params=None):
+    """Pool initializer: install the main function and its static (per-portal) parameters
+        (e.g. tag_normal_dict, the base TEI XML, the block and bigram rules and the config functions) once per worker,
+        so the tasks carry only the pages of the article.
+       If page_reading_params (the WARC offset index and the functions to gather the pages) are present the tasks
+        carry only the WARC position of the first page of the articles
+    """
+    WORKER_CONTEXT['main_function'] = main_function
+    WORKER_CONTEXT['sub_functions'] = sub_functions
+    WORKER_CONTEXT['page_reading_params'] = page_reading_params
+
+
+def init_worker_contexts(contexts):
+    """Pool initializer: install the contexts (see init_worker_context) of all portals sharing the pool once per worker,
+        so the tasks carry only the key of their portal besides the articles
+    """
+    WORKER_CONTEXTS.update(contexts)
+
+
+def run_tasks_in_worker(params):
+    """Select the context of the portal of the chunk of tasks and run the chunk function on them"""
+    portal_key, chunk_fun, tasks = params
+    init_worker_context(**WORKER_CONTEXTS[portal_key])
+    return chunk_fun(tasks)
+
+
+def run_main_function_in_worker(article):
+    """Call the installed main_function with the article and the static parameters as if they were sent together"""
+    return WORKER_CONTEXT['main_function']((article, WORKER_CONTEXT['sub_functions']))
+
+
+def run_main_function_on_articles_in_worker(articles):
+    """Call the installed main_function on each article of the chunk"""
+    return [run_main_function_in_worker(article) for article in articles]
+
+
+def read_article_and_run_main_function_in_worker(article_descriptor):
+    """Read, decode and transform the pages of the article starting from the position of its first page
+        (WARC filename, offset, length, URL) and call the installed main function with it.
+       If the URLs of the pages are known (see create_multipage_chain_index) they are read without following them.
+       The date interval of the WARC responses are returned along with the result of the main function
+    """
+    (_, _, _, article_url), page_urls = article_descriptor
+    warc_index, blacklist, next_page_of_article_fun, transform_to_html_fun, warc_logger, warc_filenames = \
+        WORKER_CONTEXT['page_reading_params']
+
+    def get_resp_record(url):
+        return read_warc_record(*warc_index[url])
+
+    if page_urls is not None:
+        article = [read_page_of_article(page_url, get_resp_record, transform_to_html_fun, warc_logger)
+                   for page_url in page_urls]
+    else:
+        article = gather_pages_of_article(article_url, get_resp_record, warc_index, blacklist,
+                                          next_page_of_article_fun, transform_to_html_fun, warc_logger, warc_filenames)
+    warc_response_datetimes = [warc_response_datetime for _, warc_response_datetime, _, _ in article]
+    return run_main_function_in_worker(article), (min(warc_response_datetimes), max(warc_response_datetimes))
+
+
+def read_articles_and_run_main_function_in_worker(article_descriptors):
+    """Read and process each article of the chunk (see read_article_and_run_main_function_in_worker)"""
+    return [read_article_and_run_main_function_in_worker(article_descriptor)
+            for article_descriptor in article_descriptors]
+
+
+def run_main_function_on_batch_in_worker(articles):
+    """Process a batch of articles with the installed main function (map step) into a new local accumulator
+        (a copy of the empty accumulator installed with the pool) and return it to be merged in the parent process
+    """
+    *params, sub_fun, (accumulator_template, *sub_fun_params) = WORKER_CONTEXT['sub_functions']
+    local_accumulator = deepcopy(accumulator_template)
+    local_sub_functions = (*params, sub_fun, (local_accumulator, *sub_fun_params))
+    for article in articles:
+        WORKER_CONTEXT['main_function']((article, local_sub_functions))
+    return [local_accumulator]
+
+
+def article_size(article):
+    """The size of an article (the sum of the length of the HTML of its pages) for the byte budget of the chunks"""
+    return sum(len(raw_html) for _, _, _, raw_html in article)
+
+
+def return_result(ret):
+    """The default result function of the jobs: pass the result of the task to the after function as is"""
+    return ret
+
+
+def multiple_process_job(warc_level_params, main_function, sub_functions, exit_stack, log_queue):
+    """Create the job of run_multiple_process: the parent process reads the articles and the workers process them.
+       A job is the tuple of the worker context, the function to run on a chunk of tasks in the worker, the tasks,
+        the maximal number of tasks in a chunk, the function to compute the size of a task (in bytes)
+        and the function to unpack the results of the tasks in the parent process
+    """
+    mp_logger = exit_stack.enter_context(sub_functions[0][0].init_mp_logging_context(log_queue))
+    sub_functions[0][0] = mp_logger
+    context = {'main_function': main_function, 'sub_functions': sub_functions}
+    articles = (article for article, _ in aggregated_multipage_articles_gen(warc_level_params, None))
+    return context, run_main_function_on_articles_in_worker, articles, 100, article_size, return_result
+
+
+def read_in_workers_job(warc_level_params, main_function, sub_functions, exit_stack, log_queue):
+    """Create the job of run_multiple_process_read_in_workers: the parent process only emits
+        the (WARC filename, offset, length, URL) of the first pages and the workers read, decompress, decode and
+        transform the WARC records themselves (see multiple_process_job for the structure of the job)
+    """
+    warc_filenames, blacklist, multipage_compile, warc_logger, date_interval, next_page_of_article_fun, \
+        transform_to_html_fun, multipage_chains, skip_urls = warc_level_params
+    warc_index = create_warc_offset_index(warc_filenames, warc_logger)
+    mp_logger = exit_stack.enter_context(sub_functions[0][0].init_mp_logging_context(log_queue))
+    sub_functions[0][0] = mp_logger
+    page_reading_params = (warc_index, blacklist, next_page_of_article_fun, transform_to_html_fun, mp_logger,
+                           warc_filenames)
+    context = {'main_function': main_function, 'sub_functions': sub_functions,
+               'page_reading_params': page_reading_params}
+    if multipage_chains is not None:
+        # The precomputed chains (see create_multipage_chain_index)
+        article_descriptors = (((*warc_index[article_url], article_url), page_urls)
+                               for article_url, page_urls in multipage_chains.items() if article_url not in skip_urls)
+    else:
+        # Articles first pages not on blacklist (and not skipped)
+        article_descriptors = (((warc_filename, offset, length, article_url), None)
+                               for article_url, (warc_filename, offset, length) in warc_index.items()
+                               if article_url not in blacklist and article_url not in skip_urls and
+                               not multipage_compile.match(article_url))
+
+    # Set defaults
+    date_interval['date_min'] = datetime(MAXYEAR, 1, 1)
+    date_interval['date_max'] = datetime(MINYEAR, 1, 1)
+
+    def update_date_interval(result):
+        # Return the computed date interval to the cally by modifying the parameter
+        ret, (article_date_min, article_date_max) = result
+        date_interval['date_min'] = min(date_interval['date_min'], article_date_min)
+        date_interval['date_max'] = max(date_interval['date_max'], article_date_max)
+        return ret
+
+    def article_descriptor_size(article_descriptor):
+        # The size of the (compressed) WARC records to be read by the worker
+        (_, _, length, _), page_urls = article_descriptor
+        if page_urls is None:
+            return length
+        return sum(warc_index[page_url][2] for page_url in page_urls)
+
+    return context, read_articles_and_run_main_function_in_worker, article_descriptors, 100, \
+        article_descriptor_size, update_date_interval
+
+
+def map_reduce_job(warc_level_params, main_function, sub_functions, exit_stack, log_queue, batch_size=100):
+    """Create the job of run_multiple_process_map_reduce: each batch of articles is summarised into a local
+        accumulator in the worker (see multiple_process_job for the structure of the job)
+    """
+    mp_logger = exit_stack.enter_context(sub_functions[0].init_mp_logging_context(log_queue))
+    context = {'main_function': main_function, 'sub_functions': (mp_logger, *sub_functions[1:])}
+    articles = (article for article, _ in aggregated_multipage_articles_gen(warc_level_params, None))
+    return context, run_main_function_on_batch_in_worker, articles, batch_size, article_size, return_result
+
+
+def take_chunk(tasks, max_tasks, max_bytes, task_size_fun):
+    """Take tasks from the iterator until there are max_tasks of them or their size reaches max_bytes
+        (a chunk contains at least one task if there are any left)
+    """
+    chunk = []
+    chunk_bytes = 0
+    for task in tasks:
+        chunk.append(task)
+        chunk_bytes += task_size_fun(task)
+        if len(chunk) >= max_tasks or chunk_bytes >= max_bytes:
+            break
+    return chunk, chunk_bytes
+
+
+def run_jobs_in_pool(jobs, processes=None, max_chunks_per_portal=None, max_bytes_in_flight=MAX_BYTES_IN_FLIGHT):
+    """Run the tasks of the jobs (of the portals) in one shared process pool and yield the key of the portal and
+        the result of the after function for each task preserving the order of the tasks of each portal.
+       The jobs are (portal key, *job (see multiple_process_job), after function, after params, file handles) tuples.
+       The chunks of tasks are submitted round-robin in the order of the jobs (fair sharing) while at most
+        twice as many chunks as processes are in flight overall and max_chunks_per_portal for each portal.
+       The tasks are read lazily only when there is room in the window, so a slow after function (e.g. writing
+        the output) holds back the reading of the WARC file. A chunk is closed when its size reaches its share of
+        max_bytes_in_flight, which bounds the memory used by the chunks in flight
+        (lower: smaller peak memory usage, higher: less overhead)
+    """
+    if processes is None:
+        processes = cpu_count()
+    max_chunks_in_flight = 2 * processes
+    if max_chunks_per_portal is None:
+        max_chunks_per_portal = max_chunks_in_flight
+    max_bytes_per_chunk = max(1, max_bytes_in_flight // max_chunks_in_flight)
+
+    # The state of the jobs: the remaining tasks, the number of submitted and processed chunks,
+    #  the finished but not yet processed chunks and the size of the unprocessed chunks by their serial number
+    #  and whether there are no more tasks
+    job_states = [{'tasks': iter(tasks), 'submitted': 0, 'processed': 0, 'finished': {}, 'chunk_bytes': {},
+                   'exhausted': False} for _, _, _, tasks, *_ in jobs]
+    chunks_finished = SimpleQueue()  # Wake up the scheduler when any chunk is finished
+
+    def store_finished_chunk(finished_chunks, chunk_id, result):
+        # Called from the result handler thread of the pool (the result may be an exception)
+        finished_chunks[chunk_id] = result
+        chunks_finished.put(None)
+
+    contexts = {portal_key: context for portal_key, context, *_ in jobs}
+    with Pool(processes, initializer=init_worker_contexts, initargs=(contexts,)) as p:
+        chunks_in_flight = 0
+        bytes_in_flight = 0
+        while True:
+            # Submit chunks round-robin until the limits are reached or there are no more tasks
+            submitted = True
+            while submitted and chunks_in_flight < max_chunks_in_flight and bytes_in_flight < max_bytes_in_flight:
+                submitted = False
+                for (portal_key, _, chunk_fun, _, chunk_size, task_size_fun, *_), state in zip(jobs, job_states):
+                    if state['exhausted'] or state['submitted'] - state['processed'] >= max_chunks_per_portal or \
+                            chunks_in_flight >= max_chunks_in_flight or bytes_in_flight >= max_bytes_in_flight:
+                        continue
+                    chunk, chunk_bytes = take_chunk(state['tasks'], chunk_size, max_bytes_per_chunk, task_size_fun)
+                    if len(chunk) == 0:
+                        state['exhausted'] = True
+                        continue
+                    store_chunk = partial(store_finished_chunk, state['finished'], state['submitted'])
+                    p.apply_async(run_tasks_in_worker, ((portal_key, chunk_fun, chunk),), callback=store_chunk,
+                                  error_callback=store_chunk)
+                    state['chunk_bytes'][state['submitted']] = chunk_bytes
+                    state['submitted'] += 1
+                    chunks_in_flight += 1
+                    bytes_in_flight += chunk_bytes
+                    submitted = True
+
+            if chunks_in_flight == 0:  # All tasks are processed
+                break
+            chunks_finished.get()
+
+            # Process the finished chunks in order for each portal. This is single process (writes to files)
+            for (portal_key, _, _, _, _, _, result_fun, after_function, after_params, fhandles), state in \
+                    zip(jobs, job_states):
+                while state['processed'] in state['finished']:
+                    results = state['finished'].pop(state['processed'])
+                    bytes_in_flight -= state['chunk_bytes'].pop(state['processed'])
+                    state['processed'] += 1
+                    chunks_in_flight -= 1
+                    if isinstance(results, BaseException):
+                        raise results
+                    for ret in results:
+                        yield portal_key, after_function(result_fun(ret), after_params, fhandles)
+
+
+def run_job(job_fun, warc_level_params, file_names_and_modes, main_function, sub_functions, after_function,
+            after_params, processes=None, max_bytes_in_flight=MAX_BYTES_IN_FLIGHT):
+    """Run the job of one portal created by job_fun in its own process pool and yield the results of after_function"""
+    with Manager() as man, ExitStack() as exit_stack:
+        fhandles = exit_stack.enter_context(open_multiple_files(file_names_and_modes))
+        job = job_fun(warc_level_params, main_function, sub_functions, exit_stack, man.Queue())
+        for _, ret in run_jobs_in_pool([(None, *job, after_function, after_params, fhandles)], processes,
+                                       max_bytes_in_flight=max_bytes_in_flight):
+            yield ret
+
+
 # This function is used outside of this file
 def run_multiple_process(warc_level_params, file_names_and_modes, main_function, sub_functions, after_function,
-                         after_params):
+                         after_params, processes=None, max_bytes_in_flight=MAX_BYTES_IN_FLIGHT):
     """Read a WARC file and sequentially process all articles in it with main_function in parallel preserving ordering
         (multi-page articles are handled as one entry) and yield the result after filtered through after_function
     """
-    # This is parallel as it computes each page separately. Order preserved!
-    with Manager() as man:
-        log_queue = man.Queue()
-        logger_obj = sub_functions[0][0]
-        with logger_obj.init_mp_logging_context(log_queue) as mp_logger, \
-                open_multiple_files(file_names_and_modes) as fhandles, Pool() as p:
-            sub_functions[0][0] = mp_logger
-            queue = p.imap(main_function, aggregated_multipage_articles_gen(warc_level_params, sub_functions),
-                           chunksize=1000)
-            for ret in queue:  # This is single process because it writes to files
-                yield after_function(ret, after_params, fhandles)
+    yield from run_job(multiple_process_job, warc_level_params, file_names_and_modes, main_function, sub_functions,
+                       after_function, after_params, processes, max_bytes_in_flight)
+
+
+# This function is used outside of this file
+def run_multiple_process_read_in_workers(warc_level_params, file_names_and_modes, main_function, sub_functions,
+                                         after_function, after_params, processes=None,
+                                         max_bytes_in_flight=MAX_BYTES_IN_FLIGHT):
+    """Read a WARC file and process all articles in it with main_function in parallel preserving ordering
+        (multi-page articles are handled as one entry) and yield the result after filtered through after_function.
+       Unlike run_multiple_process the parent process only emits the (WARC filename, offset, length, URL) of
+        the first pages and the workers read, decompress, decode and transform the WARC records themselves
+    """
+    yield from run_job(read_in_workers_job, warc_level_params, file_names_and_modes, main_function, sub_functions,
+                       after_function, after_params, processes, max_bytes_in_flight)
+
+
+# This function is used outside of this file
+def run_multiple_process_map_reduce(warc_level_params, file_names_and_modes, main_function, sub_functions,
+                                    after_function, after_params, processes=None,
+                                    max_bytes_in_flight=MAX_BYTES_IN_FLIGHT, batch_size=100):
+    """Read a WARC file and process all articles in it with main_function in parallel (multi-page articles are handled
+        as one entry) in batches. Each batch is summarised into a local accumulator in the worker (map step),
+        which is merged into the accumulator of the task with after_function in the parent process preserving ordering
+        (reduce step) and yield the results of after_function.
+       The layout of sub_functions must be the same as for process_article
+        (the accumulator is the first parameter of the subfunction)
+    """
+    yield from run_job(partial(map_reduce_job, batch_size=batch_size), warc_level_params, file_names_and_modes,
+                       main_function, sub_functions, after_function, after_params, processes, max_bytes_in_flight)
+
+
+# The jobs of the parallel runners to be able to run multiple portals in one shared process pool
+#  (see run_main_concurrently)
+POOL_JOBS = {run_multiple_process: multiple_process_job,
+             run_multiple_process_read_in_workers: read_in_workers_job,
+             run_multiple_process_map_reduce: map_reduce_job}
 
 
 # This function is used outside of this file
@@ -127,6 +579,9 @@ def dummy_fun(*_):
 
 LOCALE_LOCK = threading_Lock()
 
+# The directives of strptime which depend on the locale (names of months and days, AM/PM and the locale's formats)
+LOCALE_DEPENDENT_DIRECTIVES = re_compile(r'%[aAbBpcxX]')
+
 
 @contextmanager
 def safe_setlocale(name):
@@ -148,7 +603,14 @@ def safe_setlocale(name):
 
 # This function is used outside of this file
 def parse_date(date_raw, date_format, locale='hu_HU.UTF-8'):
-    """Parse date according to the parameters (locale and date format)"""
+    """Parse date according to the parameters (locale and date format)
+        The locale is only set if the date format depends on it (e.g. not for ISO dates)
+    """
+    if LOCALE_DEPENDENT_DIRECTIVES.search(date_format) is None:
+        try:
+            return datetime.strptime(date_raw, date_format)
+        except ValueError:
+            return None
     with safe_setlocale(locale):
         try:
             return datetime.strptime(date_raw, date_format)
@@ -183,37 +645,110 @@ def process_article(params):
             tei_logger.log('ERROR', 'UNICODE error', article_url)
 
 
+def read_and_init_portal(warc_name, portal_name, configs_dir, log_dir, warc_dir, output_dir, init_portal_fun,
+                         run_params, logfile_level, console_level):
+    """Read the portal-specific configuration and initialize the variables of the task for a WARC-portal pair"""
+    # 1. Read portal-specific configuration (initializing the dictionaries based on the received parameters)
+    tei_logger, warc_level_params, *rest_config_params = \
+        read_portalspec_config(configs_dir, portal_name, warc_dir, warc_name, log_dir, run_params,
+                               logfile_level=logfile_level, console_level=console_level)
+
+    # 2. Create (or load) the multi-page chain index in parallel if it is requested
+    load_or_create_multipage_chain_index(warc_level_params, run_params.get('persist_multipage_chains', False))
+
+    # 3. Initialize variables according to the given task
+    task_params = init_portal_fun(log_dir, output_dir, run_params, portal_name, tei_logger, warc_level_params,
+                                  rest_config_params)
+
+    return portal_name, tei_logger, warc_level_params, task_params
+
+
+def finish_portal(portal_name, tei_logger, dates, task_params):
+    """After all articles are processed summarize the accumulated information (dates, etc.)"""
+    accumulator, _, _, _, out_filenames_and_modes, final_fun, *_ = task_params
+    with open_multiple_files(out_filenames_and_modes) as out_files:
+        final_fun(dates, out_files, accumulator, tei_logger)
+
+    tei_logger.log('INFO', f'{portal_name} PORTAL FINISHED')
+
+
+def run_portal(portal_name, tei_logger, warc_level_params, task_params, pool_params):
+    """Process all articles in the WARC file sequentially or parallel (according to run_fun)"""
+    _, after_article_fun, after_article_params, log_file_names_and_modes, _, _, process_article_fun, \
+        process_article_params, run_fun = task_params
+    if run_fun not in POOL_JOBS:
+        pool_params = {}  # Single-process runner
+    date_max = datetime(MINYEAR, 1, 1)
+    date_min = datetime(MAXYEAR, 1, 1)
+    for publish_date in run_fun(warc_level_params, log_file_names_and_modes, process_article_fun,
+                                process_article_params, after_article_fun, after_article_params, **pool_params):
+        if publish_date is not None:
+            date_min = min(date_min, publish_date)
+            date_max = max(date_max, publish_date)
+
+    finish_portal(portal_name, tei_logger, (date_min, date_max), task_params)
+
+
+def run_portals_concurrently(portals, pool_params, max_chunks_per_portal=None):
+    """Process the portals which have a parallel runner (see POOL_JOBS) at once in one shared process pool
+        and the rest sequentially afterwards. The tasks of the portals with the largest WARC files
+        (the estimated amount of work) are submitted first in each round
+    """
+    portals = sorted(portals, key=lambda portal: os_path_getsize(portal[2][0]), reverse=True)
+    pool_portals = [portal for portal in portals if portal[3][8] in POOL_JOBS]
+    dates = [[datetime(MAXYEAR, 1, 1), datetime(MINYEAR, 1, 1)] for _ in pool_portals]
+
+    with Manager() as man, ExitStack() as exit_stack:
+        jobs = []
+        for portal_key, (portal_name, tei_logger, warc_level_params, task_params) in enumerate(pool_portals):
+            _, after_article_fun, after_article_params, log_file_names_and_modes, _, _, process_article_fun, \
+                process_article_params, run_fun = task_params
+            fhandles = exit_stack.enter_context(open_multiple_files(log_file_names_and_modes))
+            job = POOL_JOBS[run_fun](warc_level_params, process_article_fun, process_article_params, exit_stack,
+                                     man.Queue())
+            jobs.append((portal_key, *job, after_article_fun, after_article_params, fhandles))
+
+        for portal_key, publish_date in run_jobs_in_pool(jobs, pool_params['processes'], max_chunks_per_portal,
+                                                         pool_params['max_bytes_in_flight']):
+            if publish_date is not None:
+                portal_dates = dates[portal_key]
+                portal_dates[0] = min(portal_dates[0], publish_date)
+                portal_dates[1] = max(portal_dates[1], publish_date)
+
+    for (portal_name, tei_logger, _, task_params), (date_min, date_max) in zip(pool_portals, dates):
+        finish_portal(portal_name, tei_logger, (date_min, date_max), task_params)
+
+    # Portals that can be run only in single-process mode
+    for portal in portals:
+        if portal[3][8] not in POOL_JOBS:
+            run_portal(*portal, pool_params)
+
+
 # This function is used outside of this file
 def run_main(warc_filename, configs_dir, log_dir, warc_dir, output_dir, init_portal_fun, run_params=None,
              logfile_level='INFO', console_level='INFO'):
-    """This is the main function. It reads the input warc-portalname pairs and process them one by one"""
+    """This is the main function. It reads the input warc-portalname pairs and process them one by one
+        or (if concurrent_portals is set in run_params) at once in one shared process pool
+    """
 
-    check_exists(output_dir, check_fun=os_path_isdir, message='Directory not found')
+    if run_params is None:
+        run_params = {}
 
-    for warc_name, portal_name in read_input_config(warc_filename):
+    check_exists(output_dir, check_fun=os_path_isdir, message='Directory not found')
 
-        # 1. Read portal-specific configuration (initializing the dictionaries based on the received parameters)
-        tei_logger, warc_level_params, *rest_config_params = \
-            read_portalspec_config(configs_dir, portal_name, warc_dir, warc_name, log_dir, run_params,
-                                   logfile_level=logfile_level, console_level=console_level)
-
-        # 2. Initialize variables according to the given task
-        accumulator, after_article_fun, after_article_params, log_file_names_and_modes, out_filenames_and_modes,\
-            final_fun, process_article_fun, process_article_params, run_fun = \
-            init_portal_fun(log_dir, output_dir, run_params, portal_name, tei_logger,
-                            warc_level_params, rest_config_params)
-
-        # 3. Process all articles in the WARC file sequentially or parallel (according to run_fun)
-        date_max = datetime(MINYEAR, 1, 1)
-        date_min = datetime(MAXYEAR, 1, 1)
-        for publish_date in run_fun(warc_level_params, log_file_names_and_modes, process_article_fun,
-                                    process_article_params, after_article_fun, after_article_params):
-            if publish_date is not None:
-                date_min = min(date_min, publish_date)
-                date_max = max(date_max, publish_date)
+    # The parameters of the process pools (the number of worker processes and the memory budget of the articles
+    #  in flight)
+    pool_params = {'processes': run_params.get('processes'),
+                   'max_bytes_in_flight': run_params.get('max_megabytes_in_flight', MAX_BYTES_IN_FLIGHT // 2**20) *
+                   2**20}
 
-        # 4. After all articles are processed summarize the accumulated information (dates, etc.)
-        with open_multiple_files(out_filenames_and_modes) as out_files:
-            final_fun((date_min, date_max), out_files, accumulator, tei_logger)
+    if run_params.get('concurrent_portals', False):
+        portals = [read_and_init_portal(warc_name, portal_name, configs_dir, log_dir, warc_dir, output_dir,
+                                        init_portal_fun, run_params, logfile_level, console_level)
+                   for warc_name, portal_name in read_input_config(warc_filename)]
+        run_portals_concurrently(portals, pool_params, run_params.get('max_chunks_per_portal'))
+        return
 
-        tei_logger.log('INFO', f'{portal_name} PORTAL FINISHED')
+    for warc_name, portal_name in read_input_config(warc_filename):
+        run_portal(*read_and_init_portal(warc_name, portal_name, configs_dir, log_dir, warc_dir, output_dir,
+                                         init_portal_fun, run_params, logfile_level, console_level), pool_params)
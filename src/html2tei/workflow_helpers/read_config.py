@@ -3,7 +3,8 @@
 
 import sys
 import importlib.util
-from copy import deepcopy
+from functools import partial
+from copy import copy, deepcopy
 from argparse import Namespace
 from collections import Counter
 from os.path import join as os_path_join, split as os_path_split, isfile, isdir, abspath, splitext
@@ -12,7 +13,7 @@ from lxml import etree
 from mplogger import Logger
 from yaml import load as yaml_load, SafeLoader
 
-from ..basic_tag_dicts import BLOCK_RULES
+from ..basic_tag_dicts import BLOCK_RULES, BLOCKS, UNUSED_TAGS
 from ..json_utils import default_transform_to_html_fun
 
 
@@ -29,9 +30,26 @@ def check_exists(filesystem_path, tei_logger=None, check_fun=isfile, message='Fi
         exit(1)
 
 
+def compile_tag_normal_table(normal_name, preserved_attribute):
+    """Precompute the action of the normalized name of a tag (as used by the eltedh article body converter):
+        (action, the new name of the tag, the name of the new outer tag or None, the attribute to be preserved)
+    """
+    if normal_name in UNUSED_TAGS:
+        return 'unwrap', 'to_unwrap', None, preserved_attribute
+    elif normal_name in BLOCKS or normal_name == 'szakasz':
+        return 'block', normal_name, None, preserved_attribute
+    elif normal_name == 'decompose':
+        return 'decompose', 'to_decompose', None, preserved_attribute
+    elif ';' in normal_name:
+        inner_level, outer_level = normal_name.split(';', maxsplit=1)
+        return 'wrap', inner_level, outer_level, preserved_attribute
+    return 'rename', normal_name, None, preserved_attribute
+
+
 def load_portal_specific_dicts(text_tags_normal_fn, notext_tags_normal_fn, portal_specific_block_rules, tei_logger):
     """Load portal_specific TSV files (text and notext) into dictionaries.
-    The header is kept in the dictionary, as it differs from the other keys (HTML tags) therefore it is ignored."""
+    The header is kept in the dictionary, as it differs from the other keys (HTML tags) therefore it is ignored.
+    The normalized names are compiled into actions (see compile_tag_normal_table)."""
     with open(text_tags_normal_fn, encoding='UTF-8') as text_tags_dict, \
             open(notext_tags_normal_fn, encoding='UTF-8') as notext_tags_dict:
         portal_tags_to_normal = {}
@@ -48,7 +66,7 @@ def load_portal_specific_dicts(text_tags_normal_fn, notext_tags_normal_fn, porta
                 except ValueError:
                     tei_logger.log('CRITICAL', f'{fn} at line {line_no}: the number of fields does not match!')
                     exit(1)
-                portal_tags_to_normal[freezed_tag] = '\t'.join([normal_name, preserved_attribute])
+                portal_tags_to_normal[freezed_tag] = compile_tag_normal_table(normal_name, preserved_attribute)
     merged_portal_specific_block_rules = deepcopy(BLOCK_RULES)
     for block_key, block_value in portal_specific_block_rules.items():
         for three_key, t_value in block_value.items():
@@ -77,13 +95,21 @@ def get_portal_spec_fun_and_dict_names(module_fn, tei_logger):
         portal_speicific_funs_and_constants.append(e_loaded)
 
     # Optional parameters
-    for fun_or_const, def_value in (('transform_to_html', default_transform_to_html_fun),):
+    for fun_or_const, def_value in (('transform_to_html', default_transform_to_html_fun),
+                                    ('GET_META_MUTATES_TREE_SPEC', False)):
         e_loaded = getattr(portal_spec_module, fun_or_const, def_value)
         portal_speicific_funs_and_constants.append(e_loaded)
 
     return portal_speicific_funs_and_constants
 
 
+def get_meta_on_tree_snapshot(get_meta_fun, tei_logger, url, bs):
+    """The parsed page is shared between the metadata extraction and the article body converter.
+        If the portal-specific get_meta function modifies the tree (e.g. decomposes some tags),
+        it must receive a snapshot to leave the tree intact for the converter"""
+    return get_meta_fun(tei_logger, url, copy(bs))
+
+
 def read_portal_tei_base_file(tei_base_dir_and_name, tei_logger):
     """Read TEI XML base to be extended for the specific articles
         as it is not valid TEI XML at this point we can check only its well-formedness"""
@@ -109,6 +135,7 @@ def import_python_file(file_path, package=None):
 
 
 WRITE_OUT_MODES = {'eltedh': ('.article_body_converters.eltedh_abc.py', 'html2tei'),
+                   'eltedh-lxml': ('.article_body_converters.eltedh_lxml_abc.py', 'html2tei'),
                    'justext': ('.article_body_converters.justext_abc.py', 'html2tei'),
                    'newspaper3k': ('.article_body_converters.newspaper_abc.py', 'html2tei'),
                    'trafilatura': ('.article_body_converters.trafilatura_abc.py', 'html2tei'),
@@ -141,15 +168,24 @@ def read_portalspec_config(configs_dir, portal_name, warc_dir, warc_name, log_di
     check_exists(portal_spec_module_fn, tei_logger)
     blacklist_spec, multipage_compile, next_page_of_article_fun, get_meta_fun_spec, article_root_params, \
         decompose_spec, excluded_tags_spec, portal_url_prefix, link_filter_spec, links, block_rules_spec, \
-        bigram_rules_spec, transform_to_html_fun = get_portal_spec_fun_and_dict_names(portal_spec_module_fn, tei_logger)
+        bigram_rules_spec, transform_to_html_fun, get_meta_mutates_tree = \
+        get_portal_spec_fun_and_dict_names(portal_spec_module_fn, tei_logger)
+    if get_meta_mutates_tree:
+        # A copy is made only for the configs which declare that they need one (picklable for multiprocessing)
+        get_meta_fun_spec = partial(get_meta_on_tree_snapshot, get_meta_fun_spec)
 
     # WARC reading stuff
     warc_name = os_path_join(warc_dir, warc_name)
     check_exists(warc_name, tei_logger)
 
     warc_date_interval = {}  # Actually the maximal date interval for HTTP responses in the WARC file
+    # The first page URL -> ordered page URLs index of the articles filled before processing if it is requested
+    #  (see load_or_create_multipage_chain_index)
+    multipage_chains = {} if run_params.get('multipage_chains', False) else None
+    # The URLs of the articles to skip filled by the task if needed (e.g. the ones already done in a resumed run)
+    skip_urls = set()
     warc_level_params = (warc_name, blacklist_spec, multipage_compile, tei_logger, warc_date_interval,
-                         next_page_of_article_fun, transform_to_html_fun)
+                         next_page_of_article_fun, transform_to_html_fun, multipage_chains, skip_urls)
 
     # Portal specific TSV dictionaries stuff
     if run_params.get('w_specific_dicts', False):
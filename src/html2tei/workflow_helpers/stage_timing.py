@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from heapq import heappush, heappushpop
+from time import perf_counter
+from math import log2, ceil
+
+# The timer of the article being processed in this process (None if stage timing is turned off)
+STAGE_TIMER = None
+
+# Durations are put into logarithmic buckets: 8 buckets per doubling starting from 1 microsecond (~9% precision)
+BUCKETS_PER_DOUBLING = 8
+MIN_SECONDS = 1e-6
+NUM_OF_BUCKETS = 40 * BUCKETS_PER_DOUBLING  # Up to ~12 days
+NUM_OF_SLOWEST_URLS = 5
+
+
+class StageTimer:
+    """Record the wall time elapsed between the checkpoints of processing one article
+        and the number of tags in the tree after each stage if count_nodes is True (and the counters of the stages,
+        e.g. cache hits)
+       Counting the tags walks the whole tree at every checkpoint (~25 times per article), so it is opt-in
+    """
+    __slots__ = ('stage_times', 'counters', '_count_nodes', '_last')
+
+    def __init__(self, count_nodes=False):
+        self.stage_times = {}
+        self.counters = {}
+        self._count_nodes = count_nodes
+        self._last = perf_counter()
+
+    def checkpoint(self, stage_name, tree):
+        elapsed = perf_counter() - self._last
+        if tree is None or not self._count_nodes:
+            num_of_nodes = 0
+        elif hasattr(tree, 'find_all'):  # BeautifulSoup
+            num_of_nodes = len(tree.find_all())
+        else:  # lxml (eltedh-lxml)
+            num_of_nodes = sum(1 for _ in tree.iterdescendants())
+        seconds, nodes = self.stage_times.get(stage_name, (0.0, 0))  # The pages of multi-page articles are summed
+        self.stage_times[stage_name] = (seconds + elapsed, nodes + num_of_nodes)
+        self._last = perf_counter()  # Do not count the counting of the nodes
+
+    def count(self, counter_name, n):
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + n
+
+
+# This function is used outside of this file
+def start_stage_timing(count_nodes=False):
+    """Start recording the stage times (and the number of tags if count_nodes is True) of a new article
+        in this process
+    """
+    global STAGE_TIMER
+    STAGE_TIMER = StageTimer(count_nodes)
+
+
+# This function is used outside of this file
+def stop_stage_timing():
+    """Stop recording and return the stage times ({stage_name: (seconds, nodes)}) and the counters
+        ({counter_name: count}) of the article or None if the timing was not started
+    """
+    global STAGE_TIMER
+    stage_timer, STAGE_TIMER = STAGE_TIMER, None
+    if stage_timer is None:
+        return None
+    return stage_timer.stage_times, stage_timer.counters
+
+
+# This function is used outside of this file
+def stage_checkpoint(stage_name, tree=None):
+    """Mark the end of a stage (it costs a variable lookup when the timing is turned off)"""
+    if STAGE_TIMER is not None:
+        STAGE_TIMER.checkpoint(stage_name, tree)
+
+
+# This function is used outside of this file
+def stage_count(counter_name, n=1):
+    """Add to a counter of the article (it costs a variable lookup when the timing is turned off)"""
+    if STAGE_TIMER is not None:
+        STAGE_TIMER.count(counter_name, n)
+
+
+# This class is used outside of this file
+class StageStatistics:
+    """Aggregate the stage times of the articles (from all workers) with constant memory per stage:
+        the percentiles are estimated from logarithmic histograms and only the slowest URLs are kept
+    """
+    def __init__(self):
+        self._stages = {}  # Keeps the order of the first occurrence (the order of the pipeline)
+        self._counters = {}
+
+    def add(self, url, stage_times, counters):
+        for counter_name, n in counters.items():
+            self._counters[counter_name] = self._counters.get(counter_name, 0) + n
+        total = 0.0
+        for stage_name, (seconds, nodes) in stage_times.items():
+            self._add_one(stage_name, url, seconds, nodes)
+            total += seconds
+        self._add_one('TOTAL', url, total, 0)
+
+    def _add_one(self, stage_name, url, seconds, nodes):
+        stage = self._stages.get(stage_name)
+        if stage is None:
+            stage = {'count': 0, 'seconds': 0.0, 'max': 0.0, 'nodes': 0, 'histogram': [0] * NUM_OF_BUCKETS,
+                     'slowest': []}
+            self._stages[stage_name] = stage
+        stage['count'] += 1
+        stage['seconds'] += seconds
+        stage['max'] = max(stage['max'], seconds)
+        stage['nodes'] += nodes
+        stage['histogram'][bucket_of(seconds)] += 1
+        if len(stage['slowest']) < NUM_OF_SLOWEST_URLS:
+            heappush(stage['slowest'], (seconds, url))
+        elif seconds > stage['slowest'][0][0]:
+            heappushpop(stage['slowest'], (seconds, url))
+
+    def write_report(self, out_file):
+        """Write the report as TSV: one line for each stage in the order of the pipeline and one for the total"""
+        print('stage', 'articles', 'total_seconds', 'percent', 'mean_ms', 'p50_ms', 'p99_ms', 'max_ms', 'avg_nodes',
+              'slowest_urls', sep='\t', file=out_file)
+        total_seconds = self._stages['TOTAL']['seconds'] if 'TOTAL' in self._stages else 0.0
+        stages = [(name, stage) for name, stage in self._stages.items() if name != 'TOTAL']
+        if 'TOTAL' in self._stages:
+            stages.append(('TOTAL', self._stages['TOTAL']))
+        for stage_name, stage in stages:
+            count = stage['count']
+            slowest_urls = ' '.join(f'{url}:{seconds:.3f}' for seconds, url in sorted(stage['slowest'], reverse=True))
+            print(stage_name, count, f'{stage["seconds"]:.3f}',
+                  f'{100 * stage["seconds"] / total_seconds if total_seconds > 0 else 0.0:.1f}',
+                  f'{1000 * stage["seconds"] / count:.3f}',
+                  f'{1000 * min(percentile(stage["histogram"], count, 0.5), stage["max"]):.3f}',
+                  f'{1000 * min(percentile(stage["histogram"], count, 0.99), stage["max"]):.3f}',
+                  f'{1000 * stage["max"]:.3f}', f'{stage["nodes"] / count:.1f}', slowest_urls, sep='\t', file=out_file)
+
+    def log_counters(self, tei_logger):
+        """Log the totals of the counters and the hit rates of the caches
+            (for the pairs of NAME_hits and NAME_misses)
+        """
+        for counter_name, total in self._counters.items():
+            tei_logger.log('INFO', f'{counter_name}: {total}')
+        for counter_name, hits in self._counters.items():
+            if counter_name.endswith('_hits'):
+                cache_name = counter_name[:-len('_hits')]
+                lookups = hits + self._counters.get(f'{cache_name}_misses', 0)
+                if lookups > 0:
+                    tei_logger.log('INFO', f'{cache_name}_hit_rate: {hits / lookups:.4f}')
+
+
+def bucket_of(seconds):
+    if seconds <= MIN_SECONDS:
+        return 0
+    return min(int(log2(seconds / MIN_SECONDS) * BUCKETS_PER_DOUBLING), NUM_OF_BUCKETS - 1)
+
+
+def percentile(histogram, count, ratio):
+    """The upper bound of the bucket containing the given percentile"""
+    rank = max(ceil(count * ratio), 1)
+    cumulative = 0
+    for bucket, bucket_count in enumerate(histogram):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return MIN_SECONDS * 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING)
+    return 0.0
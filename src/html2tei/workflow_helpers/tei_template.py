@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from copy import copy, deepcopy
+
+from bs4 import BeautifulSoup
+from bs4.element import Tag, NavigableString, PreformattedString
+from lxml import etree
+
+from ..tei_utils import create_new_tag_with_string
+
+DUPL_METAS = {'sch:keywords', 'sch:author', 'sch:contentLocation', 'sch:artist', 'sch:source'}
+EMPTY_ARTICLE_NOTE = 'A cikk tartalma az archiválás pillanatában nem volt elérhető./' \
+                     'The content of the article was not available at the time of archiving.'
+
+# The serializers of the TEI XML output: prettify is the original output (BeautifulSoup, byte-compatible),
+#  compact and indent are built and written by lxml (the same XML apart from the whitespace between the tags)
+TEI_SERIALIZERS = ('prettify', 'compact', 'indent')
+
+# The slots which are filled in for every article (the rest are only needed for some of the articles)
+MANDATORY_SLOTS = ('title_stmt', 'idno', 'source_date', 'description', 'tei_descriptions',
+                   'identifier', 'sd_date_published', 'last_reviewed', 'revision_desc', 'change', 'note_change', 'body')
+
+BLANK_TEXT_REMOVING_PARSER = etree.XMLParser(remove_blank_text=True)
+
+# The templates by the base TEI XML strings of the portals and the serializers (kept in each process across articles)
+TEI_TEMPLATES = {}
+
+
+# Only TEI_SERIALIZERS, tei_template, TeiArticle and TeiTemplate are used outside of this file
+
+def tei_template(xml_string, serializer):
+    """The TeiTemplate of the base TEI XML string and the serializer (created at the first use in each process)"""
+    template = TEI_TEMPLATES.get((xml_string, serializer))
+    if template is None:
+        template = TeiTemplate(xml_string, serializer)
+        TEI_TEMPLATES[(xml_string, serializer)] = template
+    return template
+
+
+def root_tag(beauty_xml):
+    return next(child for child in beauty_xml.contents if isinstance(child, Tag))
+
+
+def child_tags(tag):
+    return [child for child in tag.contents if isinstance(child, Tag)]
+
+
+def child_elements(element):
+    return [child for child in element if isinstance(child.tag, str)]  # Without the comments and the PIs
+
+
+def tag_path(tag):
+    """The indices of the tag and its ancestors among the tags of their parents up to the root tag of the document"""
+    path = []
+    while not isinstance(tag.parent, BeautifulSoup):
+        path.append(child_tags(tag.parent).index(tag))
+        tag = tag.parent
+    path.reverse()
+    return tuple(path)
+
+
+def find_slots(beauty_xml):
+    """Find the tags of the base TEI XML which are filled in or extended for the articles
+        (the first occurrences, as BeautifulSoup.find() finds them in the original document)
+    """
+    slots = {}
+    title_stmt = beauty_xml.find('titleStmt')
+    if title_stmt is not None:
+        slots['title_stmt'] = title_stmt
+        slots['title_stmt_title'] = title_stmt.title
+    slots['idno'] = beauty_xml.find('idno')
+    source_desc = beauty_xml.find('sourceDesc')
+    if source_desc is not None:
+        source_dates = source_desc.find_all('date')
+        if len(source_dates) > 2:
+            slots['source_date'] = source_dates[2]
+        slots['source_title'] = source_desc.title
+    description = beauty_xml.find('rdf:Description')
+    if description is not None:
+        slots['description'] = description
+        slots['in_language'] = description.find('sch:inLanguage')
+    # The rdf:about attribute of the first rdf:Description is replaced by the URL before this
+    tei_descriptions = [rdf for rdf in beauty_xml.find_all('rdf:Description')
+                        if rdf is not description and rdf.attrs.get('rdf:about') == 'teiPid']
+    if len(tei_descriptions) > 0:
+        slots['tei_descriptions'] = tei_descriptions
+        tei_description = tei_descriptions[-1]  # All of them get the TEI PID, but the last one gets the data
+        slots['identifier'] = tei_description.find('sch:identifier')
+        slots['sd_date_published'] = tei_description.find('sch:sdDatePublished')
+        slots['last_reviewed'] = tei_description.find('sch:lastReviewed')
+    revision_desc = beauty_xml.find('revisionDesc')
+    if revision_desc is not None:
+        slots['revision_desc'] = revision_desc
+        change = revision_desc.change
+        slots['change'] = change
+        # The first change with a source attribute (the default change gets one before this)
+        slots['note_change'] = next((tag for tag in beauty_xml.find_all('change')
+                                     if tag is change or 'source' in tag.attrs), None)
+    slots['body'] = beauty_xml.body
+    return {name: slot for name, slot in slots.items() if slot is not None}
+
+
+# This class is used outside of this file
+class TeiArticle:
+    """The data of an article to be filled in the template (the dates are in ISO format, the optional parts are None
+        or empty if they are missing) prepared by tei_writer"""
+    __slots__ = ('tei_pid', 'url', 'title', 'alternate_title', 'sources', 'authors', 'date_published',
+                 'date_modified', 'meta_data', 'warc_id', 'warc_date', 'current_time', 'body_contents',
+                 'multipage_warc_datas')
+
+    def __init__(self, tei_pid, url, title, alternate_title, sources, authors, date_published, date_modified,
+                 meta_data, warc_id, warc_date, current_time, body_contents, multipage_warc_datas):
+        self.tei_pid = tei_pid
+        self.url = url
+        self.title = title
+        self.alternate_title = alternate_title
+        self.sources = sources
+        self.authors = authors
+        self.date_published = date_published
+        self.date_modified = date_modified
+        self.meta_data = meta_data
+        self.warc_id = warc_id
+        self.warc_date = warc_date
+        self.current_time = current_time
+        self.body_contents = body_contents
+        self.multipage_warc_datas = multipage_warc_datas
+
+
+# This class is used outside of this file
+class TeiTemplate:
+    """The base TEI XML of a portal parsed only once (in each process) along with the paths of its slots
+        (the tags which are filled in or extended for each article, see find_slots) to be followed in the copies
+        of the template instead of parsing the base TEI XML and searching the slots for every article.
+       The BeautifulSoup copies are parsed from the base TEI XML (pickling the tree recurses along its element links
+        and exceeds the recursion limit for some portals, e.g. index_koronavirus, while copy() parses it as well)
+       The serializers (see TEI_SERIALIZERS) other than prettify fill in an lxml copy of the template
+        (the BeautifulSoup tags of the article body are converted through their XML form)
+    """
+    def __init__(self, xml_string, serializer='prettify'):
+        if serializer not in TEI_SERIALIZERS:
+            raise ValueError(f'{serializer} is not in the allowed value set ({set(TEI_SERIALIZERS)})!')
+        self.serializer = serializer
+        bs_template = BeautifulSoup(xml_string, features='lxml-xml')
+        self._xml_string = xml_string
+        slots = find_slots(bs_template)
+        missing_slots = [name for name in MANDATORY_SLOTS if name not in slots]
+        if len(missing_slots) > 0:
+            raise ValueError(f'The base TEI XML does not contain the following tags: {", ".join(missing_slots)}')
+        tei_descriptions = slots.pop('tei_descriptions')
+        self._slot_paths = {name: tag_path(tag) for name, tag in slots.items()}
+        self._tei_description_paths = [tag_path(tag) for tag in tei_descriptions]
+        self._lxml_template = None
+        if serializer != 'prettify':
+            self._lxml_template = etree.fromstring(xml_string.encode('UTF-8'), BLANK_TEXT_REMOVING_PARSER)\
+                .getroottree()
+            # The namespaces of the new elements (the prefixes of the metadata are declared on xenoData)
+            self._nsmap = self._follow_lxml_path(self._lxml_template.getroot(), self._slot_paths['description']).nsmap
+            body_nsmap = self._follow_lxml_path(self._lxml_template.getroot(), self._slot_paths['body']).nsmap
+            namespace_declarations = ''.join(f' xmlns:{prefix}="{uri}"' if prefix is not None else f' xmlns="{uri}"'
+                                             for prefix, uri in body_nsmap.items())
+            self._fragment_start_tag = f'<body{namespace_declarations}>'
+
+    @staticmethod
+    def _follow_bs_path(tag, path):
+        for i in path:
+            tag = child_tags(tag)[i]
+        return tag
+
+    @staticmethod
+    def _follow_lxml_path(element, path):
+        for i in path:
+            element = child_elements(element)[i]
+        return element
+
+    def _slots(self, root, follow_path):
+        slots = {name: follow_path(root, path) for name, path in self._slot_paths.items()}
+        slots['tei_descriptions'] = [follow_path(root, path) for path in self._tei_description_paths]
+        return slots
+
+    def write(self, article):
+        """Fill in a copy of the template with the TeiArticle and return the serialized TEI XML (bytes).
+           The serializers other than prettify fall back to prettify if the article is not valid XML
+            (e.g. it contains control characters) to write it in the same (invalid) form as before
+        """
+        return self.write_with_tree(article)[0]
+
+    def write_with_tree(self, article):
+        """Like write, but return the lxml tree which was serialized along with the serialized TEI XML
+            (e.g. to validate it without parsing the serialized form again) or None if it was serialized by prettify
+        """
+        if self.serializer != 'prettify':
+            try:
+                return self._write_lxml(article)
+            except (etree.XMLSyntaxError, ValueError):
+                pass
+        return self._write_prettify(article), None
+
+    def _write_prettify(self, art):
+        beauty_xml = BeautifulSoup(self._xml_string, features='lxml-xml')
+        slots = self._slots(root_tag(beauty_xml), self._follow_bs_path)
+
+        # TEI <fileDesc>
+        file_title = slots['title_stmt']
+        if art.title is not None:
+            slots['title_stmt_title'].string = art.title
+        slots['idno'].string = art.tei_pid
+
+        # Adding the writer in the code below because it should be in sourceDesc in the same way
+        for one_source in art.sources:
+            org_tag = beauty_xml.new_tag('orgName')
+            org_tag.string = one_source
+            source_org_root = beauty_xml.new_tag('respStmt')
+            source_org_root.append(beauty_xml.new_tag('resp'))
+            source_org_root.append(org_tag)
+            file_title.append(source_org_root)
+
+        # TEI <sourceDesc><bibl>
+        source_date_tag = slots['source_date']
+        if art.date_published is not None:
+            source_date_tag.attrs = {'when': art.date_published}
+        else:
+            source_date_tag.attrs = {'when-custom': 'unknown'}
+        if art.title is not None:
+            slots['source_title'].string = art.title
+        for author_name in art.authors:
+            author_tag = beauty_xml.new_tag('author')
+            one_name = beauty_xml.new_tag('persName')
+            one_name.string = author_name.strip()
+            author_tag.append(one_name)
+            file_title.append(author_tag)
+            sourcedesc_author = copy(author_tag)
+            slots['source_title'].insert_after(sourcedesc_author)
+
+        # XENODATA 1: metadata of article source
+        xeno_meta_datas = slots['description']
+        xeno_meta_datas.attrs['rdf:about'] = art.url
+        for k, v in art.meta_data.items():
+            if v is not None:
+                if k == 'subsection':
+                    one_meta = beauty_xml.new_tag('sch:articleSection')
+                    one_meta.string = v
+                    xeno_meta_datas.find('sch:articleSection').append(one_meta)
+                elif k in DUPL_METAS:
+                    for dupl in v:
+                        create_new_tag_with_string(beauty_xml, dupl, k, xeno_meta_datas)
+                else:
+                    if k == 'sch:inLanguage':
+                        slots['in_language'].string = v
+                    else:
+                        create_new_tag_with_string(beauty_xml, v, k, xeno_meta_datas)
+
+        # XENODATA 2: warc data
+        for rdf in slots['tei_descriptions']:
+            rdf.attrs['rdf:about'] = art.tei_pid
+
+        # XENO 3: TEI file data + article warc response data
+        slots['identifier'].string = art.warc_id
+        slots['sd_date_published'].string = art.current_time
+        slots['last_reviewed'].string = art.warc_date
+
+        # revisionDesc
+        # Default change tag is already present in the XML skeleton
+        change = slots['change']
+        change.attrs['when'] = art.current_time
+        change.attrs['source'] = art.tei_pid
+        if art.date_modified is not None:
+            change_art_modified = beauty_xml.new_tag('change', when=art.date_modified, source=art.url)
+            change_art_modified.string = 'article modified'
+            slots['revision_desc'].append(change_art_modified)
+
+        # FILL TEI BODY
+        body = slots['body']
+        article_title_tag = beauty_xml.new_tag('head', type='title')
+        article_title_tag.string = art.title if art.title is not None else 'unknown'
+        body.append(article_title_tag)
+        if art.alternate_title is not None:
+            article_subtitle_tag = beauty_xml.new_tag('head', type='subtitle')
+            article_subtitle_tag.string = art.alternate_title
+            body.append(article_subtitle_tag)
+        if art.body_contents == 'EMPTY ARTICLE':
+            empty_body_note = beauty_xml.new_tag('note')
+            slots['note_change'].append(empty_body_note)
+            empty_body_note.string = EMPTY_ARTICLE_NOTE
+            body.append(beauty_xml.new_tag('p'))
+        elif isinstance(art.body_contents, list):
+            body.extend(art.body_contents)
+        elif isinstance(art.body_contents, dict):
+            for url, page_contents in art.body_contents.items():
+                div = beauty_xml.new_tag('div')
+                div.attrs = {'source': url, 'type': 'page'}
+                div.extend(page_contents)
+                body.append(div)
+        if art.multipage_warc_datas is not None:
+            note_tag = beauty_xml.new_tag('note')
+            note_tag.string = 'WARC response data per URL:'
+            for url_k, (w_id, w_d) in art.multipage_warc_datas.items():
+                note_p = beauty_xml.new_tag('p')
+                create_new_tag_with_string(beauty_xml, url_k, 'ref', note_p)
+                create_new_tag_with_string(beauty_xml, w_id[1:-1], 'idno', note_p)
+                create_new_tag_with_string(beauty_xml, w_d.isoformat(), 'date', note_p)
+                note_tag.append(note_p)
+            slots['note_change'].append(note_tag)
+        return beauty_xml.prettify().encode('UTF-8')
+
+    def _qname(self, name):
+        """The lxml form of the (prefixed) name of a new element or attribute (as written by BeautifulSoup)"""
+        prefix, _, local_name = name.rpartition(':')
+        namespace = self._nsmap.get(prefix if len(prefix) > 0 else None)
+        if namespace is None:
+            return name
+        return f'{{{namespace}}}{local_name}'
+
+    def _sub_element(self, parent, name, text=None, attrib=None):
+        element = etree.SubElement(parent, self._qname(name), attrib)
+        if text is not None:
+            element.text = text
+        return element
+
+    def _append_bs_contents(self, element, bs_contents):
+        """Append the BeautifulSoup tags and strings to the element through their XML form
+            (the names are resolved in the scope of the TEI body, as in the XML written by BeautifulSoup)
+        """
+        fragment = etree.fromstring(f'{self._fragment_start_tag}{bs_contents_to_xml(bs_contents)}</body>')
+        if fragment.text:
+            if len(element) > 0:
+                element[-1].tail = (element[-1].tail or '') + fragment.text
+            else:
+                element.text = (element.text or '') + fragment.text
+        element.extend(fragment)  # The elements keep their tails
+
+    def _write_lxml(self, art):
+        tree = deepcopy(self._lxml_template)
+        slots = self._slots(tree.getroot(), self._follow_lxml_path)
+        sub_element = self._sub_element
+
+        # TEI <fileDesc>
+        file_title = slots['title_stmt']
+        if art.title is not None:
+            set_string(slots['title_stmt_title'], art.title)
+        set_string(slots['idno'], art.tei_pid)
+        for one_source in art.sources:
+            source_org_root = sub_element(file_title, 'respStmt')
+            sub_element(source_org_root, 'resp')
+            sub_element(source_org_root, 'orgName', one_source)
+
+        # TEI <sourceDesc><bibl>
+        source_date_tag = slots['source_date']
+        source_date_tag.attrib.clear()
+        if art.date_published is not None:
+            source_date_tag.set('when', art.date_published)
+        else:
+            source_date_tag.set('when-custom', 'unknown')
+        if art.title is not None:
+            set_string(slots['source_title'], art.title)
+        for author_name in art.authors:
+            author_tag = sub_element(file_title, 'author')
+            sub_element(author_tag, 'persName', author_name.strip())
+            slots['source_title'].addnext(deepcopy(author_tag))
+
+        # XENODATA 1: metadata of article source
+        xeno_meta_datas = slots['description']
+        xeno_meta_datas.set(self._qname('rdf:about'), art.url)
+        for k, v in art.meta_data.items():
+            if v is not None:
+                if k == 'subsection':
+                    article_section = xeno_meta_datas.find(f'.//{self._qname("sch:articleSection")}')
+                    sub_element(article_section, 'sch:articleSection', v)
+                elif k in DUPL_METAS:
+                    for dupl in v:
+                        sub_element(xeno_meta_datas, k, dupl.strip())
+                elif k == 'sch:inLanguage':
+                    set_string(slots['in_language'], v)
+                else:
+                    sub_element(xeno_meta_datas, k, v.strip())
+
+        # XENODATA 2: warc data
+        for rdf in slots['tei_descriptions']:
+            rdf.set(self._qname('rdf:about'), art.tei_pid)
+
+        # XENO 3: TEI file data + article warc response data
+        set_string(slots['identifier'], art.warc_id)
+        set_string(slots['sd_date_published'], art.current_time)
+        set_string(slots['last_reviewed'], art.warc_date)
+
+        # revisionDesc
+        change = slots['change']
+        change.set('when', art.current_time)
+        change.set('source', art.tei_pid)
+        if art.date_modified is not None:
+            sub_element(slots['revision_desc'], 'change', 'article modified',
+                        {'when': art.date_modified, 'source': art.url})
+
+        # FILL TEI BODY
+        body = slots['body']
+        sub_element(body, 'head', art.title if art.title is not None else 'unknown', {'type': 'title'})
+        if art.alternate_title is not None:
+            sub_element(body, 'head', art.alternate_title, {'type': 'subtitle'})
+        if art.body_contents == 'EMPTY ARTICLE':
+            sub_element(slots['note_change'], 'note', EMPTY_ARTICLE_NOTE)
+            sub_element(body, 'p')
+        elif isinstance(art.body_contents, list):
+            self._append_bs_contents(body, art.body_contents)
+        elif isinstance(art.body_contents, dict):
+            for url, page_contents in art.body_contents.items():
+                div = sub_element(body, 'div', attrib={'source': url, 'type': 'page'})
+                self._append_bs_contents(div, page_contents)
+        if art.multipage_warc_datas is not None:
+            note_tag = sub_element(slots['note_change'], 'note', 'WARC response data per URL:')
+            for url_k, (w_id, w_d) in art.multipage_warc_datas.items():
+                note_p = sub_element(note_tag, 'p')
+                sub_element(note_p, 'ref', url_k.strip())
+                sub_element(note_p, 'idno', w_id[1:-1].strip())
+                sub_element(note_p, 'date', w_d.isoformat().strip())
+
+        if self.serializer == 'indent':
+            etree.indent(tree, space=' ')
+        return etree.tostring(tree, encoding='UTF-8', xml_declaration=True), tree
+
+
+def set_string(element, text):
+    """The same as tag.string = text in BeautifulSoup"""
+    del element[:]
+    element.text = text
+
+
+def escape_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_attribute_value(value):
+    if isinstance(value, list):  # The multi-valued attributes (e.g. class)
+        value = ' '.join(value)
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def bs_contents_to_xml(bs_contents):
+    """The XML form of the BeautifulSoup tags and strings appended by tag.extend(bs_contents) (the same as
+        ''.join(str(c) for c in bs_contents) apart from the form of the empty tags and the quoting of the attributes,
+        but much faster)
+    """
+    if isinstance(bs_contents, Tag):
+        bs_contents = bs_contents.contents
+    elif isinstance(bs_contents, str):
+        bs_contents = [bs_contents]
+    parts = []
+    # The plain strings on the stack are the end tags
+    stack = [NavigableString(c) if type(c) is str else c for c in reversed(bs_contents)]
+    while len(stack) > 0:
+        item = stack.pop()
+        item_type = type(item)
+        if item_type is str:  # The end tags
+            parts.append(item)
+        elif isinstance(item, Tag):
+            name = f'{item.prefix}:{item.name}' if item.prefix else item.name
+            attrs = ''.join(f' {k}="{escape_attribute_value(v)}"' if v is not None else f' {k}'
+                            for k, v in item.attrs.items())
+            if len(item.contents) > 0:
+                parts.append(f'<{name}{attrs}>')
+                stack.append(f'</{name}>')
+                stack.extend(reversed(item.contents))
+            else:
+                parts.append(f'<{name}{attrs}/>')
+        elif isinstance(item, PreformattedString):  # E.g. comments and CDATA sections as BeautifulSoup writes them
+            parts.append(item.output_ready())
+        else:
+            parts.append(escape_text(item))
+    return ''.join(parts)
@@ -2,41 +2,168 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
 from io import BytesIO
-from zipfile import ZipFile
+from hashlib import sha256
 from unicodedata import normalize
 from urllib.parse import urlparse
+from urllib.error import URLError
 from urllib.request import urlopen
 from re import compile as re_compile
-from os import getcwd, makedirs, listdir
+from os import getcwd, makedirs, listdir, environ, replace as os_replace
 from os.path import basename as os_path_basename, isabs as os_path_isabs, isdir as os_path_isdir, \
-    exists as os_path_exists, abspath as os_path_abspath, join as os_path_join
+    exists as os_path_exists, abspath as os_path_abspath, join as os_path_join, isfile as os_path_isfile, \
+    expanduser as os_path_expanduser
 
 import certifi
 from lxml import etree
 from mthasher import MtHasher, ALGORITHMS_GUARANTEED
 
+from .read_config import import_python_file
+from ..output_sinks.zip_sink import compress_member
+
 NOT_ALNUM_WS_OR_DASH = re_compile(r'[^\w\s-]')
 MORE_DASH_OR_WS = re_compile(r'[-\s]+')
 
-# Only init_output_writer is used outside of this file
+DEFAULT_TEI_SCHEMA = 'https://tei-c.org/release/xml/tei/custom/schema/relaxng/tei_all.rng'
+
+# The formats of the output of the valid TEI XMLs (the modules define OutputSink, see ShardedOutputSink)
+#  tar.zst and parquet need the zstandard and pyarrow packages (the zstandard and parquet extras)
+OUTPUT_SINKS = {'zip': ('.output_sinks.zip_sink.py', 'html2tei'),
+                'jsonl': ('.output_sinks.jsonl_sink.py', 'html2tei'),
+                'tar.zst': ('.output_sinks.tar_zst_sink.py', 'html2tei'),
+                'parquet': ('.output_sinks.parquet_sink.py', 'html2tei'),
+                }
+
+# The compiled RelaxNG validators by the SHA-256 hashes of the schemas (kept in each process across portals)
+RELAXNG_VALIDATORS = {}
+
+# The RelaxNG validators and the hashers by the schema and the hash algorithms created once in each (worker) process
+#  (see validate_and_hash_tei)
+TEI_CHECKERS = {}
+
+# Only DEFAULT_TEI_SCHEMA, OUTPUT_SINKS, init_output_writer, validate_and_hash_tei and keep_complete_lines
+#  are used outside of this file
 
 
-def init_output_writer(output_dir, portal_name, output_debug, tei_logger):
+def init_output_writer(output_dir, portal_name, output_debug, tei_logger, resume=False,
+                       tei_schema=DEFAULT_TEI_SCHEMA, output_sink='zip', sink_params=None):
     """Initialises the class for writing output:
-        1. Normal mode: valid XMLs go into a zip file, invalid ones go to output_dir directory
-         while a separate file is created to store the hashsums of the zipped files (all filenames are UUIDs)
+        1. Normal mode: valid XMLs go into a zip file (or into the output sink, see OUTPUT_SINKS), invalid ones go
+         to output_dir directory while a separate file is created to store the hashsums of the valid files
+         (all filenames are UUIDs)
         2. Debug mode: all XMLs go into output_dir directory (all filenames are slugs from the URL)
+       If resume is True the existing output is kept and extended (see the output writer classes)
+       The TEI XMLs are validated with tei_schema (a RelaxNG schema: URL or local file, see relaxng_validator)
+       sink_params is the dictionary of the parameters of the output sink (e.g. max_shard_bytes, max_shard_members,
+        and compression and compresslevel for zip, see the OutputSink classes)
     """
+    if sink_params is None:
+        sink_params = {}
     if output_debug:
         output_writer_class = StoreFilesWithReadableName
     else:
         output_writer_class = ValidatorHasherCompressor
     output_writer = output_writer_class(tei_logger, os_path_join(output_dir, f'{portal_name}_not_valid'),
-                                        os_path_join(output_dir, f'{portal_name}.zip'),
-                                        os_path_join(output_dir, f'{portal_name}.hashsums'))
+                                        os_path_join(output_dir, portal_name),
+                                        os_path_join(output_dir, f'{portal_name}.hashsums'), tei_schema=tei_schema,
+                                        resume=resume, output_sink=output_sink, sink_params=sink_params)
     return output_writer
 
 
+def schema_cache_dir():
+    """The directory of the downloaded schemas: $XDG_CACHE_HOME/html2tei/schemas (default: ~/.cache/...)"""
+    cache_home = environ.get('XDG_CACHE_HOME') or os_path_join(os_path_expanduser('~'), '.cache')
+    return os_path_join(cache_home, 'html2tei', 'schemas')
+
+
+def read_tei_schema(tei_schema, tei_logger):
+    """Read the schema from a local file or download it from a URL (http or https).
+        The downloaded schemas are stored in the cache directory (see schema_cache_dir) by the hash of their URL
+        and they are read from there later, therefore only the first run needs network access.
+       Return the content of the schema and its location to resolve the relative references (e.g. includes)
+    """
+    if urlparse(tei_schema).scheme not in {'http', 'https'}:
+        if not os_path_isfile(tei_schema):
+            tei_logger.log('CRITICAL', f'The TEI schema ({tei_schema}) does not exist!')
+            exit(1)
+        with open(tei_schema, 'rb') as fh:
+            return fh.read(), os_path_abspath(tei_schema)
+
+    cache_dir = schema_cache_dir()
+    cached_filename = os_path_join(cache_dir, f'{sha256(tei_schema.encode("UTF-8")).hexdigest()}.rng')
+    if os_path_isfile(cached_filename):
+        with open(cached_filename, 'rb') as fh:
+            return fh.read(), tei_schema
+
+    try:
+        with urlopen(tei_schema, cafile=certifi.where()) as response:
+            tei_schema_bytes = response.read()
+    except (URLError, OSError) as err:
+        tei_logger.log('CRITICAL', f'The TEI schema ({tei_schema}) can not be downloaded ({err}),'
+                                   f' use a local copy of it (e.g. --tei-schema tei_all.rng)!')
+        exit(1)
+    try:
+        makedirs(cache_dir, exist_ok=True)
+        with open(f'{cached_filename}.part', 'wb') as fh:
+            fh.write(tei_schema_bytes)
+        os_replace(f'{cached_filename}.part', cached_filename)  # The cache is never left with a partial file
+    except OSError as err:
+        tei_logger.log('WARNING', f'The TEI schema ({tei_schema}) can not be stored in {cache_dir} ({err})!')
+    return tei_schema_bytes, tei_schema
+
+
+def relaxng_validator(tei_schema, tei_logger):
+    """Read the RelaxNG schema (see read_tei_schema) and compile it only once in each process
+        (the compiled validators are kept by the hash of the content of the schemas).
+       The full TEI schema (tei_all) is the default, a reduced schema for the elements of the project
+        (e.g. compiled by Roma from an ODD customisation) is faster to compile and to validate with
+    """
+    tei_schema_bytes, base_url = read_tei_schema(tei_schema, tei_logger)
+    schema_hash = sha256(tei_schema_bytes).hexdigest()
+    validator = RELAXNG_VALIDATORS.get(schema_hash)
+    if validator is None:
+        try:
+            relaxng_doc = etree.fromstring(tei_schema_bytes, base_url=base_url)
+            # LXML FAQ: You can share RelaxNG, XMLSchema and (with restrictions) XSLT objects between threads.
+            validator = etree.RelaxNG(relaxng_doc)
+        except (etree.XMLSyntaxError, etree.RelaxNGParseError) as err:
+            tei_logger.log('CRITICAL', f'The TEI schema ({tei_schema}) is not a valid RelaxNG schema ({err})!')
+            exit(1)
+        RELAXNG_VALIDATORS[schema_hash] = validator
+    tei_logger.log('INFO', f'Using the TEI schema {tei_schema} (SHA-256: {schema_hash})')
+    return validator
+
+
+def validate_and_hash_tei(raw_xml_str, tei_check_params, tei_logger, xml_etree=None):
+    """Validate the TEI XML, compute its hashsums and compress it where it is created (e.g. in the worker processes),
+        so the output writer only has to write it (see ValidatorHasherCompressor.process_one_file).
+       tei_check_params is the (tei_schema, hash_algos, compression, compresslevel) tuple of the output writer
+        (see tei_check_params)
+       xml_etree is the lxml tree which was serialized to raw_xml_str (e.g. by TeiTemplate.write_with_tree),
+        if it is None raw_xml_str is parsed for the validation
+       Return the verdict: the validation error (None if the XML is valid), the hashsums and the compressed zipfile
+        member (see compress_member) (None if the XML is not valid or it is stored without compression)
+        or None if the XML is not well-formed (the output writer handles it the same way as before)
+    """
+    checker = TEI_CHECKERS.get(tei_check_params)
+    if checker is None:
+        tei_schema, hash_algos, _, _ = tei_check_params
+        checker = (relaxng_validator(tei_schema, tei_logger), MtHasher(hash_algos))
+        TEI_CHECKERS[tei_check_params] = checker
+    validator, hasher = checker
+    _, _, compression, compresslevel = tei_check_params
+
+    if xml_etree is None:
+        try:
+            xml_etree = etree.fromstring(raw_xml_str)
+        except etree.XMLSyntaxError:
+            return None
+    try:
+        validator.assert_(xml_etree)
+    except AssertionError as err:
+        return str(err), None, None
+    return None, hasher.hash_file(BytesIO(raw_xml_str)), compress_member(raw_xml_str, compression, compresslevel)
+
+
 def slugify(value, allow_unicode=True):
     """
     Original source:
@@ -76,6 +203,24 @@ def init_directory(bad_urls_dir, tei_logger):
     return bad_urls_dir
 
 
+def keep_complete_lines(filename, keep_line=None):
+    """Keep the complete lines of a file written by an interrupted run (the last line may be incomplete)
+        for which keep_line(line) is True (default: all) to be able to continue writing the file.
+        The file is replaced at once (a run killed meanwhile finds the original file). Return the lines kept
+    """
+    if not os_path_isfile(filename):
+        return []
+    with open(filename, 'rb') as fh:
+        *lines, _ = fh.read().split(b'\n')  # The incomplete last line may end inside a character
+    lines = [line.decode('UTF-8') for line in lines]
+    if keep_line is not None:
+        lines = [line for line in lines if keep_line(line)]
+    with open(f'{filename}.tmp', 'w', encoding='UTF-8') as fh:
+        fh.writelines(f'{line}\n' for line in lines)
+    os_replace(f'{filename}.tmp', filename)
+    return lines
+
+
 def check_for_filename_collision(url, desired_filename, filename_suff, assigned_filenames, tei_logger):
     """This  function ensures no output files will be overwritten during processing
         Check if the filename already assigned or not. If it is, then it will try to generate a new name
@@ -98,19 +243,34 @@ class StoreFilesWithReadableName:
     """Store output files in bad_urls_dir directory for later examination
         (no zipping, no validation, filenames are slugified urls)
     """
-    def __init__(self, tei_logger, bad_urls_dir, zipfile_name=None, hashsums_filename=None, hash_algos=None,
-                 tei_schema=None):
+    def __init__(self, tei_logger, bad_urls_dir, output_filename=None, hashsums_filename=None, hash_algos=None,
+                 tei_schema=None, resume=False, output_sink=None, sink_params=None):
         # To be a drop-in replacement
-        _ = zipfile_name, hashsums_filename, hash_algos, tei_schema
+        _ = output_filename, hashsums_filename, hash_algos, tei_schema, output_sink, sink_params
 
         # Init directory
         self._bad_urls_dir = init_directory(bad_urls_dir, tei_logger)
 
         self._tei_logger = tei_logger
         self._assigned_filenames = set()
+        if resume:
+            # Do not overwrite the files of the previous run
+            self._assigned_filenames.update(listdir(self._bad_urls_dir))
+
+        # Nothing to validate or hash before writing (see validate_and_hash_tei)
+        self.tei_check_params = None
+
+    def is_stored(self, xml_filename):
+        """Check if the file is in the output (e.g. to resume an interrupted run)"""
+        return os_path_exists(os_path_join(self._bad_urls_dir, xml_filename))
 
-    def process_one_file(self, url, desired_filename, filename_suff, raw_xml_str):
-        _ = desired_filename  # This contains the UUID
+    def close(self):
+        """Nothing to close (to be a drop-in replacement)"""
+        pass
+
+    def process_one_file(self, url, desired_filename, filename_suff, raw_xml_str, tei_verdict=None, publish_date=None,
+                         warc_date=None):
+        _ = desired_filename, tei_verdict, publish_date, warc_date  # This contains the UUID, no validation
         if url.endswith('/'):
             url = url[:-1]
         # The last segment (249 characters) of the URL something.html or .../something/ (trailing slash omitted)
@@ -126,57 +286,110 @@ class StoreFilesWithReadableName:
 
 class ValidatorHasherCompressor:
     """Validate output TEI XML files, zip the valid ones and compute their hashsums, invalid XMLs go
-        to bad_urls_dir directory with UUID filenames"""
-    def __init__(self, tei_logger, bad_urls_dir, zipfile_name, hashsums_filename, hash_algos=ALGORITHMS_GUARANTEED,
-                 tei_schema='https://tei-c.org/release/xml/tei/custom/schema/relaxng/tei_all.rng'):
-        # Init Zipfile
-        self._zipfile = ZipFile(zipfile_name, 'w')
+        to bad_urls_dir directory with UUID filenames.
+       The valid XMLs go into the output sink (see OUTPUT_SINKS, default: zip) as output_filename with the extension
+        of the sink, which is split into shards (e.g. NAME.zip, NAME_1.zip, ...) when the current one reaches
+        max_shard_bytes or max_shard_members or it is open for max_shard_seconds of sink_params (default: no limit).
+        The zipfile members are compressed with the compression of sink_params (default: stored without compression)
+       When resuming an interrupted run the existing shards are never modified, the valid XMLs go
+        into a new shard and the hashsums are appended (the hashsums of the files not in a readable shard
+        and an incomplete last line of the killed run are dropped, see keep_complete_lines)"""
+    def __init__(self, tei_logger, bad_urls_dir, output_filename, hashsums_filename, hash_algos=ALGORITHMS_GUARANTEED,
+                 tei_schema=DEFAULT_TEI_SCHEMA, resume=False, output_sink='zip', sink_params=None):
+        # Setup RelaxNG validator (compiled only once in each process, before anything is written)
+        self._validator = relaxng_validator(tei_schema, tei_logger)
 
-        # Setup RelaxNG validator
-        with urlopen(tei_schema, cafile=certifi.where()) as response:
-            tei_schema_str = response.read()
-        relaxng_doc = etree.fromstring(tei_schema_str)
-        # LXML FAQ: You can share RelaxNG, XMLSchema and (with restrictions) XSLT objects between threads.
-        self._validator = etree.RelaxNG(relaxng_doc)
+        # Init output sink (the parameters are checked before anything is written)
+        output_sink_file = OUTPUT_SINKS.get(output_sink)
+        if output_sink_file is None:
+            tei_logger.log('CRITICAL', f'{output_sink} is not in the allowed value set ({set(OUTPUT_SINKS.keys())})!')
+            exit(1)
+        try:
+            output_sink_class = getattr(import_python_file(*output_sink_file), 'OutputSink')
+        except ModuleNotFoundError as err:
+            tei_logger.log('CRITICAL', f'The {output_sink} output sink needs the {err.name} package!')
+            exit(1)
+        if sink_params is None:
+            sink_params = {}
+        self._sink = output_sink_class(tei_logger, f'{output_filename}{output_sink_class.EXTENSION}', resume,
+                                       **sink_params)
+        self._stored_filenames = self._sink.stored_filenames
+        hashsums_mode = 'a' if resume else 'w'
 
         # Init Hasher
         self._hasher = MtHasher(hash_algos)
 
-        # Init hashsums file
-        self._hashsums_fh = open(hashsums_filename, 'w', encoding='UTF-8')
-        print(*self._hasher.header, sep='\t', file=self._hashsums_fh)
+        # The TEI XMLs can be validated, hashed and compressed before they are passed to process_one_file
+        #  (e.g. in the worker processes, see validate_and_hash_tei), the validator is already compiled and cached
+        self.tei_check_params = (tei_schema, tuple(hash_algos), self._sink.compression, self._sink.compresslevel)
 
         # Init directory
         self._bad_urls_dir = init_directory(bad_urls_dir, tei_logger)
+        if resume:
+            # The hashsums of the files of a previous run which are not stored (e.g. in an incomplete shard)
+            #  are dropped as they will be processed again (the hashsums file contains the basenames only
+            #  and the header)
+            stored_basenames = {os_path_basename(xml_filename) for xml_filename in self._stored_filenames}
+            stored_basenames.add(self._hasher.header[0])
+            keep_complete_lines(hashsums_filename, lambda line: line.split('\t', maxsplit=1)[0] in stored_basenames)
+            self._stored_filenames.update(listdir(self._bad_urls_dir))
+
+        # Init hashsums file
+        self._hashsums_fh = open(hashsums_filename, hashsums_mode, encoding='UTF-8')
+        if self._hashsums_fh.tell() == 0:  # Not resumed or the previous run had not got this far
+            print(*self._hasher.header, sep='\t', file=self._hashsums_fh)
 
         self._tei_logger = tei_logger
         self._assigned_filenames = set()
 
     def __del__(self):
         # Else essential records will not be written!
-        zipfile = getattr(self, '_zipfile', None)
-        if zipfile is not None:
-            close = getattr(zipfile, 'close', None)
-            if close is not None:
-                close()
+        self.close()
+
+    def close(self):
+        """Write the buffered records of the sink and close it and the hashsums file"""
+        sink = getattr(self, '_sink', None)
+        if sink is not None:
+            sink.close()
+        hashsums_fh = getattr(self, '_hashsums_fh', None)
+        if hashsums_fh is not None:
+            hashsums_fh.close()
 
-    def process_one_file(self, url, desired_filename, filename_suff, raw_xml_str):
+    def is_stored(self, xml_filename):
+        """Check if the file is in a readable shard of the zipfile or among the invalid files
+            (e.g. to resume an interrupted run)
+        """
+        return xml_filename in self._stored_filenames or os_path_basename(xml_filename) in self._stored_filenames
+
+    def process_one_file(self, url, desired_filename, filename_suff, raw_xml_str, tei_verdict=None, publish_date=None,
+                         warc_date=None):
+        """Write the valid XML into the sink and write its hashsums or write the invalid XML into bad_urls_dir.
+            tei_verdict is the result of validate_and_hash_tei if the XML is already validated, hashed and
+             compressed (e.g. in the worker process), else it is done here.
+            The publication and WARC dates (datetime or None) are stored along with the URL and the TEI PID by the sinks
+             with metadata (e.g. jsonl)
+        """
+        if tei_verdict is None:
+            xml_etree = etree.fromstring(raw_xml_str)
+            try:
+                self._validator.assert_(xml_etree)
+                tei_verdict = None, self._hasher.hash_file(BytesIO(raw_xml_str)), None  # Compressed by writestr
+            except AssertionError as err:
+                tei_verdict = str(err), None, None
+        validation_error, digests, compressed_member = tei_verdict
 
-        xml_etree = etree.fromstring(raw_xml_str)
         xml_filename = check_for_filename_collision(url, desired_filename, filename_suff, self._assigned_filenames,
                                                     self._tei_logger)
         out_filename = os_path_basename(xml_filename)
-        try:
-            self._validator.assert_(xml_etree)
-            valid = True
-        except AssertionError as err:
-            self._tei_logger.log('ERROR', 'TEI validation error:', url, out_filename, err)
-            valid = False
-        if valid:
-            digests = self._hasher.hash_file(BytesIO(raw_xml_str))
-            self._zipfile.writestr(xml_filename, raw_xml_str)
-            print(out_filename, url, *digests, sep='\t', file=self._hashsums_fh)
+        if validation_error is None:
+            metadata = {'url': url, 'tei_pid': os_path_basename(desired_filename),
+                        'date_published': publish_date.isoformat() if publish_date is not None else None,
+                        'warc_date': warc_date.isoformat() if warc_date is not None else None}
+            self._sink.write(xml_filename, raw_xml_str, metadata, compressed_member)
+            # Written out immediately as the journal of the files in the closed shards of a killed run
+            print(out_filename, url, *digests, sep='\t', file=self._hashsums_fh, flush=True)
         else:
+            self._tei_logger.log('ERROR', 'TEI validation error:', url, out_filename, validation_error)
             with open(os_path_join(self._bad_urls_dir, out_filename), 'wb') as fh:
                 fh.write(raw_xml_str)
 
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import sys
+from random import Random
+from pathlib import Path
+
+import pytest
+
+# The benchmark scripts are not part of the package, but some tests use their functions
+sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+
+
+@pytest.fixture
+def rnd(request):
+    """Random numbers seeded by the name of the test (with its parameters) to get the same cases on every run"""
+    return Random(request.node.name)
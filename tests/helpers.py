@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""The helpers shared by the tests: a logger, random HTML, the portal configs and the input - gold file pairs"""
+
+import json
+from pathlib import Path
+
+from html2tei.workflow_helpers.read_config import get_portal_spec_fun_and_dict_names, load_portal_specific_dicts
+
+TESTS_DIR = Path(__file__).parent
+CONFIGS_DIR = TESTS_DIR.parent / 'configs'
+INPUT_DIR = TESTS_DIR / 'input'
+GOLD_DIR = TESTS_DIR / 'gold'
+WORDS = ('alma', 'korte', 'szilva', ' ', '\n')
+# A RelaxNG schema which accepts any XML (e.g. to run the cleaner offline)
+ANY_ELEMENT_RNG = b'<grammar xmlns="http://relaxng.org/ns/structure/1.0"><start><ref name="any"/></start>' \
+                  b'<define name="any"><element><anyName/><zeroOrMore><choice><attribute><anyName/></attribute>' \
+                  b'<text/><ref name="any"/></choice></zeroOrMore></element></define></grammar>'
+
+
+class DummyLogger:
+    """Collect the messages instead of writing them out"""
+    def __init__(self):
+        self.messages = []
+
+    def log(self, level, *message):
+        self.messages.append((level, *message))
+
+
+def random_html(rnd, choose_tag, depth, words=WORDS, num_of_contents=(1, 4), parent_name=None):
+    """Random HTML at most depth deep: the texts are chosen from words, the tags by choose_tag(rnd, parent_name),
+        which returns the name of the tag or a (name, attributes) pair.
+       num_of_contents is the (min, max) number of contents of each tag or a function of (rnd, depth) which returns it
+    """
+    contents = []
+    min_num, max_num = num_of_contents(rnd, depth) if callable(num_of_contents) else num_of_contents
+    for _ in range(rnd.randint(min_num, max_num)):
+        if depth == 0 or rnd.random() < 0.3:
+            contents.append(rnd.choice(words))
+        else:
+            tag_name = choose_tag(rnd, parent_name)
+            tag_name, attrs = (tag_name, '') if isinstance(tag_name, str) else tag_name
+            inner_html = random_html(rnd, choose_tag, depth - 1, words, num_of_contents, tag_name)
+            contents.append(f'<{tag_name}{attrs}>{inner_html}</{tag_name}>')
+    return ''.join(contents)
+
+
+def choice_of(tags):
+    """A choose_tag function for random_html with uniform choice from the tags"""
+    tags = tuple(tags)
+    return lambda rnd, _: rnd.choice(tags)
+
+
+def portal_dicts(portal_name, block_rules_spec=None):
+    """The tag table and the block rules of the portal"""
+    portal_dir = CONFIGS_DIR / portal_name
+    return load_portal_specific_dicts(portal_dir / f'{portal_name}_text_tags_normal.tsv',
+                                      portal_dir / f'{portal_name}_notext_tags_normal.tsv',
+                                      block_rules_spec if block_rules_spec is not None else {}, DummyLogger())
+
+
+def portal_spec_params(portal_name):
+    """The spec_params of article_body_converter and the (name, attributes) of the article root of the portal"""
+    (_, _, _, _, article_root_params, decompose_spec, excluded_tags_spec, portal_url_prefix, link_filter_spec, links,
+     block_rules_spec, bigram_rules_spec, _, _) = get_portal_spec_fun_and_dict_names(
+        CONFIGS_DIR / portal_name / f'{portal_name}_specific.py', DummyLogger())
+    tag_normal_dict, block_rules = portal_dicts(portal_name, block_rules_spec)
+    (root_args, root_kwargs), *_ = article_root_params
+    root_attrs = root_kwargs.get('attrs', root_kwargs)
+    root_attrs = ''.join(f' {k}="{v}"' for k, v in root_attrs.items() if isinstance(v, str))
+    return (article_root_params, decompose_spec, excluded_tags_spec, tag_normal_dict, links, block_rules,
+            bigram_rules_spec, portal_url_prefix, link_filter_spec), (root_args[0], root_attrs)
+
+
+def read_json_lines(path):
+    """The JSON values of the lines of the file (e.g. the HTML inputs and the outputs of a test case per line)"""
+    with open(path, encoding='UTF-8') as fh:
+        return [json.loads(line) for line in fh]
+
+
+def input_gold_pairs(pattern, gold_suffix=None):
+    """The input files matching the pattern in tests/input/ along with their gold files in tests/gold/
+        (with the same name or with gold_suffix, see tests/README.md)
+    """
+    pairs = []
+    for input_path in sorted(INPUT_DIR.glob(pattern)):
+        gold_path = GOLD_DIR / input_path.name
+        if gold_suffix is not None:
+            gold_path = gold_path.with_suffix(gold_suffix)
+        pairs.append((input_path, gold_path))
+    return pairs
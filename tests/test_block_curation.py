@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import pytest
+from bs4 import BeautifulSoup
+
+from html2tei.tei_utils import PendingMutations
+from html2tei.article_body_converters.eltedh_abc import block_specific_curation_of_internal_structure
+
+from helpers import DummyLogger, portal_dicts, read_json_lines, input_gold_pairs
+
+
+@pytest.mark.parametrize('input_path, gold_path', input_gold_pairs('block_curation_*.jsonl'))
+def test_block_specific_curation_gold(input_path, gold_path):
+    # The inputs are random nestings of blocks (often with the same text as their parent)
+    #  and the gold is the output of the original implementation (which compared the texts)
+    portal_name = input_path.stem[len('block_curation_'):]
+    _, block_dict = portal_dicts(portal_name)
+    for index, (html, gold) in enumerate(zip(read_json_lines(input_path), read_json_lines(gold_path))):
+        article = BeautifulSoup(f'<article_body_root>{html}</article_body_root>', 'lxml').find('article_body_root')
+        pending = PendingMutations()
+        block_specific_curation_of_internal_structure(article, block_dict, pending, 'https://example.hu',
+                                                      DummyLogger())
+        pending.sync()
+        assert str(article) == gold, f'ERROR: file: {input_path}; line: {index}'
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import pytest
+from bs4 import BeautifulSoup
+
+from html2tei.article_body_converters import eltedh_abc, eltedh_lxml_abc
+
+from helpers import DummyLogger, random_html, choice_of, portal_spec_params
+
+PORTALS = ('p444', 'vs', 'nnk', 'valasz', 'magyaridok', 'telex_koronavirus')
+HTML_TAGS = ('p', 'div', 'span', 'strong', 'b', 'em', 'i', 'u', 'sup', 'sub', 'blockquote', 'h2', 'h3', 'ul', 'ol',
+             'li', 'table', 'tr', 'td', 'th', 'figure', 'figcaption')
+
+
+def converted_pair(portal_name, html):
+    spec_params, (root_name, root_attrs) = portal_spec_params(portal_name)
+    page = f'<html><body><{root_name}{root_attrs}>{html}</{root_name}></body></html>'
+    outputs = []
+    for module in (eltedh_abc, eltedh_lxml_abc):
+        body_contents = module.article_body_converter(DummyLogger(), 'https://example.hu/1',
+                                                      BeautifulSoup(page, 'lxml'), spec_params)
+        if body_contents is None or body_contents == 'EMPTY ARTICLE':
+            outputs.append(body_contents)
+        else:
+            # Written as in tei_writer: prettify() shows the separate strings as well
+            body = BeautifulSoup('<body/>', features='lxml-xml').body
+            body.extend(body_contents)
+            outputs.append(body.prettify())
+    return outputs
+
+
+@pytest.mark.parametrize('html', [
+    '<p>alma <strong>korte</strong></p> szilva <em>alma</em><p><p>korte</p></p>',  # Naked text, double level
+    '<ul><li>alma</li> korte <li><p>szilva</p></li> <p>alma</p> </ul>',  # Texts and paragraphs directly in lists
+    '<table><tr><td>alma</td> <td>korte</td></tr> <p>szilva</p></table><td>alma</td>',  # Irregular tables
+    '<blockquote><h2>alma</h2> korte <blockquote>korte</blockquote></blockquote>',  # Blocks in blocks
+    '<figure><img src="https://example.hu/a.jpg"/><figcaption>alma</figcaption></figure>',  # Media
+    '<div>alma</div><blockquote>korte</blockquote><ul> <li>alma</li> \n <li>korte</li> </ul>',  # Separate strings
+])
+def test_eltedh_lxml_examples(html):
+    reference, new = converted_pair('p444', html)
+    assert reference == new
+
+
+def test_eltedh_lxml_counts_the_script_and_style_texts():
+    # The known difference: the strings of script and style tags which are not decomposed by the portal-specific
+    #  config are not counted in the texts by the eltedh engine (BeautifulSoup), but they are counted by eltedh-lxml
+    reference, new = converted_pair('vs', '<style>alma<span>korte</span></style>')
+    assert reference == 'EMPTY ARTICLE'
+    assert new == '<body>\n <p>\n  alma&lt;span&gt;korte&lt;/span&gt;\n </p>\n</body>'
+
+
+@pytest.mark.parametrize('portal_name', PORTALS)
+def test_eltedh_lxml_is_equivalent(rnd, portal_name):
+    for _ in range(30):
+        reference, new = converted_pair(portal_name, random_html(rnd, choice_of(HTML_TAGS), rnd.randint(2, 6)))
+        assert reference == new
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import pytest
+from bs4 import BeautifulSoup
+
+from html2tei.article_body_converters import eltedh_abc, eltedh_lxml_abc
+
+from helpers import DummyLogger, portal_spec_params, input_gold_pairs
+
+
+@pytest.mark.parametrize('module', (eltedh_abc, eltedh_lxml_abc), ids=('eltedh', 'eltedh-lxml'))
+@pytest.mark.parametrize('input_path, gold_path', input_gold_pairs('*.html', '.xml'))
+def test_gold_articles(module, input_path, gold_path):
+    # The articles (named <portal>_<number>.html) are written with the markup of the portals
+    #  and the gold is the article body written as in tei_writer
+    spec_params, _ = portal_spec_params(input_path.stem.rsplit('_', 1)[0])
+    raw_html = input_path.read_text(encoding='UTF-8')
+    url = BeautifulSoup(raw_html, 'lxml').find('link', rel='canonical')['href']
+    meta, body_contents = module.process_article((url, None, None, raw_html), DummyLogger(), lambda *_: {},
+                                                 spec_params)
+    body = BeautifulSoup('<body/>', features='lxml-xml').body
+    body.extend(body_contents)
+    assert body.prettify() == gold_path.read_text(encoding='UTF-8')
+
+
+@pytest.mark.parametrize('module', (eltedh_abc, eltedh_lxml_abc), ids=('eltedh', 'eltedh-lxml'))
+def test_line_breaks_are_replaced_in_the_article_body(module):
+    # get_meta reads the page as it is, only the <br> tags of the article body are replaced with spaces
+    spec_params, _ = portal_spec_params('p444')
+    raw_html = '<html><body><main id="content-main"><p>alma<br>korte<BR/>szilva</p></main></body></html>'
+    meta_texts = []
+    meta, body_contents = module.process_article(('https://444.hu/1', None, None, raw_html), DummyLogger(),
+                                                 lambda _, __, bs: meta_texts.append(bs.main.text) or {},
+                                                 spec_params)
+    assert meta_texts == ['almakorteszilva']
+    assert [str(tag) for tag in body_contents] == ['<p>alma korte szilva</p>']
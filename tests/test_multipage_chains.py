@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import re
+
+from html2tei.workflow_helpers import processing_utils
+from html2tei.workflow_helpers.processing_utils import load_or_create_multipage_chain_index
+from html2tei.workflow_helpers.read_config import get_portal_spec_fun_and_dict_names
+
+from helpers import CONFIGS_DIR, DummyLogger
+
+CHAINS = {'https://444.hu/2021/01/01/alma': ['https://444.hu/2021/01/01/alma', 'https://444.hu/2021/01/01/alma?page=2']}
+
+
+def test_persisted_multipage_chains_are_keyed_on_the_config_and_the_warc(tmp_path, monkeypatch):
+    created = []
+
+    def create_multipage_chain_index(*params):
+        created.append(params)
+        return CHAINS
+
+    monkeypatch.setattr(processing_utils, 'create_multipage_chain_index', create_multipage_chain_index)
+    blacklist, multipage_compile, next_page_of_article_fun, *_, transform_to_html_fun, _ = \
+        get_portal_spec_fun_and_dict_names(CONFIGS_DIR / 'p444' / 'p444_specific.py', DummyLogger())
+    warc_filename = tmp_path / 'p444.warc.gz'
+    warc_filename.write_bytes(b'WARC')
+    chains_filename = tmp_path / 'p444.warc.gz.multipage_chains.json'
+
+    def load(blacklist=blacklist, multipage_compile=multipage_compile):
+        multipage_chains = {}
+        load_or_create_multipage_chain_index((str(warc_filename), blacklist, multipage_compile, DummyLogger(), {},
+                                              next_page_of_article_fun, transform_to_html_fun, multipage_chains,
+                                              set()), persist=True)
+        assert multipage_chains == CHAINS
+        return len(created)
+
+    assert load() == 1
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith('.part')] == []
+    assert load() == 1  # Reused
+    assert load(blacklist=[*blacklist, 'https://444.hu/2021/01/02/korte']) == 2
+    assert load(multipage_compile=re.compile(r'.*\?oldal=.*')) == 3
+    assert load() == 4  # The last one was written by the changed config
+    assert load() == 4
+
+    warc_stat = warc_filename.stat()
+    os.utime(warc_filename, ns=(warc_stat.st_atime_ns, warc_stat.st_mtime_ns + 10**9))
+    assert load() == 5
+
+    # An incomplete file (e.g. from a killed run) is created again
+    chains_filename.write_bytes(chains_filename.read_bytes()[:-10])
+    assert load() == 6
+    assert load() == 6
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import json
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import pytest
+
+from html2tei.output_sinks import zip_sink
+from html2tei.output_sinks.zip_sink import compress_member
+from html2tei.workflow_helpers.read_config import import_python_file
+from html2tei.workflow_helpers.validate_hash_zip import OUTPUT_SINKS
+
+from helpers import DummyLogger
+
+RECORDS = [(f'2020-01-0{i}/{i}.xml', f'<TEI>alma {i} körte</TEI>'.encode('UTF-8'),
+            {'url': f'https://example.hu/{i}', 'tei_pid': str(i), 'date_published': None if i == 2 else f'2020-01-0{i}',
+             'warc_date': '2021-01-01T00:00:00'}) for i in range(1, 6)]
+
+
+def output_sink_class(output_sink):
+    if output_sink == 'tar.zst':
+        pytest.importorskip('zstandard')
+    elif output_sink == 'parquet':
+        pytest.importorskip('pyarrow')
+    return getattr(import_python_file(*OUTPUT_SINKS[output_sink]), 'OutputSink')
+
+
+@pytest.mark.parametrize('output_sink', OUTPUT_SINKS.keys())
+def test_output_sinks_shards_and_resume(tmp_path, output_sink):
+    sink_class = output_sink_class(output_sink)
+    filename = str(tmp_path / f'portal{sink_class.EXTENSION}')
+    sink = sink_class(DummyLogger(), filename, max_shard_members=2)
+    for xml_filename, raw_xml_str, metadata in RECORDS[:3]:
+        sink.write(xml_filename, raw_xml_str, metadata)
+    sink.close()
+    shards = sorted(p.name for p in tmp_path.iterdir())
+    assert len(shards) == 2  # 2 + 1 members
+    assert sink_class.read_member_names(filename) == [RECORDS[0][0], RECORDS[1][0]]
+
+    # The existing shards are kept, the new records go into a new shard
+    sink = sink_class(DummyLogger(), filename, resume=True)
+    assert sink.stored_filenames == {xml_filename for xml_filename, _, _ in RECORDS[:3]}
+    for xml_filename, raw_xml_str, metadata in RECORDS[3:]:
+        sink.write(xml_filename, raw_xml_str, metadata)
+    sink.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(shards + [f'portal_2{sink_class.EXTENSION}'])
+    resumed_sink = sink_class(DummyLogger(), filename, resume=True)
+    assert resumed_sink.stored_filenames == {xml_filename for xml_filename, _, _ in RECORDS}
+    resumed_sink.close()
+
+
+def test_jsonl_sink_buffers_records(tmp_path):
+    sink_class = output_sink_class('jsonl')
+    filename = tmp_path / 'portal.jsonl'
+    sink = sink_class(DummyLogger(), str(filename))
+    for xml_filename, raw_xml_str, metadata in RECORDS:
+        sink.write(xml_filename, raw_xml_str, metadata)
+    assert filename.read_bytes() == b''  # Buffered until the end
+    sink.close()
+    assert [json.loads(line) for line in filename.read_text(encoding='UTF-8').splitlines()] == \
+        [{'filename': xml_filename, **metadata, 'tei': raw_xml_str.decode('UTF-8')}
+         for xml_filename, raw_xml_str, metadata in RECORDS]
+
+    # An incomplete last line (e.g. a killed run) makes the shard incomplete
+    with open(filename, 'ab') as fh:
+        fh.write(b'{"filename": "2020-01-06/6.xml", "ur')
+    with pytest.raises(sink_class.INCOMPLETE_SHARD_ERRORS):
+        sink_class.read_member_names(str(filename))
+
+
+@pytest.mark.parametrize('output_sink', OUTPUT_SINKS.keys())
+def test_incomplete_shard_is_moved_aside(tmp_path, output_sink):
+    sink_class = output_sink_class(output_sink)
+    filename = str(tmp_path / f'portal{sink_class.EXTENSION}')
+    sink = sink_class(DummyLogger(), filename, max_shard_seconds=0)  # A checkpoint after each record
+    for xml_filename, raw_xml_str, metadata in RECORDS[:3]:
+        sink.write(xml_filename, raw_xml_str, metadata)
+    sink.close()
+    shards = sorted(tmp_path.iterdir())
+    assert len(shards) == 3
+    last_shard = tmp_path / f'portal_2{sink_class.EXTENSION}'
+    last_shard.write_bytes(last_shard.read_bytes()[:-20])  # E.g. killed while writing it
+
+    logger = DummyLogger()
+    sink = sink_class(logger, filename, resume=True)
+    assert sink.stored_filenames == {xml_filename for xml_filename, _, _ in RECORDS[:2]}
+    assert logger.messages[0][0] == 'WARNING'
+    sink.write(*RECORDS[2])
+    sink.close()
+    # The name of the incomplete shard is not reused
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+        sorted([shards[0].name, shards[1].name, f'{last_shard.name}.broken', f'portal_3{sink_class.EXTENSION}'])
+    assert sink_class.read_member_names(str(tmp_path / f'portal_3{sink_class.EXTENSION}')) == [RECORDS[2][0]]
+
+
+@pytest.mark.parametrize('zipfile_internals', (True, False))
+def test_zip_sink_writes_compressed_members(tmp_path, monkeypatch, zipfile_internals):
+    if not zipfile_internals:  # E.g. a later version of the zipfile module: the members are written by writestr
+        monkeypatch.setattr(zip_sink, 'ZIPFILE_INTERNALS', zip_sink.ZIPFILE_INTERNALS + ('_missing_attribute',))
+    sink_class = output_sink_class('zip')
+    filename = tmp_path / 'portal.zip'
+    sink = sink_class(DummyLogger(), str(filename), compression='deflate')
+    for i, (xml_filename, raw_xml_str, metadata) in enumerate(RECORDS):
+        # Compressed in advance (e.g. in the workers) or by the zipfile
+        sink.write(xml_filename, raw_xml_str, metadata,
+                   compress_member(raw_xml_str, ZIP_DEFLATED) if i % 2 == 0 else None)
+    sink.close()
+    with ZipFile(filename) as zf:
+        assert zf.testzip() is None
+        assert [(info.filename, info.compress_type, zf.read(info)) for info in zf.infolist()] == \
+            [(xml_filename, ZIP_DEFLATED, raw_xml_str) for xml_filename, raw_xml_str, _ in RECORDS]
+
+
+def test_compress_member_without_the_private_compressor(monkeypatch):
+    assert compress_member(b'alma', ZIP_DEFLATED) is not None
+    monkeypatch.setattr(zip_sink, 'zipfile_get_compressor', None)
+    assert compress_member(b'alma', ZIP_DEFLATED) is None  # Compressed by ZipFile.writestr in the output writer
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import sys
+import time
+import signal
+import subprocess
+
+from synthetic_warc import generate_synthetic_warc
+from html2tei.output_sinks.zip_sink import OutputSink
+
+from helpers import ANY_ELEMENT_RNG, CONFIGS_DIR
+
+
+def cleaner_cmd(work_dir, *extra_args):
+    return [sys.executable, '-m', 'html2tei', 'cleaner', '-i', str(work_dir / 'input.yaml'), '-c', str(CONFIGS_DIR),
+            '-l', str(work_dir / 'log'), '-w', str(work_dir / 'warc'), '-o', str(work_dir / 'out'), '-L', 'WARNING',
+            '--tei-schema', str(work_dir / 'any.rng'), '--max-shard-members', '10', *extra_args]
+
+
+def read_lines(path):
+    with open(path, encoding='UTF-8') as fh:
+        return fh.read().splitlines()
+
+
+def test_killed_run_is_resumed(tmp_path):
+    (tmp_path / 'warc').mkdir()
+    (tmp_path / 'log').mkdir()
+    (tmp_path / 'out').mkdir()
+    stats = generate_synthetic_warc(tmp_path / 'warc' / 'p444_synthetic.warc.gz', portal_url_prefix='https://444.hu',
+                                    article_root=('main', {'id': 'content-main'}), num_of_articles=120,
+                                    mean_page_kb=10, seed=42)
+    (tmp_path / 'input.yaml').write_text('p444_synthetic.warc.gz: p444\n', encoding='UTF-8')
+    (tmp_path / 'any.rng').write_bytes(ANY_ELEMENT_RNG)
+
+    # Kill the run (and its workers) when two shards are already closed
+    proc = subprocess.Popen(cleaner_cmd(tmp_path), start_new_session=True, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while not (tmp_path / 'out' / 'p444_2.zip').exists():
+        assert proc.poll() is None, 'The run finished before it could be killed'
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    os.killpg(proc.pid, signal.SIGKILL)
+    assert proc.wait() == -signal.SIGKILL
+
+    subprocess.run(cleaner_cmd(tmp_path, '--resume'), check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+
+    # The shard written when the run was killed is moved aside and its articles are processed again
+    out_dir = tmp_path / 'out'
+    assert len(list(out_dir.glob('p444*.zip.broken'))) == 1
+    member_names = []
+    for shard in sorted(out_dir.glob('p444*.zip')):
+        member_names.extend(OutputSink.read_member_names(str(shard)))
+    assert len(member_names) == len(set(member_names))
+
+    # Every article is done exactly once and the logs and the hashsums list exactly the stored files
+    url_lines = [line.rsplit(' ', maxsplit=1) for line in read_lines(tmp_path / 'log' / 'p444_urls.txt')]
+    bad_urls = read_lines(tmp_path / 'log' / 'p444_bad_urls.txt')
+    urls = [url for url, _ in url_lines] + bad_urls
+    assert len(urls) == len(set(urls)) == stats['articles']
+    assert sorted(filename for _, filename in url_lines) == sorted(member_names)
+    header, *hashsums = read_lines(out_dir / 'p444.hashsums')
+    assert header.startswith('filename\t')
+    assert sorted(line.split('\t', maxsplit=1)[0] for line in hashsums) == \
+        sorted(os.path.basename(member_name) for member_name in member_names)
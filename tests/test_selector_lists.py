@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import pytest
+from bs4 import BeautifulSoup
+
+from html2tei.tei_utils import decomposing, mark_media_descendants, \
+    decompose_listed_subtrees_and_mark_media_descendants
+from html2tei.workflow_helpers.read_config import import_python_file
+
+from helpers import CONFIGS_DIR, random_html, choice_of
+
+PORTALS = sorted(p.name for p in CONFIGS_DIR.iterdir() if (p / f'{p.name}_specific.py').is_file())
+PLAIN_TAGS = (('div', ''), ('p', ''), ('span', ' class="egyeb"'), ('figure', ''), ('iframe', ''))
+WORDS = ('alma', 'korte', ' ', '\n')
+
+
+def selector_tags(selectors):
+    """Tags (name, attributes) matching the selectors, sometimes with extra class values or without the attributes"""
+    tags = []
+    for args, kwargs in selectors:
+        attrs = []
+        for attr, value in kwargs.items():
+            attr = 'class' if attr == 'class_' else attr
+            value = value[0] if isinstance(value, list) else value
+            attrs.append((attr, attr if value is True else value))
+        tags.append((args[0], ''.join(f' {k}="{v}"' for k, v in attrs)))
+        tags.append((args[0], ''.join(f' {k}="egyeb {v}"' for k, v in attrs)))
+        tags.append((args[0], ''))
+    return tags
+
+
+@pytest.mark.parametrize('html', [
+    '<div class="a b"><p class="a b c">x</p><p class="b a">y</p></div><span class="">z</span>',  # Class rules
+    '<figure><figure><iframe>x</iframe></figure><p>y</p></figure><iframe><p class="a">z</p></iframe>',  # Nesting
+])
+def test_selector_lists_examples(html):
+    decomp = [(('p',), {'class': 'a b'}), (('span',), {'class_': ''}), (('p',), {'class': ['c', 'a']})]
+    media_list = [(('figure',), {}), (('iframe',), {}), (('div',), {'class': True})]
+    articles = []
+    for compiled in (False, True):
+        article = BeautifulSoup(f'<article_body_root>{html}</article_body_root>', 'lxml').find('article_body_root')
+        if compiled:
+            decompose_listed_subtrees_and_mark_media_descendants(article, decomp, media_list)
+        else:
+            decomposing(article, decomp)
+            mark_media_descendants(article, media_list)
+        articles.append(str(article))
+    assert articles[0] == articles[1]
+
+
+@pytest.mark.parametrize('portal_name', PORTALS)
+def test_selector_lists_are_equivalent(rnd, portal_name):
+    portal_spec_module = import_python_file(CONFIGS_DIR / portal_name / f'{portal_name}_specific.py')
+    decomp, media_list = portal_spec_module.DECOMP, portal_spec_module.MEDIA_LIST
+    tags = selector_tags(decomp) + selector_tags(media_list) + list(PLAIN_TAGS)
+    for _ in range(50):
+        html = f'<article_body_root>{random_html(rnd, choice_of(tags), rnd.randint(2, 6), WORDS)}</article_body_root>'
+        articles = []
+        for compiled in (False, True):
+            article = BeautifulSoup(html, 'lxml').find('article_body_root')
+            if compiled:
+                decompose_listed_subtrees_and_mark_media_descendants(article, decomp, media_list)
+            else:
+                decomposing(article, decomp)
+                mark_media_descendants(article, media_list)
+            articles.append(str(article))
+        assert articles[0] == articles[1]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from random import Random
+
+import pytest
+from bs4 import BeautifulSoup
+
+from html2tei.tei_utils import imtext_children_descendants_of_tag, SubtreeSummaries
+
+from helpers import random_html, choice_of
+
+TAG_NAMES = ('bekezdes', 'felkover', 'dolt', 'lista', 'listaelem', 'doboz')
+WORDS = ('alma', 'korte', ' ', '\n', '<!-- komment -->')
+
+
+def mutate(rnd, bs, tag, summaries):
+    """Rename, unwrap, decompose or wrap the tag, or rewrap its contents (reported before as required)"""
+    summaries.changed(tag)
+    action = rnd.choice(('rename', 'unwrap', 'decompose', 'wrap', 'rewrap'))
+    if action == 'rename':
+        tag.name = rnd.choice(TAG_NAMES)
+    elif action == 'unwrap':
+        tag.unwrap()
+    elif action == 'decompose':
+        tag.decompose()
+    elif action == 'wrap':
+        tag.wrap(bs.new_tag(rnd.choice(TAG_NAMES)))
+    else:
+        wrapper = bs.new_tag(rnd.choice(TAG_NAMES))
+        wrapper.extend(list(tag.contents))
+        tag.append(wrapper)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_subtree_summaries_are_up_to_date(seed):
+    rnd = Random(seed)
+    html = random_html(rnd, choice_of(TAG_NAMES), 6, WORDS, (0, 4))
+    bs = BeautifulSoup(f'<article_body_root>{html}</article_body_root>', 'lxml')
+    article = bs.find('article_body_root')
+    summaries = SubtreeSummaries()
+    for _ in range(30):
+        tags = article.find_all()
+        for tag in [article, *tags]:
+            assert summaries[tag] == imtext_children_descendants_of_tag(tag)
+            assert summaries.descendant_count(tag, 'bekezdes') == len(tag.find_all('bekezdes'))
+        if len(tags) == 0:
+            break
+        mutate(rnd, bs, rnd.choice(tags), summaries)
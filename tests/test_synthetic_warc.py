@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from warcio.archiveiterator import ArchiveIterator
+
+from synthetic_warc import generate_synthetic_warc
+
+
+def read_responses(warc_filename):
+    with open(warc_filename, 'rb') as stream:
+        return [(rec.rec_headers.get_header('WARC-Target-URI'), rec.content_stream().read())
+                for rec in ArchiveIterator(stream) if rec.rec_type == 'response']
+
+
+def test_synthetic_warc_is_deterministic(tmp_path):
+    params = {'portal_url_prefix': 'https://444.hu', 'article_root': ('main', {'id': 'content-main'}),
+              'num_of_articles': 20, 'mean_page_kb': 2, 'multipage_ratio': 0.5, 'max_pages': 3, 'seed': 42}
+    stats = generate_synthetic_warc(tmp_path / 'a.warc.gz', **params)
+    generate_synthetic_warc(tmp_path / 'b.warc.gz', **params)
+    assert (tmp_path / 'a.warc.gz').read_bytes() == (tmp_path / 'b.warc.gz').read_bytes()
+
+    responses = read_responses(tmp_path / 'a.warc.gz')
+    assert stats['articles'] == 20
+    assert stats['pages'] == len(responses) > 20
+    assert stats['payload_bytes'] == sum(len(payload) for _, payload in responses)
+    assert all(b'<main id="content-main">' in payload for _, payload in responses)
+    assert sum(1 for url, _ in responses if '?page=' not in url) == 20
+
+    generate_synthetic_warc(tmp_path / 'c.warc.gz', **dict(params, seed=43))
+    assert (tmp_path / 'a.warc.gz').read_bytes() != (tmp_path / 'c.warc.gz').read_bytes()
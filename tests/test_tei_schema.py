@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from io import BytesIO
+from zipfile import ZipFile
+from urllib.error import URLError
+
+import pytest
+from lxml import etree
+
+from html2tei.workflow_helpers import validate_hash_zip
+from html2tei.workflow_helpers.validate_hash_zip import relaxng_validator, schema_cache_dir, validate_and_hash_tei, \
+    ValidatorHasherCompressor
+
+from helpers import ANY_ELEMENT_RNG, DummyLogger
+
+TEI_ROOT_RNG = ANY_ELEMENT_RNG.replace(b'<start><ref name="any"/></start>',
+                                       b'<start><element name="TEI"><text/></element></start>')
+SCHEMA_URL = 'https://example.org/any.rng'
+
+
+@pytest.fixture(autouse=True)
+def empty_validator_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(validate_hash_zip, 'RELAXNG_VALIDATORS', {})
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+
+def test_local_schema_is_compiled_once(tmp_path):
+    schema_file = tmp_path / 'any.rng'
+    schema_file.write_bytes(ANY_ELEMENT_RNG)
+    validator = relaxng_validator(str(schema_file), DummyLogger())
+    assert validator.validate(etree.fromstring('<TEI><text a="b">alma</text></TEI>'))
+    assert relaxng_validator(str(schema_file), DummyLogger()) is validator
+    with pytest.raises(SystemExit):
+        relaxng_validator(str(tmp_path / 'missing.rng'), DummyLogger())
+
+
+def test_downloaded_schema_is_cached(monkeypatch, tmp_path):
+    downloads = []
+
+    def urlopen(url, cafile=None):
+        _ = cafile
+        downloads.append(url)
+        return BytesIO(ANY_ELEMENT_RNG)
+
+    monkeypatch.setattr(validate_hash_zip, 'urlopen', urlopen)
+    validator = relaxng_validator(SCHEMA_URL, DummyLogger())
+    assert downloads == [SCHEMA_URL]
+    assert str(schema_cache_dir()).startswith(str(tmp_path))
+
+    def offline_urlopen(url, cafile=None):
+        raise URLError(f'No network: {url} {cafile}')
+
+    # The cached schema is read without network access (and the same content is not compiled again)
+    monkeypatch.setattr(validate_hash_zip, 'urlopen', offline_urlopen)
+    assert relaxng_validator(SCHEMA_URL, DummyLogger()) is validator
+    with pytest.raises(SystemExit):
+        relaxng_validator('https://example.org/other.rng', DummyLogger())
+
+
+@pytest.mark.parametrize('compression', ('stored', 'deflate', 'bzip2', 'lzma'))
+@pytest.mark.parametrize('max_shard_members', (None, 1))
+def test_validated_and_hashed_in_advance_is_equivalent(tmp_path, compression, max_shard_members):
+    schema_file = tmp_path / 'tei_root.rng'
+    schema_file.write_bytes(TEI_ROOT_RNG)
+    outputs = []
+    for in_advance in (False, True):
+        out_dir = tmp_path / str(in_advance)
+        out_dir.mkdir()
+        logger = DummyLogger()
+        writer = ValidatorHasherCompressor(logger, str(out_dir / 'not_valid'), str(out_dir / 'portal'),
+                                           str(out_dir / 'portal.hashsums'), tei_schema=str(schema_file),
+                                           sink_params={'compression': compression,
+                                                        'max_shard_members': max_shard_members})
+        for i, raw_xml_str in enumerate((b'<TEI>alma</TEI>', b'<text>alma</text>', b'<TEI>korte</TEI>')):
+            tei_verdict = None
+            if in_advance:
+                tei_verdict = validate_and_hash_tei(raw_xml_str, writer.tei_check_params, DummyLogger())
+                assert (tei_verdict[0] is None) == (tei_verdict[1] is not None)
+            writer.process_one_file(f'https://example.hu/{i}', f'2020-01-01/{i}', '.xml', raw_xml_str, tei_verdict)
+        writer.close()
+        zipped = {}
+        for shard in sorted(out_dir.glob('portal*.zip')):
+            with ZipFile(shard) as zf:
+                assert zf.testzip() is None
+                zipped[shard.name] = {info.filename: (info.compress_type, zf.read(info)) for info in zf.infolist()}
+        outputs.append((zipped, (out_dir / 'portal.hashsums').read_text(encoding='UTF-8'),
+                        sorted(p.name for p in (out_dir / 'not_valid').iterdir()),
+                        [message for message in logger.messages if message[0] != 'INFO']))
+    assert outputs[0] == outputs[1]
+    zipped, _, not_valid, messages = outputs[0]
+    assert len(zipped) == (1 if max_shard_members is None else 2)
+    assert sum(len(members) for members in zipped.values()) == 2 and not_valid == ['1.xml']
+    assert messages[0][:2] == ('ERROR', 'TEI validation error:')
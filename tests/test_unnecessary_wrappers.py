@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from bs4 import BeautifulSoup
+
+from html2tei.article_body_converters.eltedh_abc import handling_unnecessary_wrappers
+
+from helpers import DummyLogger, read_json_lines, input_gold_pairs
+
+
+def test_handling_unnecessary_wrappers_gold():
+    # The inputs are repeated levels, formatting in formatting and paragraphs in links nested randomly with the tag
+    #  names of the portals and the gold is the output of the original (quadratic) implementation
+    (input_path, gold_path), = input_gold_pairs('unnecessary_wrappers.jsonl')
+    for index, (html, gold) in enumerate(zip(read_json_lines(input_path), read_json_lines(gold_path))):
+        article = BeautifulSoup(f'<article_body_root>{html}</article_body_root>', 'lxml').find('article_body_root')
+        handling_unnecessary_wrappers(article, 'https://example.hu', DummyLogger())
+        assert str(article) == gold, f'ERROR: file: {input_path}; line: {index}'